@@ -2,97 +2,388 @@ import sys
 import json
 import os
 import io
+import multiprocessing
+import shutil
+import time
 import traceback
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from preprocessing_freightrates import FreightTableExtractor
-from extraction import process_main_folder_structure_incremental
+from extraction import EXTRACTION_MAX_WORKERS, process_main_folder_structure_incremental, retry_failed_rows_incremental
+from progress import ProgressReporter, read_json_file, write_json_atomic
+from export_parquet import export_job
+from profiling import profile_job, write_stage_report
+from tracing import Tracer, tracing_enabled
+from shared_pool import FairExecutor
+from model_router import ModelRouter, routing_enabled
+from hedging import HedgedCaller, hedging_enabled
+from work_queue import distributed_enabled, process_main_folder_distributed
+from surcharges import SurchargeStage, surcharges_enabled
+from sheet_cache import warm_workbook
+from preprocess_cache import preprocess_cache_enabled, preprocess_cache_key, restore_preprocessed, store_preprocessed
+from workbook_inspector import file_sha256
 
+# Batch mode: workbooks preprocessed in parallel processes, then every row of
+# every workbook goes through one shared pool of Bedrock calls
+BATCH_MAX_CONCURRENT_CALLS = int(os.getenv("BATCH_MAX_CONCURRENT_CALLS", str(2 * EXTRACTION_MAX_WORKERS)))
+BATCH_MAX_REQUESTS_PER_SECOND = float(os.getenv("BATCH_MAX_REQUESTS_PER_SECOND", "0"))
+BATCH_PREPROCESS_WORKERS = int(os.getenv("BATCH_PREPROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+BATCH_REPORT_INTERVAL = 2.0
 
-# Set UTF-8 encoding to handle Unicode characters (emojis, special chars)
-os.environ['PYTHONIOENCODING'] = 'utf-8'
-if hasattr(sys.stdout, 'buffer'):
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-if hasattr(sys.stderr, 'buffer'):
-    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
+def configure_utf8_stdio():
+    # Set UTF-8 encoding to handle Unicode characters (emojis, special chars)
+    os.environ['PYTHONIOENCODING'] = 'utf-8'
+    if hasattr(sys.stdout, 'buffer'):
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    if hasattr(sys.stderr, 'buffer'):
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
 
-def main():
+
+def get_extraction_prompt_path():
+    # Check for custom prompt file first, fallback to default
+    custom_prompt_file = 'custom_prompt.txt'
+    default_prompt_file = 'f9.txt'
+    
+    if os.path.exists(custom_prompt_file):
+        return custom_prompt_file
+    return default_prompt_file
+
+
+def retry_failures(file_stem, status_file):
+    """Re-extract only the failed rows of a finished job and splice them back"""
+    write_json_atomic(status_file, {"status": "processing", "step": "retry"})
+    progress = ProgressReporter(f"{file_stem}_progress.json")
+    progress.set_step("retry")
+
+    main_folder = f"temp_inputfiles/{file_stem}_processed"
+    output_main_folder = f"{file_stem}_processed_output"
+    if not os.path.exists(main_folder):
+        raise FileNotFoundError(f"Preprocessed input folder not found: {main_folder}")
+
+    failed = retry_failed_rows_incremental(
+        main_folder_path=main_folder,
+        extraction_prompt_path=get_extraction_prompt_path(),
+        context_filter_prompt_path="context.txt",
+        progress=progress
+    )
+    progress.flush(force=True)
+    retried = sum(len(rows) for rows in failed.values())
+
+    # Refresh the Parquet exports and the download archive with the spliced rows
+    if retried:
+        write_json_atomic(status_file, {"status": "processing", "step": "export"})
+        export_job(output_main_folder)
+
+    write_json_atomic(status_file, {
+        "status": "completed",
+        "output_folder": output_main_folder,
+        "message": f"Retried {retried} failed row(s)."
+    })
+
+
+def preprocess_job(params):
+    """Preprocessing step of a job: split the workbook into per-sheet freight and context files"""
+    file_stem = params['file_stem']
+    custom_terms = params['custom_terms']
+    # Optional profiler for preprocessing: None, "cprofile" or "sampling"
+    profile_mode = params.get('profile')
+    output_main_folder = f"{file_stem}_processed_output"
+
+    # Write status file to indicate processing started
+    write_json_atomic(f"{file_stem}_status.json", {"status": "processing", "step": "preprocessing"})
+    progress = ProgressReporter(f"{file_stem}_progress.json")
+    progress.set_step("preprocessing")
+
+    file_path = params['file_path']
+    processed_folder = os.path.join(os.path.dirname(file_path),
+                                    f"{os.path.splitext(os.path.basename(file_path))[0]}_processed")
+
+    # Same workbook bytes, ignored sheets and custom terms as an earlier job: reuse its outputs
+    # (see preprocess_cache.py). Profiled runs always preprocess.
+    cache_key = None
+    if preprocess_cache_enabled(params.get('preprocess_cache')) and not profile_mode:
+        cache_key = preprocess_cache_key(file_sha256(file_path), params['ignored_sheets'], custom_terms)
+        if restore_preprocessed(cache_key, processed_folder):
+            print(f"♻️ Reusing preprocessed outputs {cache_key} for {file_path}")
+            return
+    # Sheets of an earlier run with other choices must not linger
+    shutil.rmtree(processed_folder, ignore_errors=True)
+
+    # Preprocessing freightrates
+    extractor = FreightTableExtractor(
+        ignored_sheets=params['ignored_sheets'],
+        custom_terms=custom_terms if any(custom_terms.values()) else None,
+        streaming=params.get('streaming')
+    )
+    with profile_job(profile_mode, output_main_folder):
+        # Reuses the sheet plan shown in the UI unless the workbook changed since
+        extractor.process_excel_file(file_path, sheet_plan=params.get('sheet_plan'))
+    write_stage_report(extractor.timer, output_main_folder)
+    if cache_key is not None:
+        store_preprocessed(cache_key, processed_folder, {
+            "file_name": os.path.basename(file_path),
+            "ignored_sheets": params['ignored_sheets'],
+            "custom_terms": custom_terms,
+        })
+
+
+def extract_job(params, executor=None):
+    """Extraction and export steps of a job whose workbook has been preprocessed.
+
+    `executor` runs the model calls; batch jobs pass their shared pool.
+    """
+    file_stem = params['file_stem']
+    main_folder = f"temp_inputfiles/{file_stem}_processed"
+    output_main_folder = f"{file_stem}_processed_output"
+
+    # Update status
+    status_file = f"{file_stem}_status.json"
+    write_json_atomic(status_file, {"status": "processing", "step": "extraction"})
+    progress = ProgressReporter(f"{file_stem}_progress.json")
+    progress.set_step("extraction")
+
+    # Extraction
+    extraction_prompt_path = get_extraction_prompt_path()
+    context_filter_prompt_path = "context.txt"
+
+    # Per-row lifecycle spans, written to {output_main_folder}/_trace/
+    tracer = Tracer.for_output_folder(output_main_folder) if tracing_enabled(params.get('trace')) else None
+    # Cheap model first, escalating rows that fail validation; stats in routing_stats.json
+    router = ModelRouter() if routing_enabled(params.get('routing')) else None
+    # Duplicate calls that run past the observed p95 latency; stats in hedging_stats.json
+    hedger = HedgedCaller() if hedging_enabled(params.get('hedge')) else None
+
+    # One pool for the whole job, so freight rows and surcharge chunks share the concurrency budget
+    job_pool = nullcontext(executor) if executor is not None else ThreadPoolExecutor(max_workers=EXTRACTION_MAX_WORKERS)
+
+    # Process the main folder structure with incremental writing
     try:
-        # Read parameters from JSON file passed as command line argument
-        params_file = sys.argv[1]
-        
-        with open(params_file, 'r', encoding='utf-8') as f:
-            params = json.load(f)
-        
-        # Extract parameters
-        file_path = params['file_path']
-        ignored_sheets = params['ignored_sheets']
-        custom_terms = params['custom_terms']
-        file_stem = params['file_stem']
-        
-        # Write status file to indicate processing started
-        status_file = f"{file_stem}_status.json"
-        with open(status_file, 'w', encoding='utf-8') as f:
-            json.dump({"status": "processing", "step": "preprocessing"}, f, ensure_ascii=False)
+        with job_pool as job_executor:
+            # Surcharge sheets are extracted in the background, alongside the freight rows
+            surcharge_stage = None
+            if surcharges_enabled(params.get('surcharges')):
+                surcharge_stage = SurchargeStage(main_folder, output_main_folder, job_executor).start()
+            if distributed_enabled(params.get('distributed')):
+                # Rows go through the shared work queue, so workers on other nodes can help
+                process_main_folder_distributed(
+                    main_folder_path=main_folder,
+                    extraction_prompt_path=extraction_prompt_path,
+                    context_filter_prompt_path=context_filter_prompt_path,
+                    progress=progress,
+                    tracer=tracer,
+                    incremental=params.get('incremental'),
+                    executor=job_executor,
+                    router=router,
+                    hedger=hedger
+                )
+            else:
+                process_main_folder_structure_incremental(
+                    main_folder_path=main_folder,
+                    extraction_prompt_path=extraction_prompt_path,
+                    context_filter_prompt_path=context_filter_prompt_path,
+                    progress=progress,
+                    tracer=tracer,
+                    # Unchanged rows of an earlier version of this ratesheet are carried over
+                    incremental=params.get('incremental'),
+                    executor=job_executor,
+                    router=router,
+                    hedger=hedger
+                )
+            if surcharge_stage is not None:
+                surcharge_stage.join()
+    finally:
+        if tracer is not None:
+            tracer.close()
+        if router is not None:
+            router.write_stats(output_main_folder)
+        if hedger is not None:
+            hedger.write_stats(output_main_folder)
+            hedger.shutdown()
+    progress.flush(force=True)
 
-        
-        # Preprocessing freightrates
-        extractor = FreightTableExtractor(
-            ignored_sheets=ignored_sheets,
-            custom_terms=custom_terms if any(custom_terms.values()) else None
-        )
-        extractor.process_excel_file(file_path)
-        
-        # Update status
-        with open(status_file, 'w', encoding='utf-8') as f:
-            json.dump({"status": "processing", "step": "extraction"}, f, ensure_ascii=False)
+    # Export typed Parquet files and a zip of all artifacts
+    write_json_atomic(status_file, {"status": "processing", "step": "export"})
+    progress.set_step("export")
+    export_job(output_main_folder)
 
+    # Write success status
+    write_json_atomic(status_file, {
+        "status": "completed",
+        "output_folder": output_main_folder,
+        "message": "Processing completed successfully!"
+    })
+
+
+def write_error_status(file_stem):
+    """Record the exception being handled in `{file_stem}_status.json`"""
+    write_json_atomic(f"{file_stem}_status.json", {
+        "status": "error",
+        "error": str(sys.exc_info()[1]),
+        "traceback": traceback.format_exc()
+    })
+
+
+def preprocess_in_subprocess(params):
+    """Batch preprocessing worker; failures are reported in the workbook's status file"""
+    try:
+        preprocess_job(params)
+        return True
+    except Exception:
+        write_error_status(params['file_stem'])
+        return False
+
+
+def extract_in_batch(params, executor):
+    try:
+        extract_job(params, executor=executor)
+        return True
+    except Exception:
+        write_error_status(params['file_stem'])
+        return False
+
+
+def write_batch_report(batch_id, jobs, results, pool, status="processing"):
+    """`{batch_id}_batch.json`: status and row progress of every workbook plus the shared pool"""
+    workbooks = {}
+    for job in jobs:
+        file_stem = job['file_stem']
+        job_status = read_json_file(f"{file_stem}_status.json") or {"status": "queued"}
+        progress = read_json_file(f"{file_stem}_progress.json") or {}
+        workbooks[file_stem] = {
+            "status": job_status.get("status"),
+            "step": job_status.get("step"),
+            "rows_total": progress.get("rows_total", 0),
+            "rows_done": progress.get("rows_done", 0),
+            "rows_failed": progress.get("rows_failed", 0),
+            "eta_seconds": progress.get("eta_seconds"),
+        }
+    write_json_atomic(f"{batch_id}_batch.json", {
+        "batch_id": batch_id,
+        "status": status,
+        "updated_at": time.time(),
+        "succeeded": sum(1 for ok in results.values() if ok),
+        "failed": sum(1 for ok in results.values() if not ok),
+        "workbooks": workbooks,
+        "pool": {"max_concurrent_calls": pool.max_workers, "tenants": pool.stats()},
+    })
+
+
+def run_batch(params):
+    """Run many workbooks as one job.
+
+    `params["jobs"]` is a list of single-job params. Workbooks are preprocessed
+    in parallel processes; as each one finishes, its extraction starts on the
+    batch's shared FairExecutor, which serves the workbooks round-robin within
+    one concurrency (and optional request rate) budget. Every workbook keeps its
+    own status, progress and output files. Returns True if all of them succeeded.
+    """
+    jobs = params['jobs']
+    batch_id = params.get('batch_id') or f"batch_{int(time.time())}"
+    pool = FairExecutor(
+        params.get('max_concurrent_calls') or BATCH_MAX_CONCURRENT_CALLS,
+        max_rate=params.get('max_requests_per_second') or BATCH_MAX_REQUESTS_PER_SECOND,
+        name="batch-bedrock"
+    )
+    results = {}
+    print(f"📦 Batch {batch_id}: {len(jobs)} workbook(s), {pool.max_workers} concurrent model calls")
+    try:
+        # Spawned (not forked) workers: a job runs its model calls in threads
+        with ProcessPoolExecutor(max_workers=max(1, min(BATCH_PREPROCESS_WORKERS, len(jobs))),
+                                 mp_context=multiprocessing.get_context("spawn")) as preprocessors, \
+                ThreadPoolExecutor(max_workers=max(1, len(jobs)), thread_name_prefix="batch-workbook") as workbooks:
+            futures = {preprocessors.submit(preprocess_in_subprocess, job): ("preprocessing", job) for job in jobs}
+            while futures:
+                done, _ = wait(futures, timeout=BATCH_REPORT_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    step, job = futures.pop(future)
+                    file_stem = job['file_stem']
+                    try:
+                        ok = future.result()
+                    except Exception:
+                        # e.g. a preprocessing process that died
+                        write_error_status(file_stem)
+                        ok = False
+                    if step == "preprocessing" and ok:
+                        executor = pool.for_tenant(file_stem)
+                        futures[workbooks.submit(extract_in_batch, job, executor)] = ("extraction", job)
+                    else:
+                        results[file_stem] = ok
+                        print(f"{'✅' if ok else '❌'} {file_stem} finished ({step})")
+                write_batch_report(batch_id, jobs, results, pool)
+    finally:
+        pool.shutdown()
+    ok = all(results.get(job['file_stem']) for job in jobs)
+    write_batch_report(batch_id, jobs, results, pool, status="completed" if ok else "completed_with_errors")
+    return ok
+
+
+def batch_params(file_paths):
+    """Batch params with default options for a list of workbook paths"""
+    return {
+        'mode': 'batch',
+        'jobs': [
+            {
+                'file_path': path,
+                'file_stem': os.path.splitext(os.path.basename(path))[0],
+                'ignored_sheets': [],
+                'custom_terms': {},
+            }
+            for path in file_paths
+        ],
+    }
+
+
+def run_job(params):
+    """Run one preprocessing + extraction job described by `params`.
+
+    Progress and errors are reported through `{file_stem}_status.json`.
+    Returns True on success, False if the job failed.
+    """
+    if params.get('mode') == 'warm':
+        # Speculative parsing of a just-uploaded workbook; it has no status file
+        # and a failure only means preprocessing parses the sheets itself
+        try:
+            warm_workbook(params['file_path'])
+            return True
+        except Exception:
+            traceback.print_exc()
+            return False
+    try:
+        if params.get('mode') == 'retry_failures':
+            file_stem = params['file_stem']
+            retry_failures(file_stem, f"{file_stem}_status.json")
+            return True
+        if params.get('mode') == 'batch':
+            return run_batch(params)
+
+        preprocess_job(params)
+        extract_job(params)
+        return True
         
-        # Extraction
-        main_folder = f"temp_inputfiles/{file_stem}_processed"
-        output_main_folder = f"{file_stem}_processed_output"
-        
-        # Check for custom prompt file first, fallback to default
-        custom_prompt_file = 'custom_prompt.txt'
-        default_prompt_file = 'f9.txt'
-        
-        if os.path.exists(custom_prompt_file):
-            extraction_prompt_path = custom_prompt_file
-        else:
-            extraction_prompt_path = default_prompt_file
-        
-        context_filter_prompt_path = "context.txt"
-        
-        # Process the main folder structure with incremental writing
-        process_main_folder_structure_incremental(
-            main_folder_path=main_folder,
-            extraction_prompt_path=extraction_prompt_path,
-            context_filter_prompt_path=context_filter_prompt_path
-        )
-        
-        # Write success status
-        with open(status_file, 'w', encoding='utf-8') as f:
-            json.dump({
-                "status": "completed", 
-                "output_folder": output_main_folder,
-                "message": "Processing completed successfully!"
-            }, f, ensure_ascii=False)
-        
-    except Exception as e:
-        # Write error status
-        error_msg = str(e)
-        error_traceback = traceback.format_exc()
-        
-        status_file = f"{params.get('file_stem', 'unknown')}_status.json"
-        with open(status_file, 'w', encoding='utf-8') as f:
-            json.dump({
-                "status": "error",
-                "error": error_msg,
-                "traceback": error_traceback
-            }, f, ensure_ascii=False)
+    except Exception:
+        write_error_status(params.get('file_stem') or params.get('batch_id', 'unknown'))
+        return False
 
+
+def main():
+    # Read parameters from JSON file passed as command line argument,
+    # or retry a previous job with: background_processor.py --retry-failures <file_stem>
+    # or run many workbooks as one batch: background_processor.py --batch a.xlsx b.xlsx ...
+    if sys.argv[1] == '--retry-failures':
+        params = {'mode': 'retry_failures', 'file_stem': sys.argv[2]}
+    elif sys.argv[1] == '--batch':
+        params = batch_params(sys.argv[2:])
+    else:
+        params_file = sys.argv[1]
         
+        with open(params_file, 'r', encoding='utf-8') as f:
+            params = json.load(f)
+
+    if not run_job(params):
         # Exit with error code
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    configure_utf8_stdio()
+    main()
@@ -0,0 +1,147 @@
+"""End-to-end extraction throughput benchmark against the local Bedrock stand-in.
+
+Generates a seeded ratesheet, preprocesses it, then runs
+process_main_folder_structure_incremental with the fake LLM backend (or a
+replay of a real recording), so concurrency, throttling and writer
+contention can be load-tested offline.
+
+    python benchmarks/bench_extraction_e2e.py
+    python benchmarks/bench_extraction_e2e.py --latency lognormal:1200:0.8 --throttle-rate 0.05 --workers 10
+    python benchmarks/bench_extraction_e2e.py --replay llm_recording.jsonl
+    python benchmarks/bench_extraction_e2e.py --scenario heavy_tail --hedge
+    python benchmarks/bench_extraction_e2e.py --save | --compare
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import warnings
+
+from common import REPO_ROOT, compare_to_baseline, save_baseline
+from ratesheet_generator import generate_ratesheet
+
+logging.disable(logging.INFO)
+warnings.filterwarnings("ignore", category=FutureWarning)
+
+import extraction
+from hedging import HedgedCaller
+from llm_backends import FakeBackend, ReplayBackend, set_llm_backend
+from preprocessing_freightrates import FreightTableExtractor
+from progress import ProgressReporter
+from tracing import Tracer, summarize_trace
+
+SCENARIOS = {
+    "baseline": dict(seed=11, sheets=2, rows=150, latency="lognormal:200:0.5", throttle_rate=0.0),
+    "heavy_tail": dict(seed=12, sheets=2, rows=150, latency="lognormal:200:1.2", throttle_rate=0.0),
+    "throttled": dict(seed=13, sheets=2, rows=150, latency="lognormal:200:0.5", throttle_rate=0.05),
+}
+
+
+def run_scenario(name, options, workers, replay_path=None, keep=False, trace=False, hedge=False):
+    work_dir = tempfile.mkdtemp(prefix=f"bench_e2e_{name}_")
+    cwd = os.getcwd()
+    try:
+        os.chdir(work_dir)
+        os.makedirs("temp_inputfiles", exist_ok=True)
+        workbook = generate_ratesheet(os.path.join("temp_inputfiles", f"{name}.xlsx"),
+                                      seed=options["seed"], sheets=options["sheets"], rows=options["rows"])
+        FreightTableExtractor(ignored_sheets=[]).process_excel_file(workbook)
+
+        if replay_path:
+            backend = ReplayBackend(os.path.join(cwd, replay_path), replay_latency=True)
+        else:
+            backend = FakeBackend(latency=options["latency"], throttle_rate=options["throttle_rate"],
+                                  seed=options["seed"])
+        set_llm_backend(backend)
+        extraction.EXTRACTION_MAX_WORKERS = workers
+
+        progress = ProgressReporter("bench_progress.json")
+        tracer = Tracer.for_output_folder(f"{name}_processed_output") if trace else None
+        hedger = HedgedCaller() if hedge else None
+        t0 = time.perf_counter()
+        sys.stdout = open(os.devnull, "w", encoding="utf-8")  # extraction prints a line per row
+        try:
+            extraction.process_main_folder_structure_incremental(
+                main_folder_path=os.path.join("temp_inputfiles", f"{name}_processed"),
+                extraction_prompt_path=os.path.join(REPO_ROOT, "f9.txt"),
+                context_filter_prompt_path=os.path.join(REPO_ROOT, "context.txt"),
+                progress=progress,
+                tracer=tracer,
+                hedger=hedger,
+            )
+        finally:
+            if tracer is not None:
+                tracer.close()
+            if hedger is not None:
+                hedger.shutdown()
+            sys.stdout.close()
+            sys.stdout = sys.__stdout__
+        seconds = time.perf_counter() - t0
+
+        snapshot = progress.snapshot()
+        failed = extraction.collect_failed_rows(f"{name}_processed_output")
+        if tracer is not None:
+            trace_summary = summarize_trace(tracer.path)
+            print(json.dumps({name: trace_summary["phases_ms"]}, indent=2), file=sys.stderr)
+        return {
+            "seconds": seconds,
+            "rows": snapshot["rows_done"],
+            "rows_per_second": snapshot["rows_done"] / seconds if seconds else None,
+            "failed_rows": sum(len(v) for v in failed.values()),
+            "calls": getattr(backend, "calls", None),
+            "throttled": getattr(backend, "throttled", None),
+            "workers": workers,
+            "hedges": hedger.stats()["hedges"] if hedger is not None else None,
+        }
+    finally:
+        set_llm_backend(None)
+        os.chdir(cwd)
+        if keep:
+            print(f"📁 Kept work dir {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS))
+    parser.add_argument("--workers", type=int, default=extraction.EXTRACTION_MAX_WORKERS)
+    parser.add_argument("--latency", help="override the latency spec of every scenario")
+    parser.add_argument("--throttle-rate", type=float, help="override the throttle rate of every scenario")
+    parser.add_argument("--rows", type=int, help="override the rows per sheet of every scenario")
+    parser.add_argument("--replay", help="replay a recording made with LLM_BACKEND=record instead of faking")
+    parser.add_argument("--trace", action="store_true", help="trace every row and print per-phase percentiles")
+    parser.add_argument("--hedge", action="store_true", help="hedge calls slower than the rolling p95")
+    parser.add_argument("--keep", action="store_true", help="keep the generated work directories")
+    parser.add_argument("--save", action="store_true", help="write results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="compare against the saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = {}
+    for name in args.scenario or list(SCENARIOS):
+        options = dict(SCENARIOS[name])
+        for key in ("latency", "throttle_rate", "rows"):
+            if getattr(args, key) is not None:
+                options[key] = getattr(args, key)
+        print(f"⏱️ {name}...", file=sys.stderr)
+        results[name] = {"end_to_end": run_scenario(name, options, args.workers, args.replay, args.keep,
+                                                              args.trace, args.hedge)}
+
+    print(json.dumps(results, indent=2))
+    if args.save:
+        save_baseline("extraction_e2e", results)
+    if args.compare:
+        regressions = compare_to_baseline("extraction_e2e", results, ["seconds"], args.tolerance)
+        if regressions:
+            print("❌ Extraction regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("✅ Extraction within baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Import-time benchmark guarding Streamlit session start-up.
+
+Each measurement runs in a fresh interpreter so nothing is cached between
+runs. `frontend2` is imported in Streamlit's bare mode (no server), which
+executes the script top to bottom the same way a new session does.
+
+    python benchmarks/bench_import_time.py            # print results
+    python benchmarks/bench_import_time.py --save     # write the baseline
+    python benchmarks/bench_import_time.py --check    # fail on regression
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(REPO_ROOT, "benchmarks", "baselines", "import_time.json")
+
+# Modules that must not be loaded just by opening the app / importing extraction
+FRONTEND_FORBIDDEN = ["pandas", "openpyxl", "boto3", "botocore", "thefuzz",
+                      "extraction", "preprocessing_freightrates"]
+EXTRACTION_FORBIDDEN = ["boto3", "botocore"]
+
+SNIPPET = """
+import json, logging, sys, time, warnings
+warnings.filterwarnings("ignore")
+logging.disable(logging.CRITICAL)
+t0 = time.perf_counter()
+import streamlit
+t1 = time.perf_counter()
+import {module}
+t2 = time.perf_counter()
+print(json.dumps({{"streamlit": t1 - t0, "module": t2 - t1,
+                  "loaded": sorted(m for m in {forbidden!r} if m in sys.modules)}}))
+"""
+
+TARGETS = {
+    "frontend2": FRONTEND_FORBIDDEN,
+    "extraction": EXTRACTION_FORBIDDEN,
+}
+
+
+def measure(module, forbidden, repeat):
+    samples, loaded = [], set()
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", SNIPPET.format(module=module, forbidden=forbidden)],
+            cwd=REPO_ROOT, capture_output=True, text=True,
+            env={**os.environ, "AWS_REGION": os.environ.get("AWS_REGION", "us-east-1")},
+        )
+        if out.returncode != 0:
+            raise RuntimeError(f"importing {module} failed:\n{out.stderr}")
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        samples.append(result["module"])
+        loaded.update(result["loaded"])
+    return {
+        "median_seconds": statistics.median(samples),
+        "min_seconds": min(samples),
+        "forbidden_loaded": sorted(loaded),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", action="store_true", help="write results as the new baseline")
+    parser.add_argument("--check", action="store_true", help="compare against the saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed relative slowdown over the baseline (default 50%%)")
+    parser.add_argument("--slack", type=float, default=0.05,
+                        help="absolute slack in seconds added to the allowed time")
+    args = parser.parse_args()
+
+    results = {name: measure(name, forbidden, args.repeat) for name, forbidden in TARGETS.items()}
+    print(json.dumps(results, indent=2))
+
+    if args.save:
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Baseline saved to {BASELINE_PATH}")
+
+    if args.check:
+        with open(BASELINE_PATH, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        failures = []
+        for name, result in results.items():
+            if result["forbidden_loaded"]:
+                failures.append(f"{name} loads {', '.join(result['forbidden_loaded'])}")
+            allowed = baseline[name]["median_seconds"] * (1 + args.tolerance) + args.slack
+            if result["median_seconds"] > allowed:
+                failures.append(f"{name} import took {result['median_seconds']:.3f}s (allowed {allowed:.3f}s)")
+        if failures:
+            print("❌ Import-time regression:\n  " + "\n  ".join(failures))
+            sys.exit(1)
+        print("✅ Import times within baseline")
+
+
+if __name__ == "__main__":
+    main()
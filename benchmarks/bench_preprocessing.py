@@ -0,0 +1,162 @@
+"""Benchmark suite for FreightTableExtractor on synthetic ratesheets.
+
+Every scenario generates a seeded workbook (see ratesheet_generator.py) and
+times each preprocessing stage per freight sheet, plus the end-to-end
+process_excel_file. Timings come from plain runs; peak memory comes from a
+separate tracemalloc run so tracing overhead does not skew the timings.
+
+    python benchmarks/bench_preprocessing.py                    # default scenarios
+    python benchmarks/bench_preprocessing.py --scenario large   # slow: several minutes
+    python benchmarks/bench_preprocessing.py --save             # write baseline
+    python benchmarks/bench_preprocessing.py --compare          # fail on regression
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+from common import compare_to_baseline, save_baseline
+from ratesheet_generator import generate_ratesheet
+
+import logging
+logging.disable(logging.INFO)
+warnings.filterwarnings("ignore", category=FutureWarning)
+
+from preprocessing_freightrates import FreightTableExtractor
+
+SCENARIOS = {
+    "small": dict(seed=1, sheets=2, rows=200, header_levels=2, banner_rows=3, noise=0.05),
+    "medium": dict(seed=2, sheets=4, rows=2000, header_levels=2, banner_rows=4, noise=0.05),
+    "wide_headers": dict(seed=3, sheets=2, rows=1000, header_levels=3, banner_rows=5, noise=0.1),
+    "large": dict(seed=4, sheets=2, rows=10000, header_levels=2, banner_rows=3, noise=0.02,
+                  freetime_sheets=2, rule_sheets=2, surcharge_sheets=2),
+}
+DEFAULT_SCENARIOS = ["small", "medium", "wide_headers"]
+STAGES = ["load_and_unmerge", "detect_header_row", "detect_table_end", "to_excel"]
+
+
+def run_stages(extractor, workbook_path, sheet, out_dir, measure_memory):
+    """Run the per-sheet pipeline once; returns {stage: seconds or peak bytes}"""
+    results = {}
+
+    def stage(name, fn):
+        if measure_memory:
+            tracemalloc.start()
+            value = fn()
+            results[name] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            t0 = time.perf_counter()
+            value = fn()
+            results[name] = time.perf_counter() - t0
+        return value
+
+    df = stage("load_and_unmerge", lambda: extractor.load_and_unmerge(workbook_path, sheet))
+    hdr = stage("detect_header_row", lambda: extractor.detect_header_row(df))
+    if hdr is None:
+        return results
+    start = hdr + 1
+    end = stage("detect_table_end", lambda: extractor.detect_table_end(df, start, lookback=8))
+    cols = extractor.merge_multi_level_headers(df, hdr)
+    tbl = df.iloc[start:end].copy()
+    tbl.columns = cols[:len(tbl.columns)]
+    freight = extractor.clean_table(tbl)
+    stage("to_excel", lambda: freight.to_excel(os.path.join(out_dir, "bench_freight_table.xlsx"), index=False))
+    return results
+
+
+def run_end_to_end(workbook_path, measure_memory):
+    work_dir = tempfile.mkdtemp(prefix="bench_e2e_")
+    try:
+        path = shutil.copy(workbook_path, work_dir)
+        extractor = FreightTableExtractor(ignored_sheets=[])
+        if measure_memory:
+            tracemalloc.start()
+            extractor.process_excel_file(path)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            return peak
+        t0 = time.perf_counter()
+        extractor.process_excel_file(path)
+        return time.perf_counter() - t0
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_scenario(name, options, repeat, cache_dir):
+    workbook_path = os.path.join(cache_dir, f"{name}_{options['seed']}.xlsx")
+    if not os.path.exists(workbook_path):
+        generate_ratesheet(workbook_path, **options)
+
+    extractor = FreightTableExtractor(ignored_sheets=[])
+    freight_sheets = [s["name"] for s in extractor.plan_sheets(workbook_path) if s["label"] == "freight"]
+
+    timings = {stage: [] for stage in STAGES + ["process_excel_file"]}
+    peaks = {stage: 0 for stage in STAGES + ["process_excel_file"]}
+    with tempfile.TemporaryDirectory(prefix="bench_stage_") as out_dir:
+        for _ in range(repeat):
+            totals = dict.fromkeys(STAGES, 0.0)
+            for sheet in freight_sheets:
+                for stage, seconds in run_stages(extractor, workbook_path, sheet, out_dir, False).items():
+                    totals[stage] += seconds
+            for stage in STAGES:
+                timings[stage].append(totals[stage])
+            timings["process_excel_file"].append(run_end_to_end(workbook_path, False))
+
+        for sheet in freight_sheets:
+            for stage, peak in run_stages(extractor, workbook_path, sheet, out_dir, True).items():
+                peaks[stage] = max(peaks[stage], peak)
+        peaks["process_excel_file"] = run_end_to_end(workbook_path, True)
+
+    return {
+        stage: {
+            "median_seconds": statistics.median(timings[stage]) if timings[stage] else None,
+            "min_seconds": min(timings[stage]) if timings[stage] else None,
+            "peak_mb": peaks[stage] / (1024 * 1024),
+        }
+        for stage in timings
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable, default: %s)" % ", ".join(DEFAULT_SCENARIOS))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--cache-dir", default=os.path.join(tempfile.gettempdir(), "freightify_bench"),
+                        help="where generated workbooks are kept between runs")
+    parser.add_argument("--output", help="also write the results JSON here")
+    parser.add_argument("--save", action="store_true", help="write results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="compare against the saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed relative regression (default 25%%)")
+    args = parser.parse_args()
+
+    os.makedirs(args.cache_dir, exist_ok=True)
+    results = {}
+    for name in args.scenario or DEFAULT_SCENARIOS:
+        print(f"⏱️ {name}...", file=sys.stderr)
+        results[name] = run_scenario(name, SCENARIOS[name], args.repeat, args.cache_dir)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.save:
+        save_baseline("preprocessing", results)
+    if args.compare:
+        regressions = compare_to_baseline("preprocessing", results, ["median_seconds", "peak_mb"], args.tolerance)
+        if regressions:
+            print("❌ Preprocessing regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("✅ Preprocessing within baseline")
+
+
+if __name__ == "__main__":
+    main()
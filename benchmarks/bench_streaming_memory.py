@@ -0,0 +1,103 @@
+"""Peak memory of preprocessing and extraction as the freight table grows.
+
+Runs process_excel_file in classic and streaming mode, then streams the
+resulting freight table through the extraction dispatcher against the fake
+LLM backend, for increasing row counts. In streaming mode the peak should
+stay roughly flat; in classic mode it grows with the sheet.
+
+    python benchmarks/bench_streaming_memory.py
+    python benchmarks/bench_streaming_memory.py --rows 5000 20000 50000
+    python benchmarks/bench_streaming_memory.py --compare
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+from common import compare_to_baseline, save_baseline
+from ratesheet_generator import generate_ratesheet
+
+logging.disable(logging.INFO)
+warnings.filterwarnings("ignore", category=FutureWarning)
+
+import extraction
+from llm_backends import FakeBackend, set_llm_backend
+from preprocessing_freightrates import FreightTableExtractor
+
+DEFAULT_ROWS = [2000, 8000]
+
+
+def measure(fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    value = fn()
+    seconds = time.perf_counter() - t0
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return value, {"seconds": seconds, "peak_mb": peak / 2**20}
+
+
+def extract_rows(freight_file):
+    """Push every row through the bounded dispatcher; returns the number of rows"""
+    done = 0
+    with extraction.ThreadPoolExecutor(max_workers=extraction.EXTRACTION_MAX_WORKERS) as executor:
+        tasks = ((idx, extraction.call_nova_pro_converse_cached, "prompt", row_csv)
+                 for idx, row_csv in extraction.iter_freight_rows(freight_file))
+        for _, future in extraction.iter_bounded_completions(executor, tasks):
+            future.result()
+            done += 1
+    return done
+
+
+def run(rows, streaming, work_dir):
+    path = os.path.join(work_dir, f"wb_{rows}_{streaming}.xlsx")
+    shutil.copy(os.path.join(work_dir, f"wb_{rows}.xlsx"), path)
+    extractor = FreightTableExtractor(ignored_sheets=[], streaming=streaming)
+    _, preprocessing = measure(lambda: extractor.process_excel_file(path))
+    freight_file = sorted(glob.glob(os.path.join(work_dir, f"wb_{rows}_{streaming}_processed", "*", "*_freight_table.xlsx")))[0]
+    extracted, extraction_stats = measure(lambda: extract_rows(freight_file))
+    return {"preprocessing": preprocessing, "extraction": dict(extraction_stats, rows=extracted)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=DEFAULT_ROWS)
+    parser.add_argument("--save", action="store_true", help="write results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="compare against the saved baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    set_llm_backend(FakeBackend(latency="fixed:0", seed=0))
+    work_dir = tempfile.mkdtemp(prefix="bench_streaming_")
+    results = {}
+    try:
+        for rows in args.rows:
+            generate_ratesheet(os.path.join(work_dir, f"wb_{rows}.xlsx"), seed=rows, sheets=1, rows=rows)
+            for streaming in (False, True):
+                name = f"{'streaming' if streaming else 'classic'}_{rows}"
+                print(f"⏱️ {name}...", file=sys.stderr)
+                results[name] = run(rows, streaming, work_dir)
+    finally:
+        set_llm_backend(None)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(json.dumps(results, indent=2))
+    if args.save:
+        save_baseline("streaming_memory", results)
+    if args.compare:
+        regressions = compare_to_baseline("streaming_memory", results, ["seconds", "peak_mb"], args.tolerance)
+        if regressions:
+            print("❌ Streaming regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("✅ Streaming within baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Shared helpers for the benchmark scripts: repo path setup and JSON baselines."""
+import json
+import os
+import platform
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(REPO_ROOT, "benchmarks", "baselines")
+
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def save_baseline(name, results):
+    """Write results, with a little machine metadata, as the baseline `name`"""
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    payload = {
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    with open(baseline_path(name), "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
+    print(f"💾 Baseline saved to {baseline_path(name)}")
+
+
+def compare_to_baseline(name, results, metrics, tolerance):
+    """Compare nested {scenario: {stage: {metric: value}}} results against the baseline.
+
+    Returns a list of human-readable regressions where a metric grew by more
+    than `tolerance` (relative) over the baseline value.
+    """
+    with open(baseline_path(name), "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    regressions = []
+    for scenario, stages in results.items():
+        for stage, values in stages.items():
+            reference = baseline.get(scenario, {}).get(stage)
+            if not reference:
+                continue
+            for metric in metrics:
+                old, new = reference.get(metric), values.get(metric)
+                if old and new is not None and new > old * (1 + tolerance):
+                    regressions.append(f"{scenario}/{stage} {metric}: {old:.4g} -> {new:.4g} (+{(new / old - 1) * 100:.0f}%)")
+    return regressions
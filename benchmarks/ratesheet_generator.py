@@ -0,0 +1,191 @@
+"""Seeded generator of realistic carrier ratesheet workbooks.
+
+The same seed and options always produce the same workbook, so benchmark
+runs are comparable across machines and commits.
+
+    python benchmarks/ratesheet_generator.py out.xlsx --rows 2000 --sheets 4 --seed 7
+"""
+import argparse
+import random
+from datetime import date, timedelta
+
+import openpyxl
+from openpyxl.styles import Font
+
+CARRIERS = ["MSC", "Maersk", "CMA CGM", "COSCO", "Hapag-Lloyd", "ONE", "Evergreen", "HMM", "ZIM", "Yang Ming"]
+PORTS = [
+    ("INNSA", "Nhava Sheva"), ("INMUN", "Mundra"), ("CNSHA", "Shanghai"), ("CNNGB", "Ningbo"),
+    ("SGSIN", "Singapore"), ("DEHAM", "Hamburg"), ("NLRTM", "Rotterdam"), ("BEANR", "Antwerp"),
+    ("USNYC", "New York"), ("USLAX", "Los Angeles"), ("AEJEA", "Jebel Ali"), ("GBFXT", "Felixstowe"),
+    ("ESVLC", "Valencia"), ("ITGOA", "Genoa"), ("KRPUS", "Busan"), ("JPTYO", "Tokyo"),
+    ("BRSSZ", "Santos"), ("ZADUR", "Durban"), ("AUMEL", "Melbourne"), ("LKCMB", "Colombo"),
+]
+INLAND = [("INTKD", "Tughlakabad ICD"), ("DEDUI", "Duisburg"), ("CZPRG", "Prague"), ("USCHI", "Chicago")]
+EQUIPMENT = ["20DC", "40DC", "40HC", "20RF", "40RF", "45HC"]
+SERVICES = ["EPIC", "IMI", "AE7", "FAL1", "MEX", "INDUS"]
+SURCHARGES = [("BAF", "Bunker adjustment factor"), ("CAF", "Currency adjustment factor"),
+              ("THC", "Terminal handling charge"), ("ISPS", "Port security"), ("PSS", "Peak season surcharge"),
+              ("LSS", "Low sulphur surcharge"), ("EBS", "Emergency bunker surcharge"), ("DOC", "Documentation fee")]
+RULES = [
+    "Rates are subject to GRI and prevailing surcharges at time of shipment.",
+    "All rates are valid for FAK cargo unless otherwise stated.",
+    "Hazardous cargo subject to approval and IMO surcharge.",
+    "Rates exclude destination charges, payable by consignee.",
+    "Overweight surcharge applies to 20' containers above 18 tons.",
+    "Reefer rates include PTI and genset where required.",
+    "Transit times are indicative and not guaranteed.",
+]
+
+
+def _rate(rng, equipment):
+    base = {"20DC": 900, "40DC": 1500, "40HC": 1600, "20RF": 2200, "40RF": 3300, "45HC": 1900}[equipment]
+    return int(base * rng.uniform(0.6, 1.8))
+
+
+def _add_banner(ws, rng, carrier, valid_from, valid_to, banner_rows):
+    lines = [
+        f"{carrier} - FAK Ratesheet",
+        f"Validity: {valid_from:%d.%m.%Y} - {valid_to:%d.%m.%Y}",
+        f"Contract No. {rng.randint(100000, 999999)}",
+        "All rates in USD per container unless stated otherwise",
+        "Subject to terms and conditions of carriage",
+    ]
+    for i in range(banner_rows):
+        ws.append([lines[i % len(lines)]])
+        ws.cell(ws.max_row, 1).font = Font(bold=True)
+    ws.append([])
+
+
+def _noisy(rng, value, noise):
+    roll = rng.random()
+    if roll < noise * 0.5:
+        return None
+    if roll < noise * 0.75:
+        return rng.choice(["N/A", "on request", "-", "tba"])
+    if roll < noise:
+        return f"USD {value}" if isinstance(value, int) else value
+    return value
+
+
+def _add_freight_sheet(wb, rng, name, rows, header_levels, banner_rows, noise):
+    ws = wb.create_sheet(name)
+    carrier = rng.choice(CARRIERS)
+    valid_from = date(2025, 1, 1) + timedelta(days=rng.randint(0, 300))
+    valid_to = valid_from + timedelta(days=rng.choice([14, 30, 31, 90]))
+    _add_banner(ws, rng, carrier, valid_from, valid_to, banner_rows)
+
+    equipment = rng.sample(EQUIPMENT, rng.randint(2, len(EQUIPMENT)))
+    location_cols = ["POL Code", "POL", "POD Code", "POD", "Via", "Service", "Transit time"]
+    header = location_cols + [f"{eq} rate" for eq in equipment] + ["Currency", "Remarks"]
+    first_header_row = ws.max_row + 1
+
+    # Upper header levels: merged group titles spanning the location / rate blocks
+    for level in range(header_levels - 1):
+        top = ["Routing" if level == 0 else "Location details"] + [None] * (len(location_cols) - 1)
+        top += ["Ocean Freight USD" if level == 0 else "All-in rates"] + [None] * (len(equipment) - 1)
+        top += ["Other", None]
+        ws.append(top)
+        r = ws.max_row
+        ws.merge_cells(start_row=r, start_column=1, end_row=r, end_column=len(location_cols))
+        ws.merge_cells(start_row=r, start_column=len(location_cols) + 1,
+                       end_row=r, end_column=len(location_cols) + len(equipment))
+        ws.merge_cells(start_row=r, start_column=len(header) - 1, end_row=r, end_column=len(header))
+    ws.append(header)
+    for c in range(1, len(header) + 1):
+        ws.cell(first_header_row, c).font = Font(bold=True)
+
+    origin = rng.choice(PORTS + INLAND)
+    block_start = None
+    for i in range(rows):
+        # Origins come in blocks, written once and merged down like carriers do
+        if i % rng.randint(5, 15) == 0 or block_start is None:
+            if block_start is not None and ws.max_row > block_start:
+                ws.merge_cells(start_row=block_start, start_column=2, end_row=ws.max_row, end_column=2)
+            origin = rng.choice(PORTS + INLAND)
+            block_start = ws.max_row + 1
+            origin_cells = [origin[0], origin[1]]
+        else:
+            origin_cells = [origin[0], None]
+        dest = rng.choice(PORTS)
+        row = origin_cells + [dest[0], dest[1], rng.choice(["", "SGSIN", "AEJEA", "direct"]),
+                              rng.choice(SERVICES), rng.randint(12, 45)]
+        row += [_noisy(rng, _rate(rng, eq), noise) for eq in equipment]
+        row += ["USD", rng.choice(["", "", "subject to GRI", "incl. BAF", "excl. THC"])]
+        ws.append(row)
+        if rng.random() < noise * 0.1:
+            ws.append([])  # stray blank row inside the table
+    if block_start is not None and ws.max_row > block_start:
+        ws.merge_cells(start_row=block_start, start_column=2, end_row=ws.max_row, end_column=2)
+
+    # Footnotes after the table, which table-end detection has to cut off
+    ws.append([])
+    ws.append([])
+    for rule in rng.sample(RULES, 3):
+        ws.append([f"* {rule}"])
+
+
+def _add_freetime_sheet(wb, rng, name):
+    ws = wb.create_sheet(name)
+    ws.append(["Free time (calendar days)"])
+    ws.append(["Port", "Demurrage", "Detention", "Combined", "Day type"])
+    for code, port in rng.sample(PORTS, 12):
+        ws.append([f"{port} ({code})", rng.randint(3, 7), rng.randint(4, 14), rng.choice([None, 10, 14, 21]),
+                   rng.choice(["Calendar", "Working"])])
+
+
+def _add_rule_sheet(wb, rng, name):
+    ws = wb.create_sheet(name)
+    ws.append(["Terms and conditions"])
+    for i, rule in enumerate(rng.sample(RULES, len(RULES)), start=1):
+        ws.append([f"{i}.", rule])
+
+
+def _add_surcharge_sheet(wb, rng, name):
+    ws = wb.create_sheet(name)
+    ws.append(["Code", "Description", "20'", "40'", "Currency", "Basis"])
+    for code, desc in SURCHARGES:
+        ws.append([code, desc, rng.randint(20, 400), rng.randint(40, 800), rng.choice(["USD", "EUR"]),
+                   rng.choice(["per container", "per B/L"])])
+
+
+def generate_ratesheet(path, seed=0, sheets=3, rows=500, header_levels=2, banner_rows=3,
+                       freetime_sheets=1, rule_sheets=1, surcharge_sheets=1, noise=0.05):
+    """Write a synthetic carrier ratesheet to `path` and return the path"""
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook()
+    wb.remove(wb.active)
+    for i in range(sheets):
+        _add_freight_sheet(wb, rng, f"Rates {rng.choice(['FAK', 'Reefer', 'Asia', 'Europe', 'USEC'])} {i + 1}",
+                           rows, header_levels, banner_rows, noise)
+    for i in range(freetime_sheets):
+        _add_freetime_sheet(wb, rng, f"Free time {i + 1}" if i else "Free time")
+    for i in range(rule_sheets):
+        _add_rule_sheet(wb, rng, f"Rules {i + 1}" if i else "Rules")
+    for i in range(surcharge_sheets):
+        _add_surcharge_sheet(wb, rng, f"Surcharges {i + 1}" if i else "Surcharges")
+    wb.save(path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sheets", type=int, default=3)
+    parser.add_argument("--rows", type=int, default=500)
+    parser.add_argument("--header-levels", type=int, default=2)
+    parser.add_argument("--banner-rows", type=int, default=3)
+    parser.add_argument("--freetime-sheets", type=int, default=1)
+    parser.add_argument("--rule-sheets", type=int, default=1)
+    parser.add_argument("--surcharge-sheets", type=int, default=1)
+    parser.add_argument("--noise", type=float, default=0.05)
+    args = parser.parse_args()
+    generate_ratesheet(args.path, seed=args.seed, sheets=args.sheets, rows=args.rows,
+                       header_levels=args.header_levels, banner_rows=args.banner_rows,
+                       freetime_sheets=args.freetime_sheets, rule_sheets=args.rule_sheets,
+                       surcharge_sheets=args.surcharge_sheets, noise=args.noise)
+    print(args.path)
+
+
+if __name__ == "__main__":
+    main()
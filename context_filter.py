@@ -0,0 +1,119 @@
+import json
+import os
+import re
+
+# Map-reduce helpers for the context filter (context.txt).
+#
+# A workbook's context (its own header/footer rows plus the freetime, rule and
+# surcharge blocks) can be far larger than one filter call handles well. The
+# context is split into chunks of at most CONTEXT_FILTER_CHUNK_TOKENS
+# estimated tokens on line boundaries, each chunk repeating the "=== ... ==="
+# marker of the block it continues. extraction.filter_context_csv filters the
+# chunks in parallel (map) and merge_filtered_reports joins the reports
+# section by section, dropping lines already reported (reduce). Context that
+# fits in one chunk takes a single call and no reduce, as before.
+#
+# Phase timings and sizes are written to
+# `{output_subfolder}/context_filter_stats.json`.
+
+CONTEXT_FILTER_STATS_FILENAME = "context_filter_stats.json"
+CONTEXT_FILTER_CHUNK_TOKENS = int(os.getenv("CONTEXT_FILTER_CHUNK_TOKENS", "24000"))
+CONTEXT_FILTER_MAX_WORKERS = int(os.getenv("CONTEXT_FILTER_MAX_WORKERS", "4"))
+CHARS_PER_TOKEN = 4
+
+# "=== FREETIME: Sheet ===" block markers written by preprocessing (possibly followed by empty CSV cells)
+MARKER_RE = re.compile(r"^===.*===,*$")
+# "## 3. Carrier & Service Details", "**3. Carrier & Service Details**", "3) Carrier ..."
+HEADING_RE = re.compile(r"^\s*(?:#{1,6}\s+|\*\*\s*)?(?:\d{1,2}[.)]\s+)?(?P<title>[^#*\n]{3,80}?)\s*\**\s*:?\s*$")
+NUMBERED_HEADING_RE = re.compile(r"^\s*(?:#{1,6}\s+)?\**\s*\d{1,2}[.)]\s+[^\n]{3,80}$")
+
+
+def split_context(context_csv, max_tokens=CONTEXT_FILTER_CHUNK_TOKENS):
+    """Split CSV text into chunks of at most `max_tokens` estimated tokens, on line boundaries"""
+    max_chars = max(1, max_tokens) * CHARS_PER_TOKEN
+    if len(context_csv) <= max_chars:
+        return [context_csv]
+    chunks, lines, size, marker = [], [], 0, None
+    for line in context_csv.splitlines(keepends=True):
+        # A single line longer than a chunk is cut as is
+        pieces = [line[i:i + max_chars] for i in range(0, len(line), max_chars)] or [line]
+        for piece in pieces:
+            if lines and size + len(piece) > max_chars:
+                chunks.append("".join(lines))
+                # The next chunk says which block it continues
+                lines = [marker] if marker and not MARKER_RE.match(piece.strip()) else []
+                size = sum(len(l) for l in lines)
+            lines.append(piece)
+            size += len(piece)
+        if MARKER_RE.match(line.strip()):
+            marker = line if line.endswith("\n") else line + "\n"
+    if lines:
+        chunks.append("".join(lines))
+    return chunks
+
+
+def parse_filter_response(text):
+    """The filtered context from a filter response: plain text, a `filtered_context` object or a list of rows"""
+    try:
+        parsed_context = json.loads(text)
+    except json.JSONDecodeError:
+        # Use the raw response if not valid JSON
+        return text
+    if isinstance(parsed_context, dict) and 'filtered_context' in parsed_context:
+        return parsed_context['filtered_context']
+    if isinstance(parsed_context, list):
+        # Convert list back to CSV format
+        import pandas as pd
+        return pd.DataFrame(parsed_context).to_csv(index=False)
+    return str(parsed_context)
+
+
+def _heading_key(line):
+    if not (line.lstrip().startswith(("#", "**")) or NUMBERED_HEADING_RE.match(line)):
+        return None
+    heading = HEADING_RE.match(line)
+    if not heading:
+        return None
+    return re.sub(r"[^a-z0-9]+", " ", heading.group("title").lower()).strip()
+
+
+def merge_filtered_reports(reports):
+    """Join per-chunk filter reports section by section without repeating lines.
+
+    Returns (merged text, stats).
+    """
+    sections = {None: ("", [], set())}
+    lines_in = duplicates = 0
+    for report in reports:
+        current = None
+        for line in report.splitlines():
+            if not line.strip():
+                continue
+            key = _heading_key(line)
+            if key:
+                current = key
+                sections.setdefault(key, (line.strip(), [], set()))
+                continue
+            lines_in += 1
+            _, lines, seen = sections[current]
+            normalized = " ".join(line.split()).lower()
+            if normalized in seen:
+                duplicates += 1
+                continue
+            seen.add(normalized)
+            lines.append(line.rstrip())
+
+    out = list(sections[None][1])
+    for key, (heading, lines, _) in sections.items():
+        if key is None:
+            continue
+        if out:
+            out.append("")
+        out.append(heading)
+        out.extend(lines)
+    return "\n".join(out) + "\n", {
+        "sections": len(sections) - 1,
+        "lines_in": lines_in,
+        "lines_out": lines_in - duplicates,
+        "duplicates_removed": duplicates,
+    }
@@ -0,0 +1,206 @@
+import json
+import os
+import re
+import zipfile
+from datetime import date, datetime
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from freight_schema import BOOL_FIELDS, DATE_FIELDS, RECORD_FIELDS
+from json_records import iter_json_record_batches
+
+# Post-extraction export stage.
+#
+# Streams every freight_rates.json of a job into two Parquet files:
+#   freight_records.parquet - one row per extracted record, dates as real dates
+#   freight_rates.parquet   - `freight_rates` exploded into (equipment, rate, currency)
+# and packs all job artifacts into a single zip for download.
+
+EXPORT_FOLDER_NAME = "_exports"
+BATCH_SIZE = 2000
+
+CURRENCY_CODES = {
+    "USD", "EUR", "GBP", "INR", "CNY", "RMB", "JPY", "KRW", "AED", "SAR", "SGD", "HKD", "AUD",
+    "NZD", "CAD", "CHF", "SEK", "NOK", "DKK", "PLN", "TRY", "ZAR", "BRL", "MXN", "THB", "VND",
+    "IDR", "MYR", "PHP", "TWD", "PKR", "BDT", "LKR", "EGP", "KES", "NGN",
+}
+CURRENCY_SYMBOLS = {"$": "USD", "€": "EUR", "£": "GBP", "¥": "JPY", "₹": "INR"}
+DATE_FORMATS = ["%Y-%m-%d", "%d.%m.%Y", "%d/%m/%Y", "%d-%m-%Y", "%Y/%m/%d", "%d %b %Y", "%d-%b-%Y", "%d %B %Y"]
+
+# Standalone upper-case three-letter words, so "Cadiz" or "Feeder" never read as currencies
+_token_re = re.compile(r"(?<![A-Za-z])[A-Z]{3}(?![A-Za-z])")
+_number_re = re.compile(r"-?\d[\d,]*(?:\.\d+)?")
+
+RECORDS_SCHEMA = pa.schema(
+    [("job", pa.string()), ("subfolder", pa.string()), ("record_id", pa.int64())]
+    + [
+        (field, pa.date32() if field in DATE_FIELDS else pa.bool_() if field in BOOL_FIELDS else pa.string())
+        for field in RECORD_FIELDS if field != "freight_rates"
+    ]
+)
+RATES_SCHEMA = pa.schema([
+    ("job", pa.string()),
+    ("subfolder", pa.string()),
+    ("record_id", pa.int64()),
+    ("equipment", pa.string()),
+    ("rate", pa.float64()),
+    ("currency", pa.string()),
+    ("raw", pa.string()),
+])
+
+
+def find_currency(text):
+    """First currency code or symbol in `text`, or None"""
+    for token in _token_re.findall(text or ""):
+        if token in CURRENCY_CODES:
+            return token
+    for symbol, code in CURRENCY_SYMBOLS.items():
+        if symbol in (text or ""):
+            return code
+    return None
+
+
+def parse_freight_rate(rate_string, default_currency=None):
+    """Split "Feeder 40DC USD:2,200" into ("Feeder 40DC", 2200.0, "USD")"""
+    header, sep, value = str(rate_string).rpartition(":")
+    if not sep:
+        header, value = "", header
+    currency = find_currency(value) or find_currency(header) or (default_currency or None)
+
+    equipment = header
+    for token in _token_re.findall(header):
+        if token in CURRENCY_CODES:
+            equipment = re.sub(rf"\b{token}\b", "", equipment)
+    equipment = re.sub(r"\s{2,}", " ", equipment).strip(" -_/()")
+
+    match = _number_re.search(value)
+    rate = float(match.group().replace(",", "")) if match else None
+    return equipment, rate, currency
+
+
+def parse_date(value):
+    """Parse a validity date in one of the formats seen in ratesheets, or None"""
+    if value in (None, ""):
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    if value in (None, ""):
+        return None
+    return str(value).strip().lower() in ("true", "yes", "y", "1")
+
+
+def to_text(value):
+    if value is None:
+        return None
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False)
+    return str(value)
+
+
+def is_extracted_record(record):
+    """Skip error / raw_response placeholders and anything that is not a record"""
+    return isinstance(record, dict) and "error" not in record and "raw_response" not in record
+
+
+def convert_batch(job, subfolder, records, first_record_id):
+    """Turn a batch of records into (records columns, rates columns)"""
+    record_rows = {name: [] for name in RECORDS_SCHEMA.names}
+    rate_rows = {name: [] for name in RATES_SCHEMA.names}
+    for offset, record in enumerate(records):
+        record_id = first_record_id + offset
+        record_rows["job"].append(job)
+        record_rows["subfolder"].append(subfolder)
+        record_rows["record_id"].append(record_id)
+        for field in RECORD_FIELDS:
+            if field == "freight_rates":
+                continue
+            value = record.get(field)
+            if field in DATE_FIELDS:
+                record_rows[field].append(parse_date(value))
+            elif field in BOOL_FIELDS:
+                record_rows[field].append(parse_bool(value))
+            else:
+                record_rows[field].append(to_text(value))
+
+        rates = record.get("freight_rates") or []
+        if isinstance(rates, str):
+            rates = [rates]
+        for rate_string in rates:
+            equipment, rate, currency = parse_freight_rate(rate_string, record.get("freight_currency"))
+            rate_rows["job"].append(job)
+            rate_rows["subfolder"].append(subfolder)
+            rate_rows["record_id"].append(record_id)
+            rate_rows["equipment"].append(equipment)
+            rate_rows["rate"].append(rate)
+            rate_rows["currency"].append(currency)
+            rate_rows["raw"].append(str(rate_string))
+    return record_rows, rate_rows
+
+
+def export_job_parquet(output_main_folder, job=None):
+    """Stream all freight_rates.json files of a job into Parquet; returns the written paths"""
+    job = job or os.path.basename(output_main_folder.rstrip("/\\"))
+    export_folder = os.path.join(output_main_folder, EXPORT_FOLDER_NAME)
+    os.makedirs(export_folder, exist_ok=True)
+    records_path = os.path.join(export_folder, "freight_records.parquet")
+    rates_path = os.path.join(export_folder, "freight_rates.parquet")
+
+    record_count = rate_count = 0
+    with pq.ParquetWriter(records_path, RECORDS_SCHEMA) as records_writer, \
+            pq.ParquetWriter(rates_path, RATES_SCHEMA) as rates_writer:
+        for subfolder in sorted(os.listdir(output_main_folder)):
+            output_path = os.path.join(output_main_folder, subfolder, "freight_rates.json")
+            if not os.path.exists(output_path):
+                continue
+            for batch in iter_json_record_batches(output_path, BATCH_SIZE):
+                records = [r for r in batch if is_extracted_record(r)]
+                if not records:
+                    continue
+                record_rows, rate_rows = convert_batch(job, subfolder, records, record_count)
+                records_writer.write_table(pa.table(record_rows, schema=RECORDS_SCHEMA))
+                if rate_rows["rate"]:
+                    rates_writer.write_table(pa.table(rate_rows, schema=RATES_SCHEMA))
+                record_count += len(records)
+                rate_count += len(rate_rows["rate"])
+
+    print(f"📦 Exported {record_count} record(s) and {rate_count} rate(s) to {export_folder}")
+    return [records_path, rates_path]
+
+
+def create_job_archive(output_main_folder):
+    """Zip every artifact of a job (outputs and exports) into `{output_main_folder}.zip`"""
+    archive_path = f"{output_main_folder.rstrip('/')}.zip"
+    tmp_path = archive_path + ".tmp"
+    with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for root, dirs, files in os.walk(output_main_folder):
+            dirs.sort()
+            for file in sorted(files):
+                if file.endswith(".tmp"):
+                    continue
+                file_path = os.path.join(root, file)
+                # Get relative path to maintain folder structure in ZIP
+                arcname = os.path.relpath(file_path, output_main_folder)
+                zip_file.write(file_path, arcname)
+    os.replace(tmp_path, archive_path)
+    return archive_path
+
+
+def export_job(output_main_folder):
+    """Run the whole export stage for a finished job and return the archive path"""
+    export_job_parquet(output_main_folder)
+    return create_job_archive(output_main_folder)
@@ -1,11 +1,27 @@
 from dotenv import load_dotenv
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
 import pandas as pd
-import boto3
+import csv
+import io
+import openpyxl
 import json
 import os
 import re
 import threading
+import time
+from json_records import iter_json_records
+from llm_backends import get_llm_backend
+from progress import write_json_atomic
+from rate_limiter import estimate_tokens, get_rate_limiter, is_throttling_error, on_quota_acquired
+from schema_validation import (merge_repair, prompt_field_rules, repair_request, validate_extraction,
+                               validate_records)
+from incremental import (DIFF_SUMMARY_FILENAME, ManifestWriter, RowDiff, discard_previous_version,
+                         find_previous_version, header_signature, iter_carried_records, row_key,
+                         text_hash, update_manifest_after_retry, write_job_diff_summary)
+from shared_context import is_shared_folder, load_sheet_context
+from context_filter import (CONTEXT_FILTER_MAX_WORKERS, CONTEXT_FILTER_STATS_FILENAME, merge_filtered_reports,
+                            parse_filter_response, split_context)
 
 load_dotenv()
 
@@ -13,15 +29,62 @@ AWS_REGION = os.getenv("AWS_REGION")
 AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
 AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 
-bedrock_client = boto3.client(
-    "bedrock-runtime",
-    region_name=AWS_REGION,
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-)
+# Rows extracted concurrently per subfolder
+EXTRACTION_MAX_WORKERS = int(os.getenv("EXTRACTION_MAX_WORKERS", "5"))
+# Rows submitted but not yet written; 0 means four per worker
+EXTRACTION_MAX_PENDING = int(os.getenv("EXTRACTION_MAX_PENDING", "0"))
+# The worker service may run several jobs at once on the same client, so the
+# HTTP pool is sized to the total number of concurrent Bedrock calls.
+BEDROCK_MAX_POOL_CONNECTIONS = int(os.getenv(
+    "BEDROCK_MAX_POOL_CONNECTIONS",
+    str(EXTRACTION_MAX_WORKERS * int(os.getenv("WORKER_MAX_CONCURRENT_JOBS", "2")) + 1)
+))
+# Records with at most this many invalid fields get a field-level repair call; 0 disables repairs
+EXTRACTION_REPAIR_MAX_FIELDS = int(os.getenv("EXTRACTION_REPAIR_MAX_FIELDS", "5"))
+VALIDATION_ERRORS_FILENAME = "validation_errors.jsonl"
+# Carry over unchanged rows from a previous version of the same ratesheet
+EXTRACTION_INCREMENTAL = os.getenv("EXTRACTION_INCREMENTAL", "1").lower() not in ("0", "false", "no")
+
+_bedrock_client = None
+_bedrock_client_lock = threading.Lock()
+_botocore_session = None
+
+def get_botocore_session():
+    """Process-wide botocore session, so credentials and endpoint data load once"""
+    global _botocore_session
+    if _botocore_session is None:
+        with _bedrock_client_lock:
+            if _botocore_session is None:
+                import botocore.session
+                _botocore_session = botocore.session.get_session()
+    return _botocore_session
+
+def get_bedrock_client():
+    """Lazily build the shared Bedrock runtime client (thread-safe).
+
+    boto3 is only imported on first use, so importing this module stays cheap.
+    """
+    global _bedrock_client
+    if _bedrock_client is None:
+        botocore_session = get_botocore_session()
+        with _bedrock_client_lock:
+            if _bedrock_client is None:
+                import boto3
+                from botocore.config import Config
+                session = boto3.session.Session(botocore_session=botocore_session)
+                _bedrock_client = session.client(
+                    "bedrock-runtime",
+                    region_name=AWS_REGION,
+                    aws_access_key_id=AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+                    config=Config(max_pool_connections=BEDROCK_MAX_POOL_CONNECTIONS)
+                )
+    return _bedrock_client
+
+FILTERED_CONTEXT_FILENAME = "filtered_context.txt"
 
 def extract_json_from_backticks(text: str) -> dict:
-    pattern = r"``````"
+    pattern = r"```(?:json)?\s*(.*?)```"
     match = re.search(pattern, text, re.DOTALL)
     if not match:
         raise ValueError("No JSON block found in the provided text.")
@@ -66,17 +129,30 @@ def call_nova_pro_converse_cached(
     if stop_sequences:
         inference_config["stopSequences"] = stop_sequences
 
-    # 3️⃣ Converse call
-    response = bedrock_client.converse(
-        modelId=model_id,
-        messages=messages,
-        inferenceConfig=inference_config,
-    )
+    # 3️⃣ Converse call (live Bedrock unless LLM_BACKEND selects a fake or a replay),
+    #    within the host-wide quota for this model (see rate_limiter.py)
+    limiter = get_rate_limiter()
+    reserved = limiter.acquire(model_id, estimate_tokens(static_prompt, user_input), max_tokens)
+    try:
+        response = get_llm_backend().converse(
+            modelId=model_id,
+            messages=messages,
+            inferenceConfig=inference_config,
+        )
+    except Exception as e:
+        if is_throttling_error(e):
+            limiter.penalize(model_id)
+        limiter.settle(model_id, reserved, 0, 0)
+        raise
 
     # 4️⃣ Extract assistant text (Nova always returns a list in content)
     assistant_segments = response["output"]["message"]["content"]
     assistant_text = "".join(seg.get("text", "") for seg in assistant_segments)
     usage = response['usage']
+    limiter.settle(model_id, reserved,
+                   (usage.get("inputTokens") or 0) + (usage.get("cacheReadInputTokens") or 0)
+                   + (usage.get("cacheWriteInputTokens") or 0),
+                   usage.get("outputTokens") or 0)
     # print(usage)
     return assistant_text,usage
 
@@ -104,14 +180,24 @@ def call_bedrock_claude(static_prompt, user_input, model_id="anthropic.claude-3-
         "temperature": temperature
     }
 
-    response = bedrock_client.invoke_model(
-        modelId=model_id,
-        contentType="application/json",
-        accept="application/json",
-        body=json.dumps(request_body)
-    )
+    limiter = get_rate_limiter()
+    reserved = limiter.acquire(model_id, estimate_tokens(static_prompt, user_input), max_tokens)
+    try:
+        response = get_bedrock_client().invoke_model(
+            modelId=model_id,
+            contentType="application/json",
+            accept="application/json",
+            body=json.dumps(request_body)
+        )
+    except Exception as e:
+        if is_throttling_error(e):
+            limiter.penalize(model_id)
+        limiter.settle(model_id, reserved, 0, 0)
+        raise
 
     response_body = json.loads(response["body"].read())
+    usage = response_body.get("usage", {})
+    limiter.settle(model_id, reserved, usage.get("input_tokens") or 0, usage.get("output_tokens") or 0)
     return response_body["content"][0]["text"]
 
 
@@ -132,108 +218,436 @@ def find_freight_and_context_files(subfolder_path):
     
     return freight_file, context_file
 
-def write_json_record_to_file(file_handle, record, is_first, file_lock):
+def write_json_record_to_file(file_handle, record, is_first, file_lock, span=None):
     """Thread-safe function to write JSON record to file"""
+    waiting_since = time.perf_counter_ns()
     with file_lock:
+        if span is not None:
+            span.add_lock_wait((time.perf_counter_ns() - waiting_since) // 1000)
         if not is_first[0]:
             file_handle.write(",\n")
         file_handle.write(json.dumps(record, ensure_ascii=False, indent=2))
         file_handle.flush()  # Ensure immediate write to disk
         is_first[0] = False
 
-def process_subfolder_pair_incremental(subfolder_path, subfolder_name, extraction_prompt_path, output_base_folder,context_filter_prompt_path=None):
-    """Process a single subfolder with incremental JSON writing"""
-    print(f"\n📁 Processing subfolder: {subfolder_name}")
-    
+def filter_context_chunk(chunk, context_filter_prompt):
+    """Map step: filter one chunk; on failure the chunk is kept unfiltered. Returns (text, usage, seconds, error)"""
+    t0 = time.perf_counter()
+    try:
+        filtered, usage = call_nova_pro_converse_cached(context_filter_prompt, chunk)
+        return parse_filter_response(filtered), usage, time.perf_counter() - t0, None
+    except Exception as e:
+        return chunk, {}, time.perf_counter() - t0, e
+
+def filter_context_csv(context_csv, context_filter_prompt, stats=None):
+    """Filter the raw context CSV down to the rate-relevant parts using the LLM.
+
+    Context larger than CONTEXT_FILTER_CHUNK_TOKENS is filtered in chunks, in
+    parallel, and the reports are merged (see context_filter.py). Phase
+    timings and sizes are added to `stats` if given.
+    """
+    print(f"🔍 Filtering context data using LLM...")
+    stats = {} if stats is None else stats
+    chunks = split_context(context_csv)
+    stats.update(input_chars=len(context_csv), input_tokens_estimate=estimate_tokens(context_csv), chunks=len(chunks))
+
+    t0 = time.perf_counter()
+    if len(chunks) == 1:
+        results = [filter_context_chunk(chunks[0], context_filter_prompt)]
+    else:
+        with ThreadPoolExecutor(max_workers=min(CONTEXT_FILTER_MAX_WORKERS, len(chunks))) as pool:
+            results = list(pool.map(filter_context_chunk, chunks, [context_filter_prompt] * len(chunks)))
+    chunk_seconds = [seconds for _, _, seconds, _ in results]
+    errors = [error for _, _, _, error in results if error is not None]
+    stats["map"] = {
+        "seconds": round(time.perf_counter() - t0, 3),
+        "calls": len(chunks),
+        "failed": len(errors),
+        "chunk_seconds_max": round(max(chunk_seconds), 3),
+        **{name: sum(usage.get(name) or 0 for _, usage, _, _ in results)
+           for name in ("inputTokens", "outputTokens", "cacheReadInputTokens")},
+    }
+    for error in errors:
+        print(f"⚠️ Error filtering context, using original: {error}")
+
+    if len(chunks) == 1:
+        filtered_context_csv = results[0][0]
+        usage = results[0][1]
+        if not errors:
+            print("Context Filter - Cache hit?", usage.get("promptCacheHit"))
+            print("Context Filter - Input tokens:", usage.get("inputTokens"))
+    else:
+        t0 = time.perf_counter()
+        filtered_context_csv, reduce_stats = merge_filtered_reports([text for text, _, _, _ in results])
+        stats["reduce"] = {"seconds": round(time.perf_counter() - t0, 3), **reduce_stats}
+        print(f"🧩 Context filtered in {len(chunks)} chunks, {reduce_stats['duplicates_removed']} duplicate line(s) merged")
+    stats["output_chars"] = len(filtered_context_csv)
+
+    if not errors:
+        print(f"✅ Context filtered successfully")
+    print(f"📏 Original context length: {len(context_csv)} chars")
+    print(f"📏 Filtered context length: {len(filtered_context_csv)} chars")
+    return filtered_context_csv
+
+def prepare_subfolder_extraction(subfolder_path, subfolder_name, extraction_prompt_path, output_subfolder,
+                                 context_filter_prompt_path=None, reuse_filtered_context=False):
+    """Check a subfolder's freight table and build its extraction prompt.
+
+    Returns (freight_file, extraction_prompt), or None when the subfolder has
+    nothing to extract. Rows are not loaded here; stream them with
+    `iter_freight_rows(freight_file)`. The filtered context is saved next to the outputs so
+    that a later retry can reuse it instead of paying for the filter call again.
+    """
     # Find freight and context files
     freight_file, context_file = find_freight_and_context_files(subfolder_path)
-    
+
     if not freight_file or not context_file:
         print(f"❌ Required files not found in {subfolder_name}")
-        return False
-    
+        return None
+
     print(f"📊 Freight file: {os.path.basename(freight_file)}")
     print(f"📋 Context file: {os.path.basename(context_file)}")
-    
-    # Load prompt templates
-    # with open(extraction_prompt_path, "r") as f:
-    #     extraction_prompt_template = f.read().strip()
 
     with open(extraction_prompt_path, "r", encoding="utf-8") as f:
         extraction_prompt_template = f.read().strip()
 
-    # Create output subfolder
-    output_subfolder = os.path.join(output_base_folder, subfolder_name)
-    os.makedirs(output_subfolder, exist_ok=True)
-    
-    try:
-        # Read freight rate file
-        df_freight = pd.read_excel(freight_file, dtype=str).fillna("")
-        print(f"✅ Loaded freight data: {len(df_freight)} rows")
-        
-        # Read context file
-        df_context = pd.read_excel(context_file, dtype=str).fillna("")
-        context_csv = df_context.to_csv(index=False) if not df_context.empty else ""
-        print(f"✅ Loaded context data: {len(df_context)} rows")
-        
-        if len(df_freight) < 1:
-            print(f"❌ Insufficient data in freight file for {subfolder_name}")
-            return False
-        
-        # Get header reference
-        header_reference_csv = df_freight.head(2).to_csv(index=False)
+    # Header plus the first rows only; the table itself is streamed later
+    df_head = pd.read_excel(freight_file, dtype=str, nrows=2).fillna("")
+
+    if len(df_head) < 1:
+        print(f"❌ Insufficient data in freight file for {subfolder_name}")
+        return None
+
+    # Get header reference
+    header_reference_csv = df_head.to_csv(index=False)
+
+    filtered_context_path = os.path.join(output_subfolder, FILTERED_CONTEXT_FILENAME)
+    if reuse_filtered_context and os.path.exists(filtered_context_path):
+        with open(filtered_context_path, "r", encoding="utf-8") as f:
+            filtered_context_csv = f.read()
+        print(f"♻️ Reusing filtered context from {filtered_context_path}")
+    else:
+        # The sheet's own context plus the workbook-wide blocks it references (see shared_context.py)
+        context_csv = load_sheet_context(subfolder_path, context_file)
+        print(f"✅ Loaded context data: {len(context_csv.splitlines())} rows")
 
         #load context filter prompt
         context_filter_prompt = None
-        # if context_filter_prompt_path and os.path.exists(context_filter_prompt_path):
-        #     with open(context_filter_prompt_path, "r") as f:
-        #         context_filter_prompt = f.read().strip()
-        
         if context_filter_prompt_path and os.path.exists(context_filter_prompt_path):
             with open(context_filter_prompt_path, "r", encoding="utf-8") as f:
                 context_filter_prompt = f.read().strip()
 
-        #extract relevant context only
         # Filter context using LLM if filter prompt is provided
         filtered_context_csv = context_csv
         if context_filter_prompt and context_csv:
-            print(f"🔍 Filtering context data using LLM...")
-            try:
-                filtered_context, usage = call_nova_pro_converse_cached(context_filter_prompt, context_csv)
-                print("Context Filter - Cache hit?", usage.get("promptCacheHit"))
-                print("Context Filter - Input tokens:", usage.get("inputTokens"))
-        
-                # Try to parse as JSON first, then fallback to plain text
-                try:
-                    parsed_context = json.loads(filtered_context)
-                    if isinstance(parsed_context, dict) and 'filtered_context' in parsed_context:
-                        filtered_context_csv = parsed_context['filtered_context']
-                    elif isinstance(parsed_context, list):
-                        # Convert list back to CSV format
-                        filtered_df = pd.DataFrame(parsed_context)
-                        filtered_context_csv = filtered_df.to_csv(index=False)
-                    else:
-                        filtered_context_csv = str(parsed_context)
-                except json.JSONDecodeError:
-                    # Use the raw response if not valid JSON
-                    filtered_context_csv = filtered_context
-        
-                print(f"✅ Context filtered successfully")
-                print(f"📏 Original context length: {len(context_csv)} chars")
-                print(f"📏 Filtered context length: {len(filtered_context_csv)} chars")
-        
-            except Exception as e:
-                print(f"⚠️ Error filtering context, using original: {e}")
-                filtered_context_csv = context_csv
+            filter_stats = {}
+            filtered_context_csv = filter_context_csv(context_csv, context_filter_prompt, filter_stats)
+            write_json_atomic(os.path.join(output_subfolder, CONTEXT_FILTER_STATS_FILENAME), filter_stats)
+
+        with open(filtered_context_path, "w", encoding="utf-8") as f:
+            f.write(filtered_context_csv)
+
+    extraction_prompt = extraction_prompt_template.replace("{{METADATA_CONTEXT_HERE}}", filtered_context_csv)
+    extraction_prompt = extraction_prompt.replace("{{HEADER_REFRENCE}}", header_reference_csv)
+    return freight_file, extraction_prompt
+
+def count_freight_rows(subfolder_path):
+    """Cheap row count of a subfolder's freight table (reads the sheet dimension only)"""
+    freight_file, _ = find_freight_and_context_files(subfolder_path)
+    if not freight_file:
+        return 0
+    wb = openpyxl.load_workbook(freight_file, read_only=True)
+    try:
+        return max(0, (wb.active.max_row or 1) - 1)
+    finally:
+        wb.close()
+
+def repair_invalid_fields(extraction_prompt, row_csv, result, usage, model_id=None):
+    """Validate a row's response and ask the model again for just its invalid fields.
+
+    The repair request reuses the cached extraction prompt, so it only pays for
+    the row, the record and the rules of the invalid fields. `model_id` is the
+    model that produced `result`. Returns (result, usage, validation) with the
+    errors left after repair in usage["validationErrors"]; responses that are
+    not JSON are left to parse_extraction_result. Prompts that no longer
+    describe the output schema are not validated, and validation is None.
+    """
+    usage = dict(usage or {})
+    rules = prompt_field_rules(extraction_prompt)
+    if rules is None:
+        usage["validationErrors"] = []
+        return result, usage, None
+    validation = validate_extraction(result, row_csv)
+    usage["validationErrors"] = validation.errors
+    if validation.valid or validation.records is None or not EXTRACTION_REPAIR_MAX_FIELDS:
+        return result, usage, validation
+
+    records = list(validation.records)
+    repairs = 0
+    model = {"model_id": model_id} if model_id else {}
+    for i, invalid in validation.field_errors.items():
+        if len(invalid) > EXTRACTION_REPAIR_MAX_FIELDS:
+            continue
+        try:
+            text, repair_usage = call_nova_pro_converse_cached(
+                extraction_prompt, repair_request(row_csv, records[i], invalid, rules), **model)
+        except Exception as e:
+            print(f"⚠️ Repair call failed ({', '.join(invalid)}): {e}")
+            continue
+        records[i] = merge_repair(records[i], invalid, text)
+        repairs += 1
+        for name in ("inputTokens", "outputTokens", "totalTokens", "cacheReadInputTokens", "cacheWriteInputTokens"):
+            usage[name] = (usage.get(name) or 0) + (repair_usage.get(name) or 0)
+    if not repairs:
+        return result, usage, validation
+    validation = validate_records(records, row_csv)
+    usage["repairCalls"] = repairs
+    usage["validationErrors"] = validation.errors
+    return json.dumps(records, ensure_ascii=False), usage, validation
+
+def call_with_progress(progress, sheet, extraction_prompt, row_csv, span=None, router=None, hedger=None):
+    """Model call that marks the row as in flight while it is running.
+
+    The row counts as in flight from the moment its first call is past the
+    rate limiter. `router` (see model_router.py) replaces the single Nova Pro
+    call and `hedger` (see hedging.py) duplicates it when it runs unusually
+    long. The response is validated and invalid fields repaired before it is
+    returned, unless the router already did so for the tier it accepted.
+    """
+    call = router or call_nova_pro_converse_cached
+    if span is not None:
+        span.mark("dispatch")
+    admitted = []
+    admitted_lock = threading.Lock()
+
+    def on_admitted(waited):
+        # In flight only once the first call is past the rate limiter, so quota waits are not model time
+        with admitted_lock:
+            if admitted:
+                return
+            admitted.append(waited)
+        if progress is not None:
+            progress.row_started(sheet)
+        if span is not None:
+            span.mark("admitted")
+            span.set(quota_wait_ms=round(waited * 1000, 1))
+
+    token = on_quota_acquired.set(on_admitted)
+    try:
+        if hedger is not None:
+            result, usage = hedger(call, extraction_prompt, row_csv)
+        else:
+            result, usage = call(extraction_prompt, row_csv)
+        if "validationErrors" not in usage:
+            result, usage, _ = repair_invalid_fields(extraction_prompt, row_csv, result, usage)
+    finally:
+        on_quota_acquired.reset(token)
+        # row_finished always follows, so a call that failed before reaching the limiter counts too
+        on_admitted(0.0)
+        if span is not None:
+            span.mark("response")
+    if span is not None:
+        span.record_usage(usage)
+        span.set(repair_calls=usage.get("repairCalls", 0), validation_errors=len(usage["validationErrors"]))
+    return result, usage
+
+def cell_to_text(value):
+    """Render a cell the way pd.read_excel(dtype=str) does"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def values_to_csv(values):
+    """Serialize a single freight row the way it is sent to the model"""
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerow(values)
+    return buffer.getvalue()
+
+def iter_freight_rows(freight_file):
+    """Stream (row_index, row_csv) from a freight table without loading it into memory.
+
+    Row indices are positions below the header, as in pd.read_excel; blank
+    rows keep their index but are not yielded.
+    """
+    wb = openpyxl.load_workbook(freight_file, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        width = len(header)
+        for idx, values in enumerate(rows):
+            values = list(values[:width]) + [None] * (width - len(values))
+            if all(v is None for v in values):
+                continue
+            yield idx, values_to_csv(cell_to_text(v) for v in values)
+    finally:
+        wb.close()
+
+def read_freight_header(freight_file):
+    """Header row of a freight table, as raw cell values"""
+    wb = openpyxl.load_workbook(freight_file, read_only=True, data_only=True)
+    try:
+        return next(wb.active.iter_rows(values_only=True), ())
+    finally:
+        wb.close()
+
+def iter_bounded_completions(executor, tasks, max_pending=None):
+    """Submit `(key, fn, *args)` tasks lazily and yield `(key, future)` as they complete.
+
+    At most `max_pending` futures exist at any time, so a 200k-row sheet never
+    holds more than a small window of rows, requests and responses in memory.
+    """
+    max_pending = max_pending or EXTRACTION_MAX_PENDING or 4 * EXTRACTION_MAX_WORKERS
+    tasks = iter(tasks)
+    pending = {}
+    exhausted = False
+    while True:
+        while not exhausted and len(pending) < max_pending:
+            task = next(tasks, None)
+            if task is None:
+                exhausted = True
+                break
+            key, fn, *args = task
+            pending[executor.submit(fn, *args)] = key
+        if not pending:
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), future
+
+def parse_extraction_result(result, idx, index_key="row_index"):
+    """Turn a model response into a list of records, keeping unparseable output under `index_key`"""
+    try:
+        records = json.loads(result)
+    except json.JSONDecodeError:
+        try:
+            records = extract_json_from_backticks(result)
+        except:
+            records = [{"raw_response": result, index_key: idx}]
+    return records if isinstance(records, list) else [records]
+
+def is_failed_record(record):
+    """True for the error / raw_response placeholders written for a failed row"""
+    return isinstance(record, dict) and "row_index" in record and ("error" in record or "raw_response" in record)
+
+def match_previous_version(subfolder_path, output_subfolder, extraction_prompt_path, freight_file, incremental=None):
+    """Match the rows of a freight table against a previous version of the same table.
+
+    Returns (manifest, previous, diff). `previous` is None when no earlier
+    extraction with the same header, prompt template and raw context exists
+    or `incremental` is False (defaults to EXTRACTION_INCREMENTAL); the sheet
+    is then not read here and no row is carried. Otherwise every row is
+    hashed once to find the carried ones; the rest are hashed again as they
+    are extracted, so no per-row state is kept for them.
+    """
+    with open(extraction_prompt_path, "r", encoding="utf-8") as f:
+        prompt_signature = text_hash(f.read())
+    # The unfiltered context: the filter call's output varies from run to run
+    _, context_file = find_freight_and_context_files(subfolder_path)
+    manifest = ManifestWriter(header_signature(read_freight_header(freight_file)), prompt_signature,
+                              text_hash(load_sheet_context(subfolder_path, context_file)))
+    previous, context_changed = None, False
+    if EXTRACTION_INCREMENTAL if incremental is None else incremental:
+        previous, context_changed = find_previous_version(output_subfolder, manifest.header_signature,
+                                                          prompt_signature, manifest.context_signature)
+    if context_changed:
+        print("⚠️ Context changed since the previous version, extracting every row")
+    diff = RowDiff(previous, context_changed)
+    if previous is not None:
+        for idx, row_csv in iter_freight_rows(freight_file):
+            diff.match(idx, text_hash(row_csv), row_key(row_csv))
+        print(f"♻️ {len(diff.carried)}/{diff.matched_rows} rows unchanged since {previous['records_path']}")
+    return manifest, previous, diff
+
+def write_carried_rows(json_file, is_first, file_lock, previous, diff, manifest):
+    """Stream the records of the carried rows from the previous output; returns the number written.
+
+    Carried rows whose records cannot be read go back to extraction, so
+    `diff.carried` is final afterwards.
+    """
+    written = 0
+    carried_counts = {}
+    if diff.carried:
+        for idx, record in iter_carried_records(previous["records_path"], diff.carried):
+            if idx not in carried_counts:
+                carried_counts[idx] = [written, 0]
+            carried_counts[idx][1] += 1
+            write_json_record_to_file(json_file, record, is_first, file_lock)
+            written += 1
+    for idx, entry in list(diff.carried.items()):
+        if idx in carried_counts:
+            manifest.add(idx, entry["row_hash"], entry["row_key"], *carried_counts[idx])
+        else:
+            diff.uncarry(idx)
+    diff.finish()
+    return written
+
+def finish_row_manifest(output_subfolder, manifest, diff):
+    """Write the row manifest and diff summary of a finished freight_rates.json and drop the previous version"""
+    manifest.write(output_subfolder)
+    summary = diff.summary()
+    write_json_atomic(os.path.join(output_subfolder, DIFF_SUMMARY_FILENAME), summary)
+    discard_previous_version(output_subfolder)
+    return summary
+
+class ValidationLog:
+    """Rows whose records still fail schema validation, as `validation_errors.jsonl` (created on first use)"""
+
+    def __init__(self, output_subfolder):
+        self.path = os.path.join(output_subfolder, VALIDATION_ERRORS_FILENAME)
+        self._file = None
+        self.rows = 0
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def add(self, idx, errors):
+        if not errors:
+            return
+        if self._file is None:
+            self._file = open(self.path, "w", encoding="utf-8")
+        self._file.write(json.dumps({"row_index": idx, "errors": errors}, ensure_ascii=False) + "\n")
+        self.rows += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            print(f"⚠️ {self.rows} row(s) with schema errors, see {self.path}")
+
+def process_subfolder_pair_incremental(subfolder_path, subfolder_name, extraction_prompt_path, output_base_folder,context_filter_prompt_path=None, progress=None, tracer=None, incremental=None, executor=None, router=None, hedger=None):
+    """Process a single subfolder with incremental JSON writing.
+
+    Rows whose content is unchanged since a previous version of the same table
+    (see incremental.py) are carried over instead of sent to the model, unless
+    `incremental` is False (defaults to EXTRACTION_INCREMENTAL). Model calls run
+    on `executor` if given (e.g. a shared batch pool), else on a private pool,
+    through `router` if given (see model_router.py), hedged by `hedger` if given
+    (see hedging.py).
+    """
+    print(f"\n📁 Processing subfolder: {subfolder_name}")
 
+    # Create output subfolder
+    output_subfolder = os.path.join(output_base_folder, subfolder_name)
+    os.makedirs(output_subfolder, exist_ok=True)
+    
+    try:
+        prepared = prepare_subfolder_extraction(
+            subfolder_path, subfolder_name, extraction_prompt_path, output_subfolder,
+            context_filter_prompt_path=context_filter_prompt_path
+        )
+        if prepared is None:
+            return False
+        freight_file, extraction_prompt = prepared
 
-        extraction_prompt = extraction_prompt_template.replace("{{METADATA_CONTEXT_HERE}}", filtered_context_csv)
-        extraction_prompt = extraction_prompt.replace("{{HEADER_REFRENCE}}", header_reference_csv)
+        # Match the rows against the previous version, if any
+        manifest, previous, diff = match_previous_version(
+            subfolder_path, output_subfolder, extraction_prompt_path, freight_file, incremental)
         
         # Output file path
         freight_rates_output_path = os.path.join(output_subfolder, "freight_rates.json")
         
-        print(f"🔄 Processing {len(df_freight)} rows for {subfolder_name}...")
         print(f"📝 Writing results incrementally to: {freight_rates_output_path}")
         
         # Open JSON file for incremental writing
@@ -243,69 +657,235 @@ def process_subfolder_pair_incremental(subfolder_path, subfolder_name, extractio
             
             is_first = [True]  # Use list to make it mutable for nested function
             file_lock = threading.Lock()  # Thread-safe file writing
+            validation_log = ValidationLog(output_subfolder)
+
+            # Unchanged rows first, streamed from the previous output
+            written = write_carried_rows(json_file, is_first, file_lock, previous, diff, manifest)
+
+            if previous is not None:
+                print(f"🔄 Processing {diff.matched_rows - len(diff.carried)} rows for {subfolder_name}...")
+                if progress is not None:
+                    progress.start_sheet(subfolder_name, diff.matched_rows - len(diff.carried))
+            else:
+                print(f"🔄 Processing every row for {subfolder_name}...")
+                if progress is not None:
+                    progress.start_sheet(subfolder_name)
             
+            # Rows stream from the sheet into a bounded window of in-flight requests
+            def tasks():
+                for idx, row_csv in iter_freight_rows(freight_file):
+                    if idx in diff.carried:
+                        continue
+                    row_hash, key = text_hash(row_csv), row_key(row_csv)
+                    diff.add_extracted(key)
+                    span = tracer.row(subfolder_name, idx) if tracer is not None else None
+                    yield (idx, row_hash, key, span), call_with_progress, progress, subfolder_name, extraction_prompt, row_csv, span, router, hedger
+
             # Process with ThreadPoolExecutor
-            with ThreadPoolExecutor(max_workers=5) as executor:
-                # Submit all tasks
-                future_to_row = {}
-                
-                for idx, row in df_freight.iterrows():
-                    # Convert current row to CSV
-                    row_csv = row.to_frame().T.to_csv(index=False, header=False)
-                    
-                    # Prepare extraction prompt
-                    # extraction_prompt = extraction_prompt_template.replace("{{TABULAR_DATA_CHUNK_HERE}}", row_csv)
-                    
-                    future = executor.submit(call_nova_pro_converse_cached, extraction_prompt, row_csv)
-                    future_to_row[future] = idx
-                
+            pool = nullcontext(executor) if executor is not None else ThreadPoolExecutor(max_workers=EXTRACTION_MAX_WORKERS)
+            with pool as pool_executor:
                 # Process results as they complete
-                for future in as_completed(future_to_row):
-                    idx = future_to_row[future]
+                for (idx, row_hash, key, span), future in iter_bounded_completions(pool_executor, tasks()):
+                    if span is not None:
+                        span.mark("collected")
+                    usage = None
+                    failed = False
                     try:
                         result,usage = future.result()
                         print("Cache hit?       ", usage.get("promptCacheHit"))
                         print("Cached tokens    ", usage.get("cachedTokens"))
                         print("Input tokens     ", usage.get("inputTokens"))
 
-                        # Parse JSON response
-                        try:
-                            records = json.loads(result)
-                        except json.JSONDecodeError:
-                            try:
-                                records = extract_json_from_backticks(result)
-                            except:
-                                records = [{"raw_response": result, "row_index": idx}]
-                        
                         # Write each record immediately
-                        if isinstance(records, list):
-                            for record in records:
-                                write_json_record_to_file(json_file, record, is_first, file_lock)
-                            print(f"✅ {subfolder_name} - Row {idx} → Wrote {len(records)} JSON object(s) to file")
-                        else:
-                            write_json_record_to_file(json_file, records, is_first, file_lock)
-                            print(f"✅ {subfolder_name} - Row {idx} → Wrote 1 JSON object to file")
+                        records = parse_extraction_result(result, idx)
+                        failed = any(is_failed_record(record) for record in records)
+                        if span is not None:
+                            span.mark("parsed")
+                        for record in records:
+                            write_json_record_to_file(json_file, record, is_first, file_lock, span)
+                        manifest.add(idx, row_hash, key, written, len(records), failed)
+                        written += len(records)
+                        validation_log.add(idx, usage.get("validationErrors"))
+                        print(f"✅ {subfolder_name} - Row {idx} → Wrote {len(records)} JSON object(s) to file")
                             
                     except Exception as e:
                         print(f"❌ Error processing row {idx} in {subfolder_name}: {e}")
                         error_record = {"error": str(e), "row_index": idx, "subfolder": subfolder_name}
-                        write_json_record_to_file(json_file, error_record, is_first, file_lock)
+                        if span is not None:
+                            span.set(error=type(e).__name__)
+                            span.mark("parsed")
+                        write_json_record_to_file(json_file, error_record, is_first, file_lock, span)
+                        manifest.add(idx, row_hash, key, written, 1, True)
+                        written += 1
+                        failed = True
+                    if span is not None:
+                        span.end(failed=failed)
+                    if progress is not None:
+                        progress.row_finished(subfolder_name, failed=failed, usage=usage)
             
             # Close JSON array
             json_file.write("\n]")
             json_file.flush()
+            validation_log.close()
+
+        summary = finish_row_manifest(output_subfolder, manifest, diff)
         
         print(f"✅ Successfully completed {subfolder_name}")
         print(f"💾 Final JSON file saved: {freight_rates_output_path}")
+        print(f"🧮 Rows: {summary['unchanged']} unchanged, {summary['changed']} changed, "
+              f"{summary['added']} added, {summary['removed']} removed")
+        if progress is not None:
+            progress.finish_sheet(subfolder_name)
         
         return True
         
     except Exception as e:
         print(f"❌ Error processing {subfolder_name}: {e}")
+        if progress is not None:
+            progress.finish_sheet(subfolder_name, success=False)
+        return False
+
+def collect_failed_rows(output_main_folder):
+    """Scan an output folder and return {subfolder_name: [row_index, ...]} for failed rows"""
+    failed = {}
+    if not os.path.isdir(output_main_folder):
+        return failed
+    for subfolder_name in sorted(os.listdir(output_main_folder)):
+        output_path = os.path.join(output_main_folder, subfolder_name, "freight_rates.json")
+        if not os.path.exists(output_path):
+            continue
+        try:
+            row_indices = sorted({record["row_index"] for record in iter_json_records(output_path)
+                                  if is_failed_record(record)})
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"⚠️ Could not read {output_path}: {e}")
+            continue
+        if row_indices:
+            failed[subfolder_name] = row_indices
+    return failed
+
+def splice_records(records, replacements):
+    """Replace the failed placeholder of each retried row with its new records, in place"""
+    spliced = []
+    replaced = set()
+    for record in records:
+        if is_failed_record(record) and record["row_index"] in replacements:
+            idx = record["row_index"]
+            if idx not in replaced:
+                spliced.extend(replacements[idx])
+                replaced.add(idx)
+            continue
+        spliced.append(record)
+    return spliced
+
+def retry_subfolder_failures(subfolder_path, subfolder_name, row_indices, extraction_prompt_path,
+                             output_base_folder, context_filter_prompt_path=None, progress=None):
+    """Re-extract only the given rows of a subfolder and splice them into freight_rates.json"""
+    print(f"\n🔁 Retrying {len(row_indices)} failed row(s) in {subfolder_name}")
+    output_subfolder = os.path.join(output_base_folder, subfolder_name)
+    freight_rates_output_path = os.path.join(output_subfolder, "freight_rates.json")
+
+    try:
+        prepared = prepare_subfolder_extraction(
+            subfolder_path, subfolder_name, extraction_prompt_path, output_subfolder,
+            context_filter_prompt_path=context_filter_prompt_path,
+            reuse_filtered_context=True
+        )
+        if prepared is None:
+            return False
+        freight_file, extraction_prompt = prepared
+        if progress is not None:
+            progress.start_sheet(subfolder_name, len(row_indices))
+
+        wanted = set(row_indices)
+
+        def tasks():
+            for idx, row_csv in iter_freight_rows(freight_file):
+                if idx in wanted:
+                    wanted.discard(idx)
+                    yield idx, call_with_progress, progress, subfolder_name, extraction_prompt, row_csv
+
+        replacements = {}
+        with ThreadPoolExecutor(max_workers=EXTRACTION_MAX_WORKERS) as executor:
+            for idx, future in iter_bounded_completions(executor, tasks()):
+                usage = None
+                try:
+                    result, usage = future.result()
+                    replacements[idx] = parse_extraction_result(result, idx)
+                    print(f"✅ {subfolder_name} - Row {idx} → Re-extracted {len(replacements[idx])} JSON object(s)")
+                except Exception as e:
+                    print(f"❌ Error retrying row {idx} in {subfolder_name}: {e}")
+                    replacements[idx] = [{"error": str(e), "row_index": idx, "subfolder": subfolder_name}]
+                if progress is not None:
+                    failed = any(is_failed_record(r) for r in replacements[idx])
+                    progress.row_finished(subfolder_name, failed=failed, usage=usage)
+
+        for idx in sorted(wanted):
+            print(f"⚠️ Row {idx} no longer exists in {subfolder_name}, skipping")
+
+        records = splice_records(iter_json_records(freight_rates_output_path), replacements)
+
+        # Write to a temp file first so a crash never leaves a half-written output
+        tmp_path = freight_rates_output_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("[\n")
+            f.write(",\n".join(json.dumps(record, ensure_ascii=False, indent=2) for record in records))
+            f.write("\n]")
+        os.replace(tmp_path, freight_rates_output_path)
+        update_manifest_after_retry(output_subfolder, replacements, is_failed_record)
+
+        still_failed = sum(1 for recs in replacements.values() if any(is_failed_record(r) for r in recs))
+        print(f"💾 Spliced {len(replacements)} row(s) into {freight_rates_output_path} ({still_failed} still failing)")
+        if progress is not None:
+            progress.finish_sheet(subfolder_name)
+        return True
+
+    except Exception as e:
+        print(f"❌ Error retrying {subfolder_name}: {e}")
+        if progress is not None:
+            progress.finish_sheet(subfolder_name, success=False)
         return False
 
-def process_main_folder_structure_incremental(main_folder_path, extraction_prompt_path, context_filter_prompt_path=None):
-    """Process main folder with incremental JSON writing"""
+def retry_failed_rows_incremental(main_folder_path, extraction_prompt_path, context_filter_prompt_path=None, progress=None):
+    """Re-extract only the failed or unparseable rows of a previous run"""
+    main_folder_name = os.path.basename(main_folder_path.rstrip('/\\'))
+    output_main_folder = f"{main_folder_name}_output"
+
+    failed = collect_failed_rows(output_main_folder)
+    if not failed:
+        print(f"✅ No failed rows found in {output_main_folder}")
+        return {}
+
+    print(f"🔁 Found {sum(len(v) for v in failed.values())} failed row(s) across {len(failed)} subfolder(s)")
+    if progress is not None:
+        for subfolder_name, row_indices in failed.items():
+            progress.register_sheet(subfolder_name, len(row_indices))
+    for subfolder_name, row_indices in failed.items():
+        subfolder_path = os.path.join(main_folder_path, subfolder_name)
+        if not os.path.isdir(subfolder_path):
+            print(f"⚠️ Input subfolder missing, cannot retry: {subfolder_path}")
+            continue
+        retry_subfolder_failures(
+            subfolder_path=subfolder_path,
+            subfolder_name=subfolder_name,
+            row_indices=row_indices,
+            extraction_prompt_path=extraction_prompt_path,
+            output_base_folder=output_main_folder,
+            context_filter_prompt_path=context_filter_prompt_path,
+            progress=progress
+        )
+    return failed
+
+def process_main_folder_structure_incremental(main_folder_path, extraction_prompt_path, context_filter_prompt_path=None, progress=None, tracer=None, incremental=None, executor=None, router=None, hedger=None):
+    """Process main folder with incremental JSON writing.
+
+    `tracer` (see tracing.py) records a lifecycle span for every row.
+    `incremental=False` re-extracts every row even if a previous version of the
+    ratesheet was extracted before. `executor` runs the model calls of every
+    subfolder (see shared_pool.py for batch jobs); `router` picks the model
+    tier of every row (see model_router.py) and `hedger` duplicates slow
+    calls (see hedging.py).
+    """
     
     if not os.path.exists(main_folder_path):
         print(f"❌ Main folder does not exist: {main_folder_path}")
@@ -320,7 +900,7 @@ def process_main_folder_structure_incremental(main_folder_path, extraction_promp
     subfolders = []
     for item in os.listdir(main_folder_path):
         item_path = os.path.join(main_folder_path, item)
-        if os.path.isdir(item_path):
+        if os.path.isdir(item_path) and not is_shared_folder(item):
             subfolders.append((item_path, item))
     
     if not subfolders:
@@ -331,6 +911,15 @@ def process_main_folder_structure_incremental(main_folder_path, extraction_promp
     print(f"📁 Input folder: {main_folder_path}")
     print(f"📁 Output folder: {output_main_folder}")
     print("📝 JSON files will be written incrementally as results are received")
+
+    # Register every sheet up front so the ETA covers the whole job
+    if progress is not None:
+        for subfolder_path, subfolder_name in subfolders:
+            try:
+                progress.register_sheet(subfolder_name, count_freight_rows(subfolder_path))
+            except Exception as e:
+                print(f"⚠️ Could not count rows in {subfolder_name}: {e}")
+                progress.register_sheet(subfolder_name, 0)
     
     successful_subfolders = 0
     failed_subfolders = 0
@@ -341,13 +930,21 @@ def process_main_folder_structure_incremental(main_folder_path, extraction_promp
             subfolder_name=subfolder_name,
             extraction_prompt_path=extraction_prompt_path,
             output_base_folder=output_main_folder,
-            context_filter_prompt_path=context_filter_prompt_path
+            context_filter_prompt_path=context_filter_prompt_path,
+            progress=progress,
+            tracer=tracer,
+            incremental=incremental,
+            executor=executor,
+            router=router,
+            hedger=hedger
         )
         
         if success:
             successful_subfolders += 1
         else:
             failed_subfolders += 1
+
+    write_job_diff_summary(output_main_folder)
     
     # print(f"\n🎯 Final Processing Summary:")
     # print(f"   ✅ Successfully processed: {successful_subfolders} subfolders")
@@ -0,0 +1,41 @@
+# Output schema of the freight rate extraction prompt (f9.txt), in prompt order.
+
+RECORD_FIELDS = [
+    "carrier", "carrier_tariff_number", "amendment_number", "service_type", "leg",
+    "service_mode_origin", "service_mode_destination", "haulage_mode_origin", "haulage_mode_destination",
+    "origin_cy_code", "origin_cy_name", "destination_cy_code", "destination_cy_name",
+    "via_port_origin", "via_port_destination", "routing_info", "transit_time_days",
+    "cargo_type", "commodity", "disallow_hazardous_surcharge", "imo_classes",
+    "valid_from", "valid_to", "payment_term",
+    "demurrage_free_days", "detention_free_days", "storage_free_days",
+    "inclusions_codes", "inclusions_remarks",
+    "subject_to_codes", "not_applicable_codes", "remarks", "on_request",
+    "freight_currency", "freight_rates",
+]
+
+LIST_FIELDS = {"demurrage_free_days", "detention_free_days", "storage_free_days", "freight_rates"}
+DATE_FIELDS = {"valid_from", "valid_to"}
+BOOL_FIELDS = {"disallow_hazardous_surcharge"}
+
+
+def empty_record():
+    """A record with every schema field present and empty"""
+    return {
+        field: [] if field in LIST_FIELDS else False if field in BOOL_FIELDS else ""
+        for field in RECORD_FIELDS
+    }
+
+# Allowed values of the enum fields ("" = not specified)
+ENUM_FIELDS = {
+    "leg": {"", "L1", "L2", "L3", "L4"},
+    "payment_term": {"", "PP", "CC"},
+    "haulage_mode_origin": {"", "Truck", "Rail / Truck", "Rail", "Barge"},
+    "haulage_mode_destination": {"", "Truck", "Rail / Truck", "Rail", "Barge"},
+}
+MANDATORY_FIELDS = {"carrier"}
+CURRENCY_FIELDS = {"freight_currency"}
+
+# FreeDay objects in demurrage_free_days / detention_free_days / storage_free_days
+FREEDAY_FIELDS = {"demurrage_free_days", "detention_free_days", "storage_free_days"}
+FREEDAY_TYPES = {"demurrage", "detention", "storage", "combined", "DnD"}
+DAY_TYPES = {"Calendar", "Working"}
@@ -1,15 +1,27 @@
 import streamlit as st
-import pandas as pd
 import os
 import io
 import zipfile
 import json
-import subprocess
-import sys
 import time
-import openpyxl
-from extraction import process_main_folder_structure_incremental
-from preprocessing_freightrates import FreightTableExtractor
+# pandas, openpyxl and the extraction/preprocessing modules are imported where
+# they are used: jobs run in worker_service, and keeping them out of the module
+# top level keeps Streamlit session start-up cheap (see benchmarks/bench_import_time.py).
+from worker_service import enqueue_job, ensure_worker_running, get_job, queue_position
+from progress import read_json_file
+from sheet_classifier import apply_ignored, classify_workbook
+
+PROGRESS_REFRESH_SECONDS = 2
+# Start parsing an uploaded workbook before "Process" is clicked
+SPECULATIVE_PREPROCESSING = os.getenv("SPECULATIVE_PREPROCESSING", "1").lower() not in ("0", "false", "no")
+SHEET_LABELS = {
+    "freight": "📈 Freight rates",
+    "freetime": "⏱️ Free time (context)",
+    "rules": "📜 Rules / policy (context)",
+    "surcharges": "💲 Surcharges",
+    "empty": "∅ Empty",
+    "ignored": "🚫 Ignored",
+}
 
 st.title("Freightify - Excel processor")
 
@@ -30,9 +42,11 @@ st.title("Freightify - Excel processor")
 
 def sheetname_checkbox(file_path):
     try:
-        # Load workbook and get sheet names
-        wb = openpyxl.load_workbook(file_path, data_only=True)
-        sheet_names = wb.sheetnames
+        # Sheet names, sizes and labels from one fuzzy pass over the xlsx package,
+        # cached by workbook hash (see sheet_classifier.py)
+        plan = classify_workbook(file_path)
+        sheets = plan["sheets"]
+        sheet_names = [sheet["name"] for sheet in sheets]
         
         st.success(f"File uploaded successfully! Found {len(sheet_names)} sheet(s)")
         
@@ -42,9 +56,29 @@ def sheetname_checkbox(file_path):
         st.session_state.ignored_sheets = []
         
         # Create checkboxes in sidebar
-        for sheet_name in sheet_names:
-            if st.sidebar.checkbox(sheet_name, key=f"sheet_{sheet_name}"):
+        for sheet in sheets:
+            sheet_name = sheet["name"]
+            size = f"{sheet['max_row']} rows × {sheet['max_column']} columns" if sheet["max_row"] else None
+            if st.sidebar.checkbox(sheet_name, key=f"sheet_{sheet_name}", help=size):
                 st.session_state.ignored_sheets.append(sheet_name)
+
+        # Classification plan the job will use, shown before processing starts
+        plan = apply_ignored(plan, st.session_state.ignored_sheets)
+        st.session_state.sheet_plan = plan
+        with st.expander("🗂️ Sheet classification", expanded=True):
+            st.dataframe(
+                [
+                    {
+                        "sheet": sheet["name"],
+                        "treated as": SHEET_LABELS[sheet["label"]],
+                        "size": f"{sheet['max_row']} × {sheet['max_column']}" if sheet["max_row"] else "–",
+                        **{f"{category} match": score for category, score in sheet["scores"].items()},
+                    }
+                    for sheet in plan["sheets"]
+                ],
+                use_container_width=True,
+                hide_index=True,
+            )
         
         # Show results in main area
         if st.session_state.ignored_sheets:
@@ -59,6 +93,41 @@ def sheetname_checkbox(file_path):
     except Exception as e:
         st.error(f"Error reading Excel file: {str(e)}")
 
+def format_duration(seconds):
+    if seconds is None:
+        return "–"
+    minutes, secs = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m" if hours else f"{minutes}m {secs:02d}s"
+
+@st.fragment(run_every=PROGRESS_REFRESH_SECONDS)
+def show_progress(file_stem):
+    """Small auto-refreshing progress panel; reruns the whole app once the job is done"""
+    status_data = read_json_file(f"{file_stem}_status.json")
+    if status_data and status_data.get('status') != 'processing':
+        st.rerun()
+
+    progress_data = read_json_file(f"{file_stem}_progress.json")
+    if not progress_data or not progress_data.get('rows_total'):
+        st.caption("Waiting for the first rows to be dispatched...")
+        return
+
+    rows_total = progress_data['rows_total']
+    rows_done = progress_data['rows_done']
+    st.progress(min(1.0, rows_done / rows_total), text=f"{rows_done}/{rows_total} rows")
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Rows/s", f"{progress_data['rows_per_second']:.2f}")
+    col2.metric("Tokens/s", f"{progress_data['tokens_per_second']:.0f}")
+    col3.metric("ETA", format_duration(progress_data.get('eta_seconds')))
+    col4.metric("Failed", progress_data['rows_failed'])
+
+    with st.expander("Per-sheet progress"):
+        st.dataframe(
+            [{"sheet": name, **counters} for name, counters in progress_data['sheets'].items()],
+            use_container_width=True
+        )
+
 uploaded_file = st.file_uploader("Upload an Excel file", type=["xlsx", "xls"])
 if uploaded_file is not None:
     # Create folder if it doesn't exist
@@ -72,6 +141,14 @@ if uploaded_file is not None:
         f.write(uploaded_file.getbuffer())
     
     st.success(f"File saved to: {file_path}")
+    # Parse and unmerge the sheets in the background while the options below are chosen
+    # (see sheet_cache.py). Negative priority: it only runs when no real job is queued, and
+    # processing this file before it started cancels it
+    upload_key = (uploaded_file.name, uploaded_file.size)
+    if SPECULATIVE_PREPROCESSING and st.session_state.get("warmed_upload") != upload_key:
+        enqueue_job({'mode': 'warm', 'file_path': file_path}, priority=-10)
+        ensure_worker_running()
+        st.session_state.warmed_upload = upload_key
     #choose sheets to process
     sheetname_checkbox(file_path)
 
@@ -182,6 +259,54 @@ custom_terms = {
     'logistics': parse_custom_terms(custom_logistics)
 }
 
+with st.sidebar.expander("🛠️ Diagnostics"):
+    profile_mode = st.selectbox(
+        "Profile preprocessing",
+        ["Off", "sampling", "cprofile"],
+        help="Writes a per-job profile report to the _profile folder of the outputs. "
+             "Sampling has little overhead; cProfile is exact but slows preprocessing down.",
+        key="profile_mode",
+    )
+    trace_rows = st.checkbox(
+        "Trace extraction rows",
+        help="Records queue, model, parse and write times of every row to the _trace folder of the outputs.",
+        key="trace_rows",
+    )
+
+reuse_rows = st.sidebar.checkbox(
+    "♻️ Reuse unchanged rows from earlier versions",
+    value=True,
+    help="When an amended version of an already extracted ratesheet is uploaded, only new and "
+         "changed rows are sent to the model; see diff_summary.json in the outputs. A changed "
+         "context (validity, carrier, free time) re-extracts every row.",
+    key="reuse_rows",
+)
+extract_surcharges = st.sidebar.checkbox(
+    "💲 Extract surcharge sheets",
+    help="Extracts the workbook's surcharge sheets alongside the freight rates, into surcharges.json "
+         "next to each sheet's freight_rates.json. Adds a second pass of model calls.",
+    key="extract_surcharges",
+)
+route_models = st.sidebar.checkbox(
+    "⚡ Route simple rows to a smaller model",
+    help="Rows go to Nova Lite first and are escalated to Nova Pro or Claude only when the output "
+         "fails schema validation; see routing_stats.json in the outputs.",
+    key="route_models",
+)
+hedge_calls = st.sidebar.checkbox(
+    "🏁 Hedge slow model calls",
+    help="Re-issues a row's request when it runs longer than 95% of recent calls and keeps whichever "
+         "answer arrives first. Adds at most 5% extra calls; see hedging_stats.json in the outputs.",
+    key="hedge_calls",
+)
+distribute_rows = st.sidebar.checkbox(
+    "🌐 Share rows with queue workers",
+    help="Publishes the rows to the shared work queue so queue workers (python work_queue.py worker) "
+         "extract them alongside this job. The queue is a SQLite file: single host only, workers must "
+         "run on this server, not on other machines or a network share.",
+    key="distribute_rows",
+)
+
 # Show preview of custom terms if any are added - in sidebar
 if any(custom_terms.values()):
     st.sidebar.subheader("🔍 Custom Terms Preview")
@@ -236,27 +361,32 @@ if uploaded_file is not None:
                 'file_path': file_path,
                 'ignored_sheets': st.session_state.ignored_sheets,
                 'custom_terms': custom_terms,
-                'file_stem': file_stem
+                'file_stem': file_stem,
+                'profile': None if profile_mode == "Off" else profile_mode,
+                'trace': trace_rows or None,
+                'incremental': None if reuse_rows else False,
+                'surcharges': extract_surcharges or None,
+                'routing': route_models or None,
+                'hedge': hedge_calls or None,
+                'distributed': distribute_rows or None,
+                'sheet_plan': st.session_state.get('sheet_plan')
             }
             
-            # Save parameters to JSON file
-            params_file = f"{file_stem}_params.json"
-            with open(params_file, 'w') as f:
-                json.dump(params, f)
-            
-            # Start background process
-            process = subprocess.Popen([
-                sys.executable, "background_processor.py", params_file
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            # Clear any status left over from a previous run of the same file
+            for stale_file in (f"{file_stem}_status.json", f"{file_stem}_progress.json"):
+                if os.path.exists(stale_file):
+                    os.remove(stale_file)
+
+            # Hand the job to the background worker
+            st.session_state.job_id = enqueue_job(params)
+            ensure_worker_running()
             
             st.session_state.is_processing = True
             st.session_state.process_started = True
-            st.success("🚀 Processing started in background! Use the refresh button below to check status.")
+            st.success("🚀 Processing queued in background! Use the refresh button below to check status.")
             
-        except FileNotFoundError:
-            st.error("❌ Error: background_processor.py not found. Please ensure the file exists.")
         except Exception as e:
-            st.error(f"❌ Error starting background process: {str(e)}")
+            st.error(f"❌ Error queueing background job: {str(e)}")
 
     # Status checking and refresh button
     if st.session_state.process_started:
@@ -279,21 +409,19 @@ if uploaded_file is not None:
                         step = status_data.get('step', 'unknown')
                         if step == 'preprocessing':
                             st.info("⏳ Step 1/2: Preprocessing freight rates...")
+                        elif step == 'export':
+                            st.info("⏳ Exporting Parquet files and archive...")
+                        elif step == 'retry':
+                            st.info("⏳ Re-extracting failed rows...")
+                            show_progress(st.session_state.file_stem)
                         elif step == 'extraction':
                             # st.info("⏳ Step 2/2: Extracting data...")
                             st.info("""
                                     ⏳ Step 2/2: Extracting data...
-                                    
-                                    ⏳ **Processing in Progress**
 
-                                    Please note that this operation may take several minutes to complete, depending on the size and complexity of your file.
-
-                                    - **Do not refresh or close the browser tab during processing.**
-                                    - You may safely navigate away and return later to check the results.
-                                    - To check the current status, please click the **"Refresh Status"** button when you return.
-
-                                    Thank you for your patience!
+                                    Progress below refreshes automatically. You may safely navigate away and return later to check the results.
                                     """)
+                            show_progress(st.session_state.file_stem)
                         else:
                             st.info("⏳ Processing...")
                             
@@ -305,7 +433,7 @@ if uploaded_file is not None:
                         # Clean up temporary files
                         try:
                             os.remove(status_file)
-                            os.remove(f"{st.session_state.file_stem}_params.json")
+                            os.remove(f"{st.session_state.file_stem}_progress.json")
                         except:
                             pass
                             
@@ -321,7 +449,7 @@ if uploaded_file is not None:
                         # Clean up temporary files
                         try:
                             os.remove(status_file)
-                            os.remove(f"{st.session_state.file_stem}_params.json")
+                            os.remove(f"{st.session_state.file_stem}_progress.json")
                         except:
                             pass
                             
@@ -330,7 +458,13 @@ if uploaded_file is not None:
                 except Exception as e:
                     st.error(f"❌ Error reading status: {str(e)}")
             else:
-                st.info("⏳ Starting background process...")
+                job = get_job(st.session_state.job_id) if st.session_state.get("job_id") else None
+                if job and job['status'] == 'queued':
+                    position = queue_position(job['id'])
+                    st.info(f"⏳ Job queued ({position} job(s) ahead)...")
+                    ensure_worker_running()
+                else:
+                    st.info("⏳ Starting background process...")
 
     # Simple download button
     if st.session_state.show_download and not st.session_state.is_processing:
@@ -340,6 +474,39 @@ if uploaded_file is not None:
         
         root_folder = output_main_folder
 
+        # Single download with every artifact of the job (JSON outputs + Parquet exports)
+        archive_path = f"{output_main_folder}.zip"
+        if os.path.exists(archive_path):
+            with open(archive_path, "rb") as archive:
+                st.download_button(
+                    label=f"📦 Download All Files as ZIP ({os.path.getsize(archive_path) // 1024} KB)",
+                    data=archive,
+                    file_name=os.path.basename(archive_path),
+                    mime="application/zip"
+                )
+
+        # Offer to re-extract only the rows that failed or could not be parsed
+        from result_viewer import failed_rows_summary
+        failed_rows = failed_rows_summary(output_main_folder)
+        if failed_rows:
+            failed_count = sum(len(rows) for rows in failed_rows.values())
+            st.warning(f"⚠️ {failed_count} row(s) failed or could not be parsed in {len(failed_rows)} sheet(s)")
+            with st.expander("View failed rows"):
+                for subfolder_name, rows in failed_rows.items():
+                    st.write(f"**{subfolder_name}:** {', '.join(str(r) for r in rows)}")
+            if st.button("🔁 Retry Failed Rows", type="secondary"):
+                try:
+                    # Retries are small, let them jump ahead of full jobs
+                    st.session_state.job_id = enqueue_job({'mode': 'retry_failures', 'file_stem': file_stem}, priority=10)
+                    ensure_worker_running()
+
+                    st.session_state.is_processing = True
+                    st.session_state.process_started = True
+                    st.session_state.show_download = False
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"❌ Error starting retry: {str(e)}")
+
         # # Initialize session state for selected file display
         # if "selected_json_file" not in st.session_state:
         #     st.session_state.selected_json_file = None
@@ -431,22 +598,9 @@ if uploaded_file is not None:
         if "selected_json_file" not in st.session_state:
             st.session_state.selected_json_file = None
 
-        # Organize JSON files by folder
-        json_files_by_folder = {}
-        for dirpath, dirnames, filenames in os.walk(root_folder):
-            json_files_in_folder = []
-            for file in filenames:
-                if file.endswith(".json"):
-                    file_path = os.path.join(dirpath, file)
-                    json_files_in_folder.append({
-                        "file_name": file,
-                        "file_path": file_path
-                    })
-            
-            if json_files_in_folder:
-                relative_path = os.path.relpath(dirpath, root_folder)
-                folder_name = "Root" if relative_path == "." else relative_path
-                json_files_by_folder[folder_name] = json_files_in_folder
+        # Organize JSON files by folder (cached, see result_viewer)
+        from result_viewer import list_output_files, render_result_viewer
+        json_files_by_folder = list_output_files(root_folder)
 
         if json_files_by_folder:
             st.subheader("📁 Processed Files")
@@ -470,55 +624,22 @@ if uploaded_file is not None:
                                     "folder": folder_name
                                 }
             
-            # Display selected file content (same as above)
+            # Display selected file content
             if st.session_state.selected_json_file:
-                # ... (same display logic as previous example)
                 selected_file = st.session_state.selected_json_file
                 
                 st.markdown("---")
-                # st.subheader(f"📄 {selected_file['display_name']}")
                 display_name = f"{selected_file['folder']}/{selected_file['file_name']}" if selected_file['folder'] != "Root" else selected_file['file_name']
                 st.subheader(f"📄 {display_name}")
-                
-                try:
-                    with open(selected_file['file_path'], "r", encoding="utf-8") as f:
-                        data = json.load(f)
-
-                    # Add a clear button
-                    col1, col2 = st.columns([1, 4])
-                    with col1:
-                        if st.button("❌ Clear View", key="clear_json_view"):
-                            st.session_state.selected_json_file = None
-                            st.rerun()
-                    
-                    # Normalize and display JSON data
-                    if isinstance(data, dict):
-                        df = pd.json_normalize(data)
-                    elif isinstance(data, list):
-                        df = pd.json_normalize(data)
-                    else:
-                        df = pd.DataFrame([data])
-
-                    # Display as both table and raw JSON
-                    tab1, tab2 = st.tabs(["📊 Table View", "📋 Raw JSON"])
-                    
-                    with tab1:
-                        st.dataframe(df, use_container_width=True)
-                        
-                        # # Add download button for this specific file
-                        # csv_data = df.to_csv(index=False)
-                        # st.download_button(
-                        #     label=f"📥 Download {selected_file['file_name']} as CSV",
-                        #     data=csv_data,
-                        #     file_name=f"{os.path.splitext(selected_file['file_name'])[0]}.csv",
-                        #     mime="text/csv"
-                        # )
-                    
-                    with tab2:
-                        st.json(data)
 
-                except Exception as e:
-                    st.error(f"❌ Error reading {selected_file['file_path']}: {e}")
+                # Add a clear button
+                col1, col2 = st.columns([1, 4])
+                with col1:
+                    if st.button("❌ Clear View", key="clear_json_view"):
+                        st.session_state.selected_json_file = None
+                        st.rerun()
+
+                render_result_viewer(selected_file['file_path'], key="result_view")
         else:
             st.warning("⚠️ No JSON files found in the output folder.")
 
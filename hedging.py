@@ -0,0 +1,162 @@
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from progress import write_json_atomic
+from rate_limiter import on_quota_acquired
+from tracing import percentile
+
+# Request hedging for row extraction calls.
+#
+# A call that is still running after the rolling p95 latency of recent calls
+# gets a duplicate; whichever finishes first is used. A duplicate that has not
+# started yet is cancelled; one already in flight cannot be interrupted (boto3
+# has no cancellation), so its response is simply discarded. Hedges are capped
+# at EXTRACTION_HEDGE_MAX_RATE of all calls to keep the extra cost bounded.
+#
+# Only time past the rate limiter counts, both in the latency samples and
+# towards the hedge delay: a call waiting for quota is not slow, and hedging it
+# would only add load to the limiter that is holding it back.
+#
+# Enabled per job with the `hedge` param or EXTRACTION_HEDGE=1; counters go to
+# `{output_main_folder}/hedging_stats.json`.
+
+HEDGING_STATS_FILENAME = "hedging_stats.json"
+EXTRACTION_HEDGE_QUANTILE = float(os.getenv("EXTRACTION_HEDGE_QUANTILE", "0.95"))
+EXTRACTION_HEDGE_MAX_RATE = float(os.getenv("EXTRACTION_HEDGE_MAX_RATE", "0.05"))
+EXTRACTION_HEDGE_MIN_SAMPLES = int(os.getenv("EXTRACTION_HEDGE_MIN_SAMPLES", "20"))
+# Threads running primaries and hedges; callers only wait on them
+EXTRACTION_HEDGE_POOL_SIZE = int(os.getenv("EXTRACTION_HEDGE_POOL_SIZE", "64"))
+LATENCY_WINDOW = 500
+
+
+def hedging_enabled(requested=None):
+    """Job param wins; otherwise EXTRACTION_HEDGE=1 turns hedging on"""
+    if requested is not None:
+        return bool(requested)
+    return os.getenv("EXTRACTION_HEDGE", "").lower() in ("1", "true", "yes")
+
+
+class HedgedCaller:
+    """Runs calls with a hedge after the observed latency quantile. Thread-safe."""
+
+    def __init__(self, quantile=None, max_rate=None, min_samples=None, pool_size=None):
+        self.quantile = EXTRACTION_HEDGE_QUANTILE if quantile is None else quantile
+        self.max_rate = EXTRACTION_HEDGE_MAX_RATE if max_rate is None else max_rate
+        self.min_samples = EXTRACTION_HEDGE_MIN_SAMPLES if min_samples is None else min_samples
+        self._pool = ThreadPoolExecutor(max_workers=pool_size or EXTRACTION_HEDGE_POOL_SIZE,
+                                        thread_name_prefix="hedge")
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._delay = None
+        self._samples = 0
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.hedges_skipped = 0
+        self.discarded = 0
+
+    @staticmethod
+    def _model_seconds(clock):
+        """Seconds an attempt has spent past the rate limiter (0 while it waits for its first quota)"""
+        started = clock.get("started")
+        return 0.0 if started is None else time.perf_counter() - started - clock["waited"]
+
+    def _timed(self, fn, args, clock):
+        previous = on_quota_acquired.get()
+
+        def acquired(waited):
+            if "started" not in clock:
+                clock["started"] = time.perf_counter()
+            else:
+                clock["waited"] += waited
+            if previous is not None:
+                previous(waited)
+
+        # Runs in a copy of the caller's context, so this does not leak into other calls
+        on_quota_acquired.set(acquired)
+        result = fn(*args)
+        if "started" not in clock:
+            return result
+        latency = self._model_seconds(clock)
+        with self._lock:
+            self._latencies.append(latency)
+            self._samples += 1
+            # Recompute the threshold every few samples rather than on every call
+            if len(self._latencies) >= self.min_samples and (self._delay is None or self._samples % 10 == 0):
+                self._delay = percentile(self._latencies, self.quantile)
+        return result
+
+    def _submit(self, fn, args):
+        clock = {"waited": 0.0}
+        return self._pool.submit(contextvars.copy_context().run, self._timed, fn, args, clock), clock
+
+    def _may_hedge(self):
+        with self._lock:
+            if self.hedges + 1 > self.max_rate * self.calls:
+                self.hedges_skipped += 1
+                return False
+            self.hedges += 1
+            return True
+
+    def __call__(self, fn, *args):
+        """fn(*args), hedged; returns the first successful result"""
+        with self._lock:
+            self.calls += 1
+            delay = self._delay
+        primary, clock = self._submit(fn, args)
+        if delay is None:
+            return primary.result()
+        while True:
+            remaining = delay - self._model_seconds(clock)
+            if remaining <= 0:
+                break
+            done, _ = wait([primary], timeout=remaining)
+            if done:
+                return primary.result()
+        if not self._may_hedge():
+            return primary.result()
+
+        hedge, _ = self._submit(fn, args)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        if not loser.cancel():
+                            with self._lock:
+                                self.discarded += 1
+                    if future is hedge:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def stats(self):
+        with self._lock:
+            return {
+                "quantile": self.quantile,
+                "max_rate": self.max_rate,
+                "current_delay_ms": round(self._delay * 1000, 1) if self._delay else None,
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "hedge_rate": self.hedges / self.calls if self.calls else None,
+                "hedge_wins": self.hedge_wins,
+                "hedges_skipped_by_cap": self.hedges_skipped,
+                "discarded_in_flight": self.discarded,
+            }
+
+    def write_stats(self, output_main_folder):
+        path = os.path.join(output_main_folder, HEDGING_STATS_FILENAME)
+        write_json_atomic(path, self.stats())
+        return path
+
+    def shutdown(self):
+        # Abandoned calls finish in the background; do not wait for them
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,270 @@
+import csv
+import glob
+import hashlib
+import json
+import os
+import re
+from collections import Counter, defaultdict, deque
+
+from json_records import iter_json_records
+from progress import write_json_atomic
+
+# Incremental re-extraction for new versions of the same ratesheet.
+#
+# Every extracted subfolder gets a row manifest next to its freight_rates.json:
+#   {"header_signature", "prompt_signature", "context_signature",
+#    "rows": [{"row_index", "row_hash", "row_key", "first_record", "record_count", "failed"}, ...]}
+# where first_record/record_count locate the row's records in freight_rates.json.
+#
+# When a new upload has a subfolder whose header, prompt template and context
+# match an earlier manifest, rows with an identical content hash are carried
+# over instead of sent to Bedrock. The context signature covers the sheet's
+# own context and the workbook-wide blocks before filtering, so new validity
+# dates, carriers or free-time notes re-extract every row. Earlier manifests
+# are looked up in this job's own output first, then in the same sheet of
+# other jobs for the same workbook (see workbook_family). Rows whose hash is
+# new are "changed" if a previous row had the same key (its non-numeric
+# cells: ports, services, ...), otherwise "added".
+
+MANIFEST_FILENAME = "row_manifest.json"
+DIFF_SUMMARY_FILENAME = "diff_summary.json"
+RESULTS_FILENAME = "freight_rates.json"
+PREVIOUS_SUFFIX = ".previous"
+OUTPUT_FOLDER_SUFFIX = "_processed_output"
+MAX_CANDIDATES = 50
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:24]
+
+
+def _is_number(cell):
+    try:
+        float(cell.replace(",", ""))
+        return True
+    except ValueError:
+        return False
+
+
+def row_key(row_csv):
+    """Identity of a row across versions: its non-empty, non-numeric cells"""
+    cells = next(csv.reader([row_csv]), [])
+    return text_hash("\x1f".join(c.strip() for c in cells if c.strip() and not _is_number(c.strip())))
+
+
+def header_signature(header):
+    return text_hash("\x1f".join("" if cell is None else str(cell).strip() for cell in header))
+
+
+def _previous_path(path):
+    root, ext = os.path.splitext(path)
+    return f"{root}{PREVIOUS_SUFFIX}{ext}"
+
+
+def _load_manifest(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def workbook_family(output_folder_name):
+    """A job's workbook name without dates, version numbers and punctuation.
+
+    "FAK Reefer 01.04.-30.04.2025" and "FAK Reefer 01.05.-31.05.2025 v2" are
+    both "fak reefer".
+    """
+    stem = output_folder_name.removesuffix(OUTPUT_FOLDER_SUFFIX).lower()
+    stem = re.sub(r"(?<![a-z])v(?=\d)", "", stem)
+    return " ".join(re.sub(r"[^a-z]+", " ", stem).split())
+
+
+def find_previous_version(output_subfolder, header_sig, prompt_sig, context_sig):
+    """(manifest, context_changed) of an earlier extraction of the same table.
+
+    The manifest has "records_path" set, or is None when nothing matches;
+    context_changed is True when a candidate matched everything but the
+    context. Looks in this job's own output first (moving its files aside so
+    the new run can write in place), then in the same sheet of other jobs for
+    the same workbook family.
+    """
+    subfolder_name = os.path.basename(output_subfolder.rstrip("/\\"))
+    job_folder = os.path.dirname(os.path.abspath(output_subfolder))
+    jobs_root = os.path.dirname(job_folder)
+    family = workbook_family(os.path.basename(job_folder))
+
+    own_manifest = os.path.join(output_subfolder, MANIFEST_FILENAME)
+    own_results = os.path.join(output_subfolder, RESULTS_FILENAME)
+    # A run that crashed halfway leaves the previous files behind; use them first
+    if not os.path.exists(_previous_path(own_manifest)) and os.path.exists(own_manifest) and os.path.exists(own_results):
+        os.replace(own_manifest, _previous_path(own_manifest))
+        os.replace(own_results, _previous_path(own_results))
+    candidates = [(_previous_path(own_manifest), _previous_path(own_results))]
+
+    pattern = os.path.join(jobs_root, f"*{OUTPUT_FOLDER_SUFFIX}", glob.escape(subfolder_name), MANIFEST_FILENAME)
+    paths = [p for p in glob.glob(pattern)
+             if os.path.dirname(os.path.dirname(os.path.abspath(p))) != job_folder
+             and workbook_family(os.path.basename(os.path.dirname(os.path.dirname(p)))) == family]
+    for path in sorted(paths, key=os.path.getmtime, reverse=True)[:MAX_CANDIDATES]:
+        candidates.append((path, os.path.join(os.path.dirname(path), RESULTS_FILENAME)))
+
+    context_changed = False
+    for manifest_path, records_path in candidates:
+        if not os.path.exists(manifest_path) or not os.path.exists(records_path):
+            continue
+        manifest = _load_manifest(manifest_path)
+        if not manifest or manifest.get("header_signature") != header_sig or manifest.get("prompt_signature") != prompt_sig:
+            continue
+        if manifest.get("context_signature") != context_sig:
+            context_changed = True
+            continue
+        manifest["manifest_path"] = manifest_path
+        manifest["records_path"] = records_path
+        return manifest, False
+    return None, context_changed
+
+
+def discard_previous_version(output_subfolder):
+    """Remove the files moved aside by find_previous_version once the new run is complete"""
+    for name in (MANIFEST_FILENAME, RESULTS_FILENAME):
+        path = _previous_path(os.path.join(output_subfolder, name))
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class RowDiff:
+    """Matches the rows of a new version against a previous manifest.
+
+    Only the carried rows are kept per row; rows sent to the model are
+    counted as they are extracted (see add_extracted).
+    """
+
+    def __init__(self, previous_manifest=None, context_changed=False):
+        self.previous = previous_manifest
+        self.context_changed = context_changed
+        self.by_hash = defaultdict(deque)
+        self.previous_rows = 0
+        for entry in (previous_manifest or {}).get("rows", []):
+            self.previous_rows += 1
+            self.by_hash[entry["row_hash"]].append(entry)
+        self.carried = {}        # new row index -> previous manifest entry
+        self.matched_rows = 0
+        self.leftover_keys = Counter()
+        self.extracted = 0
+        self.changed = 0
+
+    def match(self, idx, row_hash, key):
+        """Returns the previous entry to carry over for this row, or None if it must be extracted"""
+        self.matched_rows += 1
+        entries = self.by_hash.get(row_hash)
+        while entries:
+            entry = entries.popleft()
+            # Rows that failed last time are extracted again
+            if not entry.get("failed"):
+                self.carried[idx] = entry
+                return entry
+            self.by_hash.setdefault("__failed__", deque()).append(entry)
+        return None
+
+    def uncarry(self, idx):
+        """A carried row whose records could not be read goes back to extraction"""
+        del self.carried[idx]
+
+    def finish(self):
+        """Once the carried rows are final: the keys of previous rows not carried over"""
+        self.leftover_keys = Counter(
+            entry["row_key"] for key, entries in self.by_hash.items() for entry in entries
+        )
+        self.by_hash.clear()
+
+    def add_extracted(self, key):
+        """Count a row sent to the model; "changed" if a leftover previous row had its key"""
+        self.extracted += 1
+        if self.leftover_keys[key] > 0:
+            self.leftover_keys[key] -= 1
+            self.changed += 1
+
+    def summary(self):
+        added = self.extracted - self.changed
+        removed = self.previous_rows - len(self.carried) - self.changed
+        return {
+            "previous": self.previous.get("records_path") if self.previous else None,
+            "rows_total": len(self.carried) + self.extracted,
+            "unchanged": len(self.carried),
+            "added": added,
+            "changed": self.changed,
+            "removed": max(0, removed),
+            "extracted": self.extracted,
+            "context_changed": self.context_changed,
+        }
+
+
+def iter_carried_records(records_path, carried):
+    """Yield (new_row_index, record) for every record of the carried rows, in file order"""
+    position_to_row = {}
+    for idx, entry in carried.items():
+        for position in range(entry["first_record"], entry["first_record"] + entry["record_count"]):
+            position_to_row[position] = idx
+    for position, record in enumerate(iter_json_records(records_path)):
+        idx = position_to_row.get(position)
+        if idx is not None:
+            yield idx, record
+
+
+class ManifestWriter:
+    """Collects per-row hashes and record positions while freight_rates.json is written"""
+
+    def __init__(self, header_sig, prompt_sig, context_sig):
+        self.header_signature = header_sig
+        self.prompt_signature = prompt_sig
+        self.context_signature = context_sig
+        self.rows = {}
+
+    def add(self, idx, row_hash, key, first_record, record_count, failed=False):
+        self.rows[idx] = {
+            "row_index": int(idx),
+            "row_hash": row_hash,
+            "row_key": key,
+            "first_record": first_record,
+            "record_count": record_count,
+            "failed": failed,
+        }
+
+    def write(self, output_subfolder):
+        write_json_atomic(os.path.join(output_subfolder, MANIFEST_FILENAME), {
+            "header_signature": self.header_signature,
+            "prompt_signature": self.prompt_signature,
+            "context_signature": self.context_signature,
+            "rows": [self.rows[idx] for idx in sorted(self.rows)],
+        })
+
+
+def update_manifest_after_retry(output_subfolder, replacements, is_failed_record):
+    """Shift record positions after splice_records replaced failed rows with `replacements`"""
+    path = os.path.join(output_subfolder, MANIFEST_FILENAME)
+    manifest = _load_manifest(path)
+    if not manifest:
+        return
+    shift = 0
+    for entry in sorted(manifest["rows"], key=lambda e: e["first_record"]):
+        entry["first_record"] += shift
+        records = replacements.get(entry["row_index"])
+        if entry.get("failed") and records is not None:
+            shift += len(records) - entry["record_count"]
+            entry["record_count"] = len(records)
+            entry["failed"] = any(is_failed_record(r) for r in records)
+    write_json_atomic(path, manifest)
+
+
+def write_job_diff_summary(output_main_folder):
+    """Aggregate every subfolder's diff_summary.json into one at the job level"""
+    subfolders, totals = {}, Counter()
+    for name in sorted(os.listdir(output_main_folder)):
+        summary = _load_manifest(os.path.join(output_main_folder, name, DIFF_SUMMARY_FILENAME))
+        if summary:
+            subfolders[name] = summary
+            totals.update({k: v for k, v in summary.items() if isinstance(v, int) and not isinstance(v, bool)})
+    if subfolders:
+        write_json_atomic(os.path.join(output_main_folder, DIFF_SUMMARY_FILENAME),
+                          {"totals": dict(totals), "subfolders": subfolders})
@@ -0,0 +1,19 @@
+import os
+
+# Imported once by the worker's forkserver (see worker_service.job_process_context),
+# so every job process is forked with the heavy modules imported and the Bedrock
+# client already built.
+#
+# Building the client resolves credentials and endpoint data (~0.2 s) but opens
+# no connections; its pool connects on the first call, inside the job process,
+# so no socket is ever shared between jobs.
+
+import background_processor  # noqa: F401  pandas, openpyxl, thefuzz, boto3
+from extraction import get_bedrock_client
+
+if os.getenv("LLM_BACKEND", "bedrock").lower() in ("bedrock", "record"):
+    try:
+        get_bedrock_client()
+    except Exception as e:
+        # Missing region or credentials: each job fails with the real error on its first call
+        print(f"⚠️ Bedrock client not prebuilt: {e}")
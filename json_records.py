@@ -0,0 +1,101 @@
+import json
+
+# Incremental readers for extraction outputs.
+#
+# freight_rates.json is written as a JSON array, one record at a time, so a
+# file that is still being written is an unterminated array. These readers
+# decode one record at a time from fixed-size chunks, never holding more than
+# one chunk plus the current record in memory, and stop quietly at a
+# truncated tail.
+
+CHUNK_SIZE = 1 << 16
+
+_decoder = json.JSONDecoder()
+
+
+def _iter_array_records(f, buffer):
+    pos = buffer.index("[") + 1
+    eof = False
+    while True:
+        # Skip separators between records
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buffer) or eof:
+                break
+            chunk = f.read(CHUNK_SIZE)
+            buffer, pos, eof = chunk, 0, not chunk
+
+        if pos >= len(buffer) or buffer[pos] == "]":
+            return
+
+        try:
+            record, end = _decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                return  # truncated record at the end of a file still being written
+            chunk = f.read(CHUNK_SIZE)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+            continue
+
+        # A record that ends exactly at the buffer edge may be a number cut in half
+        if end == len(buffer) and not eof:
+            chunk = f.read(CHUNK_SIZE)
+            buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+            continue
+
+        yield record
+        pos = end
+
+
+def _iter_jsonl_records(f, first_chunk):
+    pending = first_chunk
+    while True:
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+        chunk = f.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        pending += chunk
+    if pending.strip():
+        try:
+            yield json.loads(pending)
+        except json.JSONDecodeError:
+            pass
+
+
+def iter_json_records(path):
+    """Yield records from a JSON array, a single JSON object or a JSONL file, incrementally"""
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = f.read(CHUNK_SIZE)
+        while buffer and not buffer.lstrip():
+            buffer = f.read(CHUNK_SIZE)
+        stripped = buffer.lstrip()
+        if not stripped:
+            return
+        if path.endswith(".jsonl"):
+            yield from _iter_jsonl_records(f, buffer)
+        elif stripped[0] == "[":
+            yield from _iter_array_records(f, stripped)
+        else:
+            # Single object: nothing to stream, decode the whole file
+            yield json.loads(buffer + f.read())
+
+
+def iter_json_record_batches(path, batch_size=2000):
+    """Group `iter_json_records` output into lists of at most `batch_size` records"""
+    batch = []
+    for record in iter_json_records(path):
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
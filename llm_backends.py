@@ -0,0 +1,220 @@
+import hashlib
+import json
+import math
+import os
+import random
+import string
+import threading
+import time
+
+from freight_schema import empty_record
+
+# Pluggable backends behind call_nova_pro_converse_cached.
+#
+#   LLM_BACKEND=bedrock  (default) live Bedrock Converse API
+#   LLM_BACKEND=fake     local stand-in with configurable latency, throttling and responses
+#   LLM_BACKEND=record   live Bedrock, every request/response appended to LLM_RECORDING_PATH
+#   LLM_BACKEND=replay   answer from a recording made with LLM_BACKEND=record
+#
+# Fake backend settings:
+#   FAKE_LLM_LATENCY        latency spec in ms: "fixed:800", "uniform:300:1500", "lognormal:800:0.5"
+#   FAKE_LLM_THROTTLE_RATE  probability of a ThrottlingException per call (0..1)
+#   FAKE_LLM_RESPONSE_FILE  response template; $row_csv, $row_json and $model_id are substituted
+#   FAKE_LLM_SEED           seed for reproducible latencies and throttling
+
+DEFAULT_RECORDING_PATH = "llm_recording.jsonl"
+
+
+def request_key(modelId, messages, inferenceConfig=None, **_):
+    """Stable hash of a Converse request, ignoring cache markers"""
+    texts = [
+        part["text"]
+        for message in messages
+        for part in message.get("content", [])
+        if "text" in part
+    ]
+    payload = json.dumps([modelId, texts, inferenceConfig or {}], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def parse_latency_spec(spec):
+    """'lognormal:800:0.5' -> function returning a latency in seconds"""
+    kind, *args = spec.split(":")
+    args = [float(a) for a in args]
+    if kind == "fixed":
+        return lambda rng: args[0] / 1000
+    if kind == "uniform":
+        return lambda rng: rng.uniform(args[0], args[1]) / 1000
+    if kind == "lognormal":
+        median, sigma = args[0], (args[1] if len(args) > 1 else 0.5)
+        return lambda rng: rng.lognormvariate(math.log(median), sigma) / 1000
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class BedrockBackend:
+    """Live Bedrock Converse calls through the shared client"""
+
+    def converse(self, **request):
+        from extraction import get_bedrock_client
+        return get_bedrock_client().converse(**request)
+
+
+class FakeBackend:
+    """Local Bedrock stand-in for offline load testing"""
+
+    def __init__(self, latency="lognormal:800:0.5", throttle_rate=0.0, response_template=None,
+                 responses=None, seed=None):
+        self.sample_latency = parse_latency_spec(latency) if isinstance(latency, str) else latency
+        self.throttle_rate = throttle_rate
+        self.response_template = string.Template(response_template) if response_template else None
+        self.responses = responses
+        self.rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self._cached_prompts = set()
+        self.calls = 0
+        self.throttled = 0
+
+    def _response_text(self, modelId, user_input):
+        if self.responses:
+            return self.responses[self.calls % len(self.responses)]
+        if self.response_template:
+            return self.response_template.safe_substitute(
+                row_csv=user_input.strip(),
+                row_json=json.dumps(user_input.strip(), ensure_ascii=False),
+                model_id=modelId,
+            )
+        # Default: one schema-complete record echoing the row's numeric cells as rates
+        record = empty_record()
+        record["carrier"] = "FAKE CARRIER"
+        record["remarks"] = user_input.strip()[:200]
+        values = [v.strip() for v in user_input.strip().split(",")]
+        record["freight_rates"] = [
+            f"Column_{i}:{v}" for i, v in enumerate(values) if v.replace(".", "", 1).isdigit()
+        ]
+        return json.dumps([record], ensure_ascii=False)
+
+    def converse(self, modelId, messages, inferenceConfig=None, **_):
+        with self._rng_lock:
+            self.calls += 1
+            latency = self.sample_latency(self.rng)
+            throttle = self.rng.random() < self.throttle_rate
+        time.sleep(latency)
+        if throttle:
+            from botocore.exceptions import ClientError
+            with self._rng_lock:
+                self.throttled += 1
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Too many requests (fake backend)"}},
+                "Converse",
+            )
+
+        texts = [part["text"] for part in messages[0]["content"] if "text" in part]
+        static_prompt, user_input = texts[0], texts[-1]
+        text = self._response_text(modelId, user_input)
+
+        static_tokens, input_tokens = len(static_prompt) // 4, len(user_input) // 4
+        with self._rng_lock:
+            cache_hit = static_prompt in self._cached_prompts
+            self._cached_prompts.add(static_prompt)
+        return {
+            "output": {"message": {"role": "assistant", "content": [{"text": text}]}},
+            "usage": {
+                "inputTokens": input_tokens,
+                "outputTokens": len(text) // 4,
+                "totalTokens": static_tokens + input_tokens + len(text) // 4,
+                "cacheReadInputTokens": static_tokens if cache_hit else 0,
+                "cacheWriteInputTokens": 0 if cache_hit else static_tokens,
+            },
+            "metrics": {"latencyMs": int(latency * 1000)},
+            "stopReason": "end_turn",
+        }
+
+
+class RecordingBackend:
+    """Wraps another backend and appends every request/response pair to a JSONL file"""
+
+    def __init__(self, inner, path=DEFAULT_RECORDING_PATH):
+        self.inner = inner
+        self.path = path
+        self._lock = threading.Lock()
+
+    def converse(self, **request):
+        response = self.inner.converse(**request)
+        entry = {
+            "key": request_key(**request),
+            "modelId": request.get("modelId"),
+            "response": {k: response[k] for k in ("output", "usage", "metrics", "stopReason") if k in response},
+        }
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        return response
+
+
+class ReplayBackend:
+    """Answers requests from a recording; misses raise KeyError unless a fallback is given"""
+
+    def __init__(self, path=DEFAULT_RECORDING_PATH, fallback=None, replay_latency=False):
+        self.fallback = fallback
+        self.replay_latency = replay_latency
+        self.responses = {}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.responses[entry["key"]] = entry["response"]
+
+    def converse(self, **request):
+        response = self.responses.get(request_key(**request))
+        if response is None:
+            if self.fallback is not None:
+                return self.fallback.converse(**request)
+            raise KeyError("No recorded response for this request")
+        if self.replay_latency:
+            time.sleep(response.get("metrics", {}).get("latencyMs", 0) / 1000)
+        return response
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def backend_from_env():
+    name = os.getenv("LLM_BACKEND", "bedrock").lower()
+    recording_path = os.getenv("LLM_RECORDING_PATH", DEFAULT_RECORDING_PATH)
+    if name == "bedrock":
+        return BedrockBackend()
+    if name == "fake":
+        template = None
+        if os.getenv("FAKE_LLM_RESPONSE_FILE"):
+            with open(os.getenv("FAKE_LLM_RESPONSE_FILE"), "r", encoding="utf-8") as f:
+                template = f.read()
+        seed = os.getenv("FAKE_LLM_SEED")
+        return FakeBackend(
+            latency=os.getenv("FAKE_LLM_LATENCY", "lognormal:800:0.5"),
+            throttle_rate=float(os.getenv("FAKE_LLM_THROTTLE_RATE", "0")),
+            response_template=template,
+            seed=int(seed) if seed else None,
+        )
+    if name == "record":
+        return RecordingBackend(BedrockBackend(), recording_path)
+    if name == "replay":
+        return ReplayBackend(recording_path)
+    raise ValueError(f"Unknown LLM_BACKEND: {name}")
+
+
+def get_llm_backend():
+    """The process-wide backend, built from the environment on first use"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = backend_from_env()
+    return _backend
+
+
+def set_llm_backend(backend):
+    """Override the backend (benchmarks, load tests); pass None to go back to the environment"""
+    global _backend
+    with _backend_lock:
+        _backend = backend
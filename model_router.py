@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+
+from extraction import call_nova_pro_converse_cached, repair_invalid_fields
+from progress import write_json_atomic
+from tracing import percentile
+
+# Tiered model routing for row extraction.
+#
+# Each row goes to the cheapest tier first. The response is validated against
+# the f9.txt schema (schema_validation.py) and its invalid fields repaired on
+# the same tier; rows still invalid after repair, scoring below
+# MODEL_ROUTER_MIN_CONFIDENCE or erroring out are escalated to the next tier.
+# With a custom prompt that changes the schema only errors escalate. The last
+# tier's answer is always kept. All tiers go through the Converse API, so
+# LLM_BACKEND fakes and recordings work unchanged.
+#
+# Per-tier calls, latency, tokens, estimated cost and escalation rates are
+# written to `{output_main_folder}/routing_stats.json`. Enabled per job with
+# the `routing` param or MODEL_ROUTING=1.
+
+ROUTING_STATS_FILENAME = "routing_stats.json"
+DEFAULT_TIERS = [
+    "amazon.nova-lite-v1:0",
+    "amazon.nova-pro-v1:0",
+    "anthropic.claude-3-7-sonnet-20250219-v1:0",
+]
+MODEL_ROUTER_TIERS = [m.strip() for m in os.getenv("MODEL_ROUTER_TIERS", ",".join(DEFAULT_TIERS)).split(",") if m.strip()]
+MODEL_ROUTER_MIN_CONFIDENCE = float(os.getenv("MODEL_ROUTER_MIN_CONFIDENCE", "0.8"))
+
+# On-demand USD per 1,000 input / output tokens (us-east-1); cache reads are billed at 25% of input
+MODEL_PRICES_PER_1K = {
+    "amazon.nova-micro-v1:0": (0.000035, 0.00014),
+    "amazon.nova-lite-v1:0": (0.00006, 0.00024),
+    "amazon.nova-pro-v1:0": (0.0008, 0.0032),
+    "anthropic.claude-3-5-haiku-20241022-v1:0": (0.0008, 0.004),
+    "anthropic.claude-3-7-sonnet-20250219-v1:0": (0.003, 0.015),
+}
+CACHE_READ_PRICE_RATIO = 0.25
+TOKEN_FIELDS = ("inputTokens", "outputTokens", "totalTokens", "cacheReadInputTokens", "cacheWriteInputTokens")
+
+
+def routing_enabled(requested=None):
+    """Job param wins; otherwise MODEL_ROUTING=1 turns routing on"""
+    if requested is not None:
+        return bool(requested)
+    return os.getenv("MODEL_ROUTING", "").lower() in ("1", "true", "yes")
+
+
+def estimate_cost(model_id, usage):
+    input_price, output_price = MODEL_PRICES_PER_1K.get(model_id.split("/")[-1].removeprefix("us."), (0.0, 0.0))
+    return (
+        (usage.get("inputTokens") or 0) * input_price
+        + (usage.get("outputTokens") or 0) * output_price
+        + (usage.get("cacheReadInputTokens") or 0) * input_price * CACHE_READ_PRICE_RATIO
+    ) / 1000
+
+
+class ModelRouter:
+    """Routes row extraction calls through escalating model tiers. Thread-safe."""
+
+    def __init__(self, tiers=None, min_confidence=None):
+        self.tiers = list(tiers or MODEL_ROUTER_TIERS)
+        self.min_confidence = MODEL_ROUTER_MIN_CONFIDENCE if min_confidence is None else min_confidence
+        self._lock = threading.Lock()
+        self.counters = defaultdict(Counter)
+        self.latencies = defaultdict(list)
+        self.costs = Counter()
+        self.final_tier = Counter()
+        self.escalation_reasons = defaultdict(Counter)
+
+    def _record(self, model_id, seconds, usage=None, outcome="accepted", reason=None):
+        with self._lock:
+            counters = self.counters[model_id]
+            counters["calls"] += 1
+            counters[outcome] += 1
+            self.latencies[model_id].append(seconds)
+            if usage:
+                for name in TOKEN_FIELDS:
+                    counters[name] += usage.get(name) or 0
+                self.costs[model_id] += estimate_cost(model_id, usage)
+            if reason:
+                self.escalation_reasons[model_id][reason] += 1
+            if outcome == "accepted":
+                self.final_tier[model_id] += 1
+
+    def __call__(self, static_prompt, row_csv):
+        """Same contract as call_nova_pro_converse_cached: returns (text, usage)"""
+        total_usage = Counter()
+        for tier, model_id in enumerate(self.tiers):
+            last = tier == len(self.tiers) - 1
+            t0 = time.perf_counter()
+            try:
+                text, usage = call_nova_pro_converse_cached(static_prompt, row_csv, model_id=model_id)
+            except Exception as e:
+                self._record(model_id, time.perf_counter() - t0, outcome="errors" if last else "escalated",
+                             reason=type(e).__name__)
+                if last:
+                    raise
+                continue
+            # Repairing a few fields is cheaper than re-extracting the row on a larger model
+            text, usage, result = repair_invalid_fields(static_prompt, row_csv, text, usage, model_id=model_id)
+            seconds = time.perf_counter() - t0
+            total_usage.update({name: usage.get(name) or 0 for name in TOKEN_FIELDS})
+
+            # Without a validated schema only errors escalate
+            if last or result is None or (result.valid and result.confidence >= self.min_confidence):
+                self._record(model_id, seconds, usage, outcome="accepted")
+                return text, dict(usage, **total_usage, modelId=model_id, routingTier=tier,
+                                  confidence=result.confidence if result else None)
+            reason = "invalid" if not result.valid else "low_confidence"
+            self._record(model_id, seconds, usage, outcome="escalated", reason=reason)
+
+    def stats(self):
+        with self._lock:
+            rows = sum(self.final_tier.values())
+            tiers = {}
+            for model_id in self.tiers:
+                counters = self.counters[model_id]
+                latencies = self.latencies[model_id]
+                tiers[model_id] = {
+                    "calls": counters["calls"],
+                    "accepted": counters["accepted"],
+                    "escalated": counters["escalated"],
+                    "errors": counters["errors"],
+                    "escalation_rate": counters["escalated"] / counters["calls"] if counters["calls"] else None,
+                    "escalation_reasons": dict(self.escalation_reasons[model_id]),
+                    "latency_ms": {
+                        q: round(percentile(latencies, p) * 1000, 1) if latencies else None
+                        for q, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+                    },
+                    "tokens": {name: counters[name] for name in TOKEN_FIELDS},
+                    "estimated_cost_usd": round(self.costs[model_id], 6),
+                }
+            return {
+                "tiers_in_order": self.tiers,
+                "min_confidence": self.min_confidence,
+                "rows": rows,
+                "rows_by_final_tier": dict(self.final_tier),
+                "estimated_cost_usd": round(sum(self.costs.values()), 6),
+                "tiers": tiers,
+            }
+
+    def write_stats(self, output_main_folder):
+        path = os.path.join(output_main_folder, ROUTING_STATS_FILENAME)
+        write_json_atomic(path, self.stats())
+        return path
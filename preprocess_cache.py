@@ -0,0 +1,171 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+# Reuse of preprocessing outputs for repeated uploads.
+#
+# A finished `{stem}_processed` folder depends only on the workbook bytes,
+# the ignored sheets and the custom header terms, so it is stored under a
+# hash of exactly those:
+#
+#   {PREPROCESS_CACHE_DIR}/{key}/processed/...   copy of the _processed folder
+#   {PREPROCESS_CACHE_DIR}/{key}/entry.json      what the key was built from
+#
+# A job whose key matches copies the folder back and goes straight to
+# extraction. Folder contents never mention the file stem, so a renamed
+# upload of the same workbook hits the cache too. Entries are copies, not
+# links, because later runs rewrite the `_processed` files in place.
+#
+# Bump PREPROCESS_CACHE_VERSION whenever preprocessing output changes.
+#
+#   python preprocess_cache.py list
+#   python preprocess_cache.py evict --max-age-days 14 --max-size-gb 5 [--sheet-cache]
+
+PREPROCESS_CACHE_DIR = os.getenv("PREPROCESS_CACHE_DIR", "preprocess_cache")
+PREPROCESS_CACHE_VERSION = 1
+ENTRY_FILENAME = "entry.json"
+PROCESSED_DIRNAME = "processed"
+
+
+def preprocess_cache_enabled(requested=None):
+    """Job param wins; otherwise on unless PREPROCESS_CACHE=0"""
+    if requested is not None:
+        return bool(requested)
+    return os.getenv("PREPROCESS_CACHE", "1").lower() not in ("0", "false", "no")
+
+
+def preprocess_cache_key(workbook_sha256, ignored_sheets, custom_terms):
+    """Cache key for one workbook and the user's preprocessing choices"""
+    terms = {category: sorted(set(values)) for category, values in (custom_terms or {}).items() if values}
+    payload = json.dumps({
+        "version": PREPROCESS_CACHE_VERSION,
+        "workbook": workbook_sha256,
+        "ignored_sheets": sorted(set(ignored_sheets or ())),
+        "custom_terms": terms,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:24]
+
+
+def folder_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def restore_preprocessed(key, processed_folder, cache_dir=PREPROCESS_CACHE_DIR):
+    """Replace `processed_folder` with the cached outputs for `key`; False on a miss"""
+    entry = os.path.join(cache_dir, key)
+    source = os.path.join(entry, PROCESSED_DIRNAME)
+    if not os.path.isdir(source):
+        return False
+    tmp = f"{processed_folder.rstrip('/')}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        shutil.copytree(source, tmp)
+    except OSError:
+        # Evicted while copying
+        shutil.rmtree(tmp, ignore_errors=True)
+        return False
+    shutil.rmtree(processed_folder, ignore_errors=True)
+    os.replace(tmp, processed_folder)
+    # The entry's mtime is its last use, for eviction
+    os.utime(entry)
+    return True
+
+
+def store_preprocessed(key, processed_folder, metadata, cache_dir=PREPROCESS_CACHE_DIR):
+    """Copy a finished `processed_folder` into the cache under `key` (kept if already there)"""
+    entry = os.path.join(cache_dir, key)
+    if os.path.isdir(entry):
+        return entry
+    tmp = os.path.join(cache_dir, f".{key}.{uuid.uuid4().hex[:8]}.tmp")
+    shutil.copytree(processed_folder, os.path.join(tmp, PROCESSED_DIRNAME))
+    with open(os.path.join(tmp, ENTRY_FILENAME), "w", encoding="utf-8") as f:
+        json.dump({**metadata, "key": key, "created_at": time.time(),
+                   "size_bytes": folder_size(tmp)}, f, ensure_ascii=False, indent=2)
+    try:
+        os.rename(tmp, entry)
+    except OSError:
+        # Another job stored the same key first
+        shutil.rmtree(tmp, ignore_errors=True)
+    return entry
+
+
+def list_entries(cache_dir):
+    """[(path, last used, size in bytes)], oldest first; skips half-written entries"""
+    if not os.path.isdir(cache_dir):
+        return []
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.startswith(".") or not os.path.isdir(path):
+            continue
+        entries.append((path, os.path.getmtime(path), folder_size(path)))
+    return sorted(entries, key=lambda entry: entry[1])
+
+
+def evict(cache_dir, max_age_seconds=None, max_bytes=None, now=None):
+    """Remove entries unused for `max_age_seconds`, then least recently used ones until under `max_bytes`"""
+    now = now or time.time()
+    entries = list_entries(cache_dir)
+    total = sum(size for _, _, size in entries)
+    removed = []
+    for path, last_used, size in entries:
+        too_old = max_age_seconds is not None and now - last_used > max_age_seconds
+        too_big = max_bytes is not None and total > max_bytes
+        if not (too_old or too_big):
+            continue
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        removed.append((path, size))
+    return removed, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preprocessing output cache maintenance")
+    parser.add_argument("--cache-dir", default=PREPROCESS_CACHE_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="entries with their last use and size")
+    evict_parser = sub.add_parser("evict", help="remove old entries and keep the cache under a size")
+    evict_parser.add_argument("--max-age-days", type=float, help="remove entries unused for this long")
+    evict_parser.add_argument("--max-size-gb", type=float, help="then remove least recently used entries above this total")
+    evict_parser.add_argument("--sheet-cache", action="store_true",
+                              help="apply the same limits to the parsed sheet cache (see sheet_cache.py)")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for path, last_used, size in list_entries(args.cache_dir):
+            entry = {}
+            try:
+                with open(os.path.join(path, ENTRY_FILENAME), "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                pass
+            print(f"{os.path.basename(path)}  {time.strftime('%Y-%m-%d %H:%M', time.localtime(last_used))}  "
+                  f"{size / 1e6:8.1f} MB  {entry.get('file_name', '')}")
+        return
+
+    if args.max_age_days is None and args.max_size_gb is None:
+        parser.error("evict needs --max-age-days and/or --max-size-gb")
+    max_age = args.max_age_days * 86400 if args.max_age_days is not None else None
+    max_bytes = args.max_size_gb * 1e9 if args.max_size_gb is not None else None
+    cache_dirs = [args.cache_dir]
+    if args.sheet_cache:
+        from sheet_cache import SHEET_CACHE_DIR
+        cache_dirs.append(SHEET_CACHE_DIR)
+    for cache_dir in cache_dirs:
+        removed, total = evict(cache_dir, max_age, max_bytes)
+        print(f"🧹 {cache_dir}: evicted {len(removed)} entr{'y' if len(removed) == 1 else 'ies'} "
+              f"({sum(size for _, size in removed) / 1e6:.1f} MB), {total / 1e6:.1f} MB left")
+
+
+if __name__ == "__main__":
+    main()
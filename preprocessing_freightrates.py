@@ -1,16 +1,31 @@
 import pandas as pd
 import numpy as np
+import itertools
+import os
 import re
+from collections import deque
 from typing import List, Tuple, Optional, Union
 from pathlib import Path
 import openpyxl
 import logging
 from thefuzz import fuzz
+from workbook_inspector import file_sha256, read_merged_ranges
+from profiling import StageTimer
+from sheet_classifier import DEFAULT_SHEET_KEYWORDS, DEFAULT_THRESHOLD, apply_ignored, classify_workbook, plan_matches
+from sheet_cache import load_cached_sheet, store_sheet
+from shared_context import write_context_workbook, write_shared_artifact, write_sheet_reference
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Workbooks with at least this many cells are processed in streaming mode:
+# rows flow from a read-only reader through header/table-end detection into a
+# write-only workbook, so memory no longer grows with the row count.
+STREAMING_MIN_CELLS = int(os.getenv("PREPROCESS_STREAMING_MIN_CELLS", "1000000"))
+# Rows buffered for header detection (50 candidates + the 3-row context window)
+HEADER_SCAN_ROWS = 53
+
 def flatten_headers(header_block: pd.DataFrame, sep: str = " ") -> List[str]:
     arr = header_block.astype(str).fillna("").values
     rows, cols = arr.shape
@@ -26,6 +41,88 @@ def flatten_headers(header_block: pd.DataFrame, sep: str = " ") -> List[str]:
         flat.append(name or f"Column_{c}")
     return flat
 
+def row_signature(values) -> Tuple[int, str]:
+    """(non-null cell count, type signature) of a row, as table-end detection sees it"""
+    count, sig = 0, []
+    for v in values:
+        if pd.notna(v):
+            count += 1
+        sig.append('num' if isinstance(v,(int,float))
+                   else 'txt' if isinstance(v,str) and v.strip()
+                   else 'emt')
+    return count, ''.join(sig)
+
+class TableEndDetector:
+    """Table-end heuristic fed one row at a time, starting at row `start`.
+
+    Needs at most `lookback` rows of lookahead, so it works on a stream: once
+    `feed` returns an index, every row before it belongs to the table.
+    """
+    def __init__(self, start: int, lookback: int=8, pattern_tolerance: int=2,
+                 recovery_threshold: int=3, min_threshold_ratio: float=0.4):
+        self.start = start
+        self.lookback = lookback
+        self.pattern_tolerance = pattern_tolerance
+        self.recovery_threshold = recovery_threshold
+        self.min_threshold_ratio = min_threshold_ratio
+        self.index = start      # next row to evaluate
+        self.buffer = []        # rows fed before the threshold is known
+        self.threshold = None
+        self.end = None
+        self.bad = self.good_streak = self.pattern_violations = 0
+        self.last_sig = None
+
+    def feed(self, values) -> Optional[int]:
+        if self.end is None:
+            self.buffer.append(row_signature(values))
+            if self.threshold is None and len(self.buffer) >= self.lookback:
+                self._set_threshold()
+            if self.threshold is not None:
+                self._evaluate()
+        return self.end
+
+    def finish(self) -> int:
+        """End of the table once the input is exhausted"""
+        if self.end is None:
+            if self.threshold is None and self.buffer:
+                self._set_threshold()
+            self._evaluate()
+        return self.end if self.end is not None else self.index
+
+    def _set_threshold(self):
+        init_max = max(count for count, _ in self.buffer[:self.lookback])
+        self.threshold = max(3, init_max * self.min_threshold_ratio)
+
+    def _evaluate(self):
+        for cnt, s in self.buffer:
+            i = self.index
+            self.index += 1
+            is_bad_row = False
+
+            if cnt < self.threshold:
+                is_bad_row = True
+            elif self.last_sig and s != self.last_sig:
+                self.pattern_violations += 1
+                if self.pattern_violations > self.pattern_tolerance:
+                    is_bad_row = True
+
+            if is_bad_row:
+                self.bad += 1
+                self.good_streak = 0
+            else:
+                self.good_streak += 1
+                self.pattern_violations = max(0, self.pattern_violations - 1)
+                self.last_sig = s
+
+                # Recovery mechanism
+                if self.good_streak >= self.recovery_threshold:
+                    self.bad = max(0, self.bad - 2)
+
+            if self.bad >= self.lookback:
+                self.end = max(self.start, i - self.bad + 1)
+                break
+        self.buffer.clear()
+
 def clean_context(df: pd.DataFrame) -> pd.DataFrame:
     """
     Replace blank or all‐whitespace cells with NaN, then drop any rows
@@ -34,8 +131,22 @@ def clean_context(df: pd.DataFrame) -> pd.DataFrame:
     # Drop rows that are all NaN
     df_clean = df.dropna(how='all').reset_index(drop=True)
     return df_clean
+def unmerged_frame(ws) -> Tuple[pd.DataFrame, int]:
+    """(DataFrame of a worksheet with every merged range filled with its top-left value, merged range count)"""
+    merged = list(ws.merged_cells.ranges)
+    for mr in merged:
+        minc,minr,maxc,maxr = mr.bounds
+        val = ws.cell(minr, minc).value
+        ws.unmerge_cells(str(mr))
+        for r in range(minr, maxr+1):
+            for c in range(minc, maxc+1):
+                ws.cell(r,c).value = val
+    data = [[c.value for c in row] for row in ws.iter_rows()]
+    return pd.DataFrame(data), len(merged)
+
 class FreightTableExtractor:
-    def __init__(self,ignored_sheets, custom_terms=None):
+    def __init__(self,ignored_sheets, custom_terms=None, timer: Optional[StageTimer] = None,
+                 streaming: Optional[bool] = None):
         # Terms for header scoring
         self.default_location_terms = {'origin','destination','port','pol','pod','country','area',
                                'carrier','carriers','from','to','via','start'}
@@ -65,9 +176,21 @@ class FreightTableExtractor:
             self.logistics_terms
         )
         # Keywords for fuzzy matching sheet names
-        self.freetime_keywords = ["free time","freetime","demurrage","detention","storage"]
-        self.rule_keywords = ["rule","policy","term","condition","regulation","note","remark"]
-        self.surcharges_keywords = ["surcharge","tariff","charge"]
+        self.freetime_keywords = list(DEFAULT_SHEET_KEYWORDS["freetime"])
+        self.rule_keywords = list(DEFAULT_SHEET_KEYWORDS["rules"])
+        self.surcharges_keywords = list(DEFAULT_SHEET_KEYWORDS["surcharges"])
+        self.sheet_keywords = {
+            "freetime": self.freetime_keywords,
+            "rules": self.rule_keywords,
+            "surcharges": self.surcharges_keywords,
+        }
+        # Per-sheet stage timings and counters (see profiling.py)
+        self.timer = timer or StageTimer()
+        # None: decide per workbook from its size (STREAMING_MIN_CELLS)
+        self.streaming = streaming
+        self.stream_workbook = bool(streaming)
+        # Workbook hash keying the sheet cache; set per workbook, None while streaming
+        self.workbook_sha = None
 
     def normalize_sheet_name(self, name: str) -> str:
         return re.sub(r'[^a-z0-9]', '', name.lower()) if name else ''
@@ -77,17 +200,64 @@ class FreightTableExtractor:
         return any(fuzz.partial_ratio(txt, kw) >= threshold for kw in choices)
 
     def load_and_unmerge(self, file_path: Union[str,Path], sheet: str) -> pd.DataFrame:
-        wb = openpyxl.load_workbook(file_path, data_only=True)
-        ws = wb[sheet]
-        for mr in list(ws.merged_cells.ranges):
-            minc,minr,maxc,maxr = mr.bounds
-            val = ws.cell(minr, minc).value
-            ws.unmerge_cells(str(mr))
-            for r in range(minr, maxr+1):
-                for c in range(minc, maxc+1):
-                    ws.cell(r,c).value = val
-        data = [[c.value for c in row] for row in ws.iter_rows()]
-        return pd.DataFrame(data)
+        """Sheet with merged ranges filled in; taken from the sheet cache when the workbook was warmed (see sheet_cache.py)"""
+        with self.timer.sheet(sheet):
+            if self.workbook_sha:
+                with self.timer.stage("sheet_cache"):
+                    df = load_cached_sheet(self.workbook_sha, sheet)
+                if df is not None:
+                    self.timer.count("cached_sheets", 1)
+                    self.timer.count("cells", df.size)
+                    return df
+            with self.timer.stage("load_workbook"):
+                wb = openpyxl.load_workbook(file_path, data_only=True)
+                ws = wb[sheet]
+            with self.timer.stage("unmerge"):
+                df, merged = unmerged_frame(ws)
+            if self.workbook_sha:
+                with self.timer.stage("sheet_cache"):
+                    store_sheet(self.workbook_sha, sheet, df)
+            self.timer.count("merged_ranges", merged)
+            self.timer.count("cells", df.size)
+            return df
+
+    def iter_unmerged_rows(self, file_path: Union[str,Path], sheet: str, merged: Optional[List[tuple]] = None):
+        """Stream a sheet's rows as lists with merged ranges filled in, like load_and_unmerge.
+
+        Only the merged ranges still open at the current row are kept in memory.
+        """
+        if merged is None:
+            merged = read_merged_ranges(file_path, sheet)
+        merged = sorted(merged, key=lambda bounds: bounds[1])
+        wb = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            next_merge, active = 0, []
+            for r, row in enumerate(wb[sheet].iter_rows(min_row=1, values_only=True), start=1):
+                values = list(row)
+                while next_merge < len(merged) and merged[next_merge][1] == r:
+                    minc = merged[next_merge][0]
+                    active.append((merged[next_merge], values[minc-1] if minc <= len(values) else None))
+                    next_merge += 1
+                if active:
+                    for (minc,minr,maxc,maxr), val in active:
+                        if maxc > len(values):
+                            values.extend([None] * (maxc - len(values)))
+                        values[minc-1:maxc] = [val] * (maxc - minc + 1)
+                    active = [a for a in active if a[0][3] > r]
+                yield values
+        finally:
+            wb.close()
+
+    def load_sheet(self, file_path: Union[str,Path], sheet: str) -> pd.DataFrame:
+        """Whole sheet as a DataFrame, read through the streaming reader for large workbooks"""
+        if not self.stream_workbook:
+            return self.load_and_unmerge(file_path, sheet)
+        with self.timer.sheet(sheet), self.timer.stage("stream_load"):
+            merged = read_merged_ranges(file_path, sheet)
+            df = pd.DataFrame(list(self.iter_unmerged_rows(file_path, sheet, merged)))
+            self.timer.count("merged_ranges", len(merged))
+            self.timer.count("cells", df.size)
+            return df
 
     def normalize_text(self, txt: str) -> str:
         if pd.isna(txt) or not isinstance(txt,str):
@@ -95,6 +265,7 @@ class FreightTableExtractor:
         return re.sub(r'[^\w\s]', ' ', txt.lower()).strip()
 
     def calculate_freight_score(self, row: List[str]) -> float:
+        self.timer.count("rows_scored")
         norm = [self.normalize_text(v) for v in row if pd.notna(v)]
         txt = ' '.join(norm)
         loc = sum(t in txt for t in self.location_terms)
@@ -150,48 +321,11 @@ class FreightTableExtractor:
                         min_threshold_ratio: float=0.4) -> int:
         n = len(df)
         if start >= n: return n
-        
-        non_null = df.notna().sum(axis=1)
-        sig = df.applymap(lambda v:
-                        'num' if isinstance(v,(int,float))
-                        else 'txt' if isinstance(v,str) and v.strip()
-                        else 'emt').agg(''.join, axis=1)
-        
-        init_max = non_null[start:start+lookback].max()
-        threshold = max(3, init_max * min_threshold_ratio)
-        
-        bad, good_streak, pattern_violations = 0, 0, 0
-        last_sig = None
-        
-        for i in range(start, n):
-            cnt, s = non_null[i], sig[i]
-            
-            is_bad_row = False
-            
-            if cnt < threshold:
-                is_bad_row = True
-            elif last_sig and s != last_sig:
-                pattern_violations += 1
-                if pattern_violations > pattern_tolerance:
-                    is_bad_row = True
-            
-            if is_bad_row:
-                bad += 1
-                good_streak = 0
-            else:
-                good_streak += 1
-                pattern_violations = max(0, pattern_violations - 1)
-                last_sig = s
-                
-                # Recovery mechanism
-                if good_streak >= recovery_threshold:
-                    bad = max(0, bad - 2)
-            
-            if bad >= lookback:
-                return max(start, i - bad + 1)
-        
-        return n
-
+        detector = TableEndDetector(start, lookback, pattern_tolerance, recovery_threshold, min_threshold_ratio)
+        for values in df.iloc[start:].itertuples(index=False, name=None):
+            if detector.feed(values) is not None:
+                break
+        return detector.finish()
 
     def clean_table(self, df: pd.DataFrame) -> pd.DataFrame:
         return df.dropna(how='all').dropna(axis=1,how='all').reset_index(drop=True)
@@ -215,35 +349,50 @@ class FreightTableExtractor:
     def is_surcharge_sheet(self, name: str) -> bool:
         return self.fuzzy_match_any(name, self.surcharges_keywords, threshold=70)
 
-    def get_additional_context(self, fp: Union[str,Path]) -> List[Tuple[str,pd.DataFrame]]:
-        wb = openpyxl.load_workbook(fp, data_only=True)
+    def plan_sheets(self, fp: Union[str,Path], plan: Optional[dict] = None) -> List[dict]:
+        """Sheet dimensions and labels for the whole workbook, in one fuzzy pass.
+
+        A plan computed earlier (e.g. shown in the UI) is reused when it still
+        matches the workbook content; see sheet_classifier.py.
+        """
+        if plan_matches(plan, fp, self.sheet_keywords, DEFAULT_THRESHOLD):
+            return apply_ignored(plan, self.ignored_sheets)["sheets"]
+        return classify_workbook(fp, self.sheet_keywords, self.ignored_sheets)["sheets"]
+
+    def get_additional_context(self, fp: Union[str,Path], sheets: Optional[List[dict]] = None) -> List[Tuple[str,pd.DataFrame]]:
+        if sheets is None:
+            sheets = self.plan_sheets(fp)
         out = []
-        for sh in wb.sheetnames:
-            if self.to_be_ignored(sh):
+        for sheet in sheets:
+            sh = sheet["name"]
+            if sheet["ignored"]:
                 continue
-            df = self.load_and_unmerge(fp, sh)
-            if df.empty: continue
-            if self.is_freetime_sheet(sh):
+            # Classify by name first so freight sheets are never loaded here
+            if sheet["freetime"]:
                 hdr = f"=== FREETIME: {sh} ==="
-            elif self.is_rule_sheet(sh):
+            elif sheet["rules"]:
                 hdr = f"=== RULES/POLICY: {sh} ==="
             else:
                 continue
+            df = self.load_sheet(fp, sh)
+            if df.empty: continue
             out.append((hdr, df))
         return out
     
-    def get_additional_surcharges(self, fp: Union[str,Path]) -> List[Tuple[str,pd.DataFrame]]:
-        wb = openpyxl.load_workbook(fp, data_only=True)
+    def get_additional_surcharges(self, fp: Union[str,Path], sheets: Optional[List[dict]] = None) -> List[Tuple[str,pd.DataFrame]]:
+        if sheets is None:
+            sheets = self.plan_sheets(fp)
         out = []
-        for sh in wb.sheetnames:
-            if self.to_be_ignored(sh):
+        for sheet in sheets:
+            sh = sheet["name"]
+            if sheet["ignored"]:
                 continue
-            df = self.load_and_unmerge(fp, sh)
-            if df.empty: continue
-            if self.is_surcharge_sheet(sh):
+            if sheet["surcharges"]:
                 hdr = f"=== surcharge: {sh} ==="
             else:
                 continue
+            df = self.load_sheet(fp, sh)
+            if df.empty: continue
             out.append((hdr, df))
         return out
 
@@ -260,73 +409,188 @@ class FreightTableExtractor:
             parts.append(df)
         return pd.concat(parts, ignore_index=True) if parts else None
 
-    def process_excel_file(self, file_path: Union[str,Path]) -> None:
+    def process_excel_file(self, file_path: Union[str,Path], sheet_plan: Optional[dict] = None) -> None:
         fp = Path(file_path)
         if not fp.exists(): raise FileNotFoundError(fp)
         out_dir = fp.parent / f"{fp.stem}_processed"
         out_dir.mkdir(exist_ok=True)
 
-        # Always gather all freetime/rule sheets up front
-        extras = self.get_additional_context(fp)
-        surcharges = self.get_additional_surcharges(fp)
+        with self.timer.stage("inspect"):
+            plan = self.plan_sheets(fp, sheet_plan)
+        logger.info("Sheet plan: " + ", ".join(f"{s['name']}={s['label']}" for s in plan))
+        if self.streaming is None:
+            total_cells = sum((s["max_row"] or 0) * (s["max_column"] or 0) for s in plan)
+            self.stream_workbook = total_cells >= STREAMING_MIN_CELLS
+        self.workbook_sha = None
+        if self.stream_workbook:
+            logger.info(f"Streaming mode for {fp.name}")
+        else:
+            with self.timer.stage("inspect"):
+                self.workbook_sha = file_sha256(fp)
+
+        # Always gather all freetime/rule sheets up front, and write them once for all sheets
+        extras = self.get_additional_context(fp, plan)
+        surcharges = self.get_additional_surcharges(fp, plan)
+        shared = self.write_shared_context(out_dir, extras, surcharges)
 
-        wb = openpyxl.load_workbook(fp, data_only=True)
+        for sheet_info in plan:
+            with self.timer.sheet(sheet_info["name"]):
+                self.process_sheet(fp, out_dir, sheet_info, shared)
 
-        for sh in wb.sheetnames:
-            if self.is_freetime_sheet(sh) or self.is_rule_sheet(sh) or self.is_surcharge_sheet(sh) or self.to_be_ignored(sh):
-                continue
-            df = self.load_and_unmerge(fp, sh)
+        logger.info(f"Preprocessing stages: {self.timer.summary()}")
+        logger.info("Processing complete.")
+
+    def write_shared_context(self, out_dir: Path,
+                             extras: List[Tuple[str,pd.DataFrame]],
+                             surcharges: List[Tuple[str,pd.DataFrame]]) -> dict:
+        """Write the workbook-wide context blocks to `_shared/` once; returns {kind: relative path}.
+
+        See shared_context.py for the layout.
+        """
+        shared = {}
+        with self.timer.stage("write_shared_context"):
+            for kind, blocks, sheet_name in (("context", extras, "Context"), ("surcharges", surcharges, "rest")):
+                combined = self.combine_context(None, blocks, "")
+                if combined is None or combined.empty:
+                    continue
+                shared[kind] = write_shared_artifact(out_dir, clean_context(combined), sheet_name)
+        return shared
+
+    def process_sheet(self, fp: Path, out_dir: Path, sheet_info: dict, shared: dict) -> None:
+        sh = sheet_info["name"]
+        if sheet_info["label"] == "empty":
+            logger.info(f"Skipping sheet {sh}: no data rows")
+        if sheet_info["label"] != "freight":
+            return
+        if self.stream_workbook:
+            self.process_sheet_streaming(fp, out_dir, sh, shared)
+            return
+        df = self.load_and_unmerge(fp, sh)
+        with self.timer.stage("header_detection"):
             hdr = self.detect_header_row(df)
-            if hdr is None:
-                freight, context = None, df.copy()
-            else:
-                start = hdr+1
-                end   = self.detect_table_end(df, start, lookback=8)
-                cols  = self.merge_multi_level_headers(df, hdr)
-                tbl   = df.iloc[start:end].copy()
-                tbl.columns = cols[:len(tbl.columns)]
-                freight = self.clean_table(tbl)
-                context = self.extract_raw_context(df, start, end)
-
-            if freight is not None and not freight.empty:
-                folder = out_dir / re.sub(r'[<>:"/\\|?*]', '_', sh)
-                folder.mkdir(parents=True, exist_ok=True)
-                # save freight table
-                output_path = Path(folder).resolve()
-                output_path.mkdir(parents=True, exist_ok=True)
-
-                # Create the full file path
-                file_path = output_path / f"{output_path.name}_freight_table.xlsx"
+        if hdr is None:
+            freight, context = None, df.copy()
+        else:
+            start = hdr+1
+            with self.timer.stage("table_end"):
+                end = self.detect_table_end(df, start, lookback=8)
+            cols  = self.merge_multi_level_headers(df, hdr)
+            tbl   = df.iloc[start:end].copy()
+            tbl.columns = cols[:len(tbl.columns)]
+            freight = self.clean_table(tbl)
+            context = self.extract_raw_context(df, start, end)
+
+        if freight is not None and not freight.empty:
+            self.timer.count("freight_rows", len(freight))
+            output_path = self.sheet_output_folder(out_dir, sh)
+
+            # Create the full file path
+            file_path = output_path / f"{output_path.name}_freight_table.xlsx"
+            with self.timer.stage("write_freight_table"):
                 freight.to_excel(file_path, index=False)
-                # freight.to_excel(folder / f"{folder.name}_freight_table.xlsx", index=False)
-                # combine and save context
-                combined = self.combine_context(context, extras, sh)
-                #combine surcharges
-                surcharges_combined = self.combine_context(context,surcharges,sh)
-
-                rest = output_path / f"{output_path.name}_surcharges.xlsx"
-                with pd.ExcelWriter(rest, engine='openpyxl') as w:
-                    if surcharges_combined is not None and not surcharges_combined.empty:
-                        # clean out blank rows
-                        surcharges_combined = clean_context(surcharges_combined)
-                        surcharges_combined.to_excel(w,
-                                        sheet_name='rest',
-                                        index=False,
-                                        header=False)
-
-                ctxf = output_path / f"{output_path.name}_context.xlsx"
-                with pd.ExcelWriter(ctxf, engine='openpyxl') as w:
-                    if combined is not None and not combined.empty:
-                        # clean out blank rows
-                        combined = clean_context(combined)
-                        combined.to_excel(w,
-                                        sheet_name='Context',
-                                        index=False,
-                                        header=False)
-                    else:
-                        pd.DataFrame([["No context found"]]).to_excel(w, sheet_name='Context', index=False, header=False)
+            self.write_context_files(output_path, sh, context, shared)
 
-        logger.info("Processing complete.")
+    def process_sheet_streaming(self, fp: Path, out_dir: Path, sh: str, shared: dict) -> None:
+        """process_sheet with memory bounded by the context, not by the table.
+
+        Pass 1 streams the sheet to find the header, the table end and the
+        non-empty columns; pass 2 streams the table rows into a write-only workbook.
+        """
+        lookback = 8
+        merged = read_merged_ranges(fp, sh)
+        self.timer.count("merged_ranges", len(merged))
+
+        with self.timer.stage("stream_scan"):
+            rows = self.iter_unmerged_rows(fp, sh, merged)
+            head = list(itertools.islice(rows, HEADER_SCAN_ROWS))
+            head_df = pd.DataFrame(head)
+        if head_df.empty:
+            return
+        with self.timer.stage("header_detection"):
+            hdr = self.detect_header_row(head_df)
+        if hdr is None:
+            rows.close()
+            return
+
+        start = hdr+1
+        cols = self.merge_multi_level_headers(head_df, hdr)
+        width = len(cols)
+        occupied = [False] * width
+        table_rows = 0
+        context_rows = head[:start]
+        detector = TableEndDetector(start, lookback=lookback)
+        window = deque()  # rows fed to the detector that may still fall after the table end
+        end = None
+
+        def keep(values):
+            nonlocal table_rows
+            filled = [c for c, v in enumerate(values[:width]) if pd.notna(v)]
+            if filled:
+                table_rows += 1
+                for c in filled:
+                    occupied[c] = True
+
+        with self.timer.stage("stream_scan"):
+            for idx, values in enumerate(itertools.chain(head[start:], rows), start=start):
+                self.timer.count("cells", len(values))
+                if end is not None:
+                    context_rows.append(values)
+                    continue
+                window.append((idx, values))
+                end = detector.feed(values)
+                if end is None and len(window) > lookback:
+                    keep(window.popleft()[1])
+            if end is None:
+                end = detector.finish()
+            for idx, values in window:
+                if idx < end:
+                    keep(values)
+                else:
+                    context_rows.append(values)
+            window.clear()
+
+        if not table_rows or not any(occupied):
+            return
+        self.timer.count("freight_rows", table_rows)
+        columns = [c for c in range(width) if occupied[c]]
+        output_path = self.sheet_output_folder(out_dir, sh)
+        file_path = output_path / f"{output_path.name}_freight_table.xlsx"
+
+        with self.timer.stage("write_freight_table"):
+            wb = openpyxl.Workbook(write_only=True)
+            ws = wb.create_sheet("Sheet1")
+            ws.append([cols[c] for c in columns])
+            for idx, values in enumerate(self.iter_unmerged_rows(fp, sh, merged)):
+                if idx < start:
+                    continue
+                if idx >= end:
+                    break
+                if any(pd.notna(v) for v in values[:width]):
+                    ws.append([values[c] if c < len(values) else None for c in columns])
+            wb.save(file_path)
+
+        context = pd.DataFrame(context_rows) if context_rows else None
+        self.write_context_files(output_path, sh, context, shared)
+
+    def sheet_output_folder(self, out_dir: Path, sh: str) -> Path:
+        folder = out_dir / re.sub(r'[<>:"/\\|?*]', '_', sh)
+        folder.mkdir(parents=True, exist_ok=True)
+        # save freight table
+        output_path = Path(folder).resolve()
+        output_path.mkdir(parents=True, exist_ok=True)
+        return output_path
+
+    def write_context_files(self, output_path: Path, sh: str, context: Optional[pd.DataFrame],
+                            shared: dict) -> None:
+        """Save the sheet's own context and reference the shared workbook context"""
+        combined = self.combine_context(context, [], sh)
+
+        ctxf = output_path / f"{output_path.name}_context.xlsx"
+        with self.timer.stage("write_context"):
+            # clean out blank rows
+            combined = clean_context(combined) if combined is not None else pd.DataFrame()
+            write_context_workbook(ctxf, combined, 'Context')
+        write_sheet_reference(output_path, shared)
 
 
 # # Example usage:
@@ -0,0 +1,179 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from progress import write_json_atomic
+
+# Profiling hooks for the preprocessing pipeline.
+#
+# StageTimer is always on and cheap: named stage timings and counters (cells,
+# merged ranges, rows scored) per sheet. A full profiler is opt-in per job via
+# the `profile` job param:
+#   "cprofile"  deterministic cProfile of the job thread -> .prof + text report
+#   "sampling"  samples the job thread's stack every few ms -> collapsed stacks
+#               (flamegraph.pl / speedscope compatible); low overhead
+# Reports are written to `{output_main_folder}/_profile/`.
+
+PROFILE_FOLDER_NAME = "_profile"
+PROFILE_MODES = ("cprofile", "sampling")
+WORKBOOK_SCOPE = "_workbook"
+SAMPLING_INTERVAL = float(os.getenv("PROFILE_SAMPLING_INTERVAL", "0.005"))
+
+logger = logging.getLogger(__name__)
+
+
+class StageTimer:
+    """Accumulates stage durations and counters per sheet.
+
+    Not thread-safe: one timer belongs to one extractor run.
+    """
+
+    def __init__(self):
+        self.stages = defaultdict(lambda: defaultdict(float))
+        self.calls = defaultdict(Counter)
+        self.counters = defaultdict(Counter)
+        self._sheet = WORKBOOK_SCOPE
+        self._started = time.perf_counter()
+
+    @contextmanager
+    def sheet(self, name):
+        """Attribute stages and counters inside the block to `name`"""
+        previous, self._sheet = self._sheet, name
+        try:
+            yield
+        finally:
+            self._sheet = previous
+
+    @contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[self._sheet][name] += time.perf_counter() - t0
+            self.calls[self._sheet][name] += 1
+
+    def count(self, name, n=1):
+        self.counters[self._sheet][name] += n
+
+    def report(self):
+        totals, counter_totals = defaultdict(float), Counter()
+        sheets = {}
+        for sheet in sorted(set(self.stages) | set(self.counters)):
+            for name, seconds in self.stages[sheet].items():
+                totals[name] += seconds
+            counter_totals.update(self.counters[sheet])
+            sheets[sheet] = {
+                "stages": {name: round(s, 4) for name, s in self.stages[sheet].items()},
+                "calls": dict(self.calls[sheet]),
+                "counters": dict(self.counters[sheet]),
+            }
+        return {
+            "wall_seconds": round(time.perf_counter() - self._started, 4),
+            "stages": {name: round(s, 4) for name, s in sorted(totals.items(), key=lambda kv: -kv[1])},
+            "counters": dict(counter_totals),
+            "sheets": sheets,
+        }
+
+    def summary(self):
+        """One-line stage breakdown for the logs"""
+        report = self.report()
+        parts = [f"{name} {seconds:.2f}s" for name, seconds in report["stages"].items()]
+        return f"{report['wall_seconds']:.2f}s total: " + ", ".join(parts)
+
+
+class SamplingProfiler:
+    """Samples one thread's Python stack at a fixed interval and counts collapsed stacks"""
+
+    def __init__(self, thread_id=None, interval=SAMPLING_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+    def top_functions(self, limit=30):
+        """Self time per function, as (function, samples) pairs"""
+        leaf = Counter(stack.rsplit(";", 1)[-1] for stack in self.samples.elements())
+        return leaf.most_common(limit)
+
+
+@contextmanager
+def profile_job(mode, output_main_folder, name="preprocessing"):
+    """Profile the enclosed block with `mode` (None, "cprofile" or "sampling")"""
+    if not mode:
+        yield
+        return
+    if mode not in PROFILE_MODES:
+        raise ValueError(f"Unknown profile mode: {mode} (expected one of {PROFILE_MODES})")
+
+    profile_folder = os.path.join(output_main_folder, PROFILE_FOLDER_NAME)
+    os.makedirs(profile_folder, exist_ok=True)
+
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(profile_folder, f"{name}.prof"))
+            report = io.StringIO()
+            pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(60)
+            with open(os.path.join(profile_folder, f"{name}_cprofile.txt"), "w", encoding="utf-8") as f:
+                f.write(report.getvalue())
+    else:
+        profiler = SamplingProfiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            profiler.write(os.path.join(profile_folder, f"{name}_stacks.txt"))
+            with open(os.path.join(profile_folder, f"{name}_sampling.txt"), "w", encoding="utf-8") as f:
+                total = sum(profiler.samples.values()) or 1
+                f.write(f"{total} samples every {profiler.interval * 1000:.1f} ms\n\n")
+                for function, samples in profiler.top_functions():
+                    f.write(f"{samples / total:7.1%}  {samples:6d}  {function}\n")
+    logger.info(f"Wrote {mode} profile to {profile_folder}")
+
+
+def write_stage_report(timer, output_main_folder, name="preprocessing"):
+    """Dump a StageTimer report to `_profile/{name}_stages.json`; returns the path"""
+    profile_folder = os.path.join(output_main_folder, PROFILE_FOLDER_NAME)
+    os.makedirs(profile_folder, exist_ok=True)
+    path = os.path.join(profile_folder, f"{name}_stages.json")
+    write_json_atomic(path, timer.report())
+    return path
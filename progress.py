@@ -0,0 +1,147 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+def write_json_atomic(path, data):
+    """Write JSON to a temp file and rename it over `path`, so readers never see a partial file"""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def read_json_file(path):
+    """Read a JSON file, returning None if it is missing or mid-write"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+class ProgressReporter:
+    """Row-level progress channel for a job, written to `{file_stem}_progress.json`.
+
+    The extraction engine reports rows as they are dispatched and finished;
+    the reporter keeps per-sheet counters plus rolling throughput figures and
+    rewrites the progress file at most once every `min_interval` seconds.
+    """
+
+    def __init__(self, path, min_interval=0.5, window_seconds=60.0):
+        self.path = path
+        self.min_interval = min_interval
+        self.window_seconds = window_seconds
+        self.started_at = time.time()
+        self.step = None
+        self.sheets = {}
+        self._completions = deque()  # (timestamp, tokens) of recently finished rows
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+
+    def set_step(self, step):
+        with self._lock:
+            self.step = step
+        self.flush(force=True)
+
+    def register_sheet(self, sheet, rows_total):
+        """Announce a sheet and its row count before extraction starts"""
+        with self._lock:
+            self.sheets[sheet] = {
+                "status": "pending",
+                "rows_total": rows_total,
+                "rows_done": 0,
+                "rows_failed": 0,
+                "rows_in_flight": 0,
+            }
+        self.flush()
+
+    def start_sheet(self, sheet, rows_total=None):
+        with self._lock:
+            counters = self.sheets.setdefault(sheet, {
+                "rows_total": 0, "rows_done": 0, "rows_failed": 0, "rows_in_flight": 0,
+            })
+            counters["status"] = "processing"
+            if rows_total is not None:
+                counters["rows_total"] = rows_total
+        self.flush(force=True)
+
+    def finish_sheet(self, sheet, success=True):
+        with self._lock:
+            if sheet in self.sheets:
+                self.sheets[sheet]["status"] = "completed" if success else "failed"
+                self.sheets[sheet]["rows_in_flight"] = 0
+        self.flush(force=True)
+
+    def set_sheet_counts(self, sheet, rows_done, rows_failed, rows_in_flight=0):
+        """Overwrite a sheet's counters with totals observed elsewhere (e.g. a shared work queue)"""
+        now = time.time()
+        with self._lock:
+            counters = self.sheets.setdefault(sheet, {"status": "processing", "rows_total": 0})
+            newly_done = max(0, rows_done - counters.get("rows_done", 0))
+            counters.update(rows_done=rows_done, rows_failed=rows_failed, rows_in_flight=rows_in_flight)
+            self._completions.extend((now, 0) for _ in range(newly_done))
+        self.flush()
+
+    def row_started(self, sheet):
+        with self._lock:
+            self.sheets[sheet]["rows_in_flight"] += 1
+        self.flush()
+
+    def row_finished(self, sheet, failed=False, usage=None):
+        now = time.time()
+        tokens = 0
+        if usage:
+            tokens = (usage.get("inputTokens") or 0) + (usage.get("outputTokens") or 0)
+        with self._lock:
+            counters = self.sheets[sheet]
+            counters["rows_in_flight"] = max(0, counters["rows_in_flight"] - 1)
+            counters["rows_done"] += 1
+            if failed:
+                counters["rows_failed"] += 1
+            self._completions.append((now, tokens))
+        self.flush()
+
+    def snapshot(self):
+        with self._lock:
+            now = time.time()
+            while self._completions and now - self._completions[0][0] > self.window_seconds:
+                self._completions.popleft()
+
+            rows_total = sum(s["rows_total"] for s in self.sheets.values())
+            rows_done = sum(s["rows_done"] for s in self.sheets.values())
+
+            # Rates over the rolling window (or since start if the job is younger than it)
+            span = min(self.window_seconds, max(now - self.started_at, 1e-6))
+            rows_per_second = len(self._completions) / span
+            tokens_per_second = sum(t for _, t in self._completions) / span
+            remaining = max(0, rows_total - rows_done)
+            eta_seconds = remaining / rows_per_second if rows_per_second > 0 else None
+
+            return {
+                "step": self.step,
+                "started_at": self.started_at,
+                "updated_at": now,
+                "elapsed_seconds": now - self.started_at,
+                "rows_total": rows_total,
+                "rows_done": rows_done,
+                "rows_failed": sum(s["rows_failed"] for s in self.sheets.values()),
+                "rows_in_flight": sum(s["rows_in_flight"] for s in self.sheets.values()),
+                "rows_per_second": rows_per_second,
+                "tokens_per_second": tokens_per_second,
+                "eta_seconds": eta_seconds,
+                "sheets": {name: dict(counters) for name, counters in self.sheets.items()},
+            }
+
+    def flush(self, force=False):
+        """Write the progress file, throttled to one write per `min_interval`"""
+        now = time.time()
+        if not force and now - self._last_write < self.min_interval:
+            return
+        self._last_write = now
+        try:
+            write_json_atomic(self.path, self.snapshot())
+        except OSError as e:
+            print(f"⚠️ Could not write progress file {self.path}: {e}")
@@ -0,0 +1,210 @@
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Host-wide Bedrock quota limiter.
+#
+# Every model call first takes one request and its estimated tokens from two
+# token buckets per model_id (requests per minute and tokens per minute). The
+# buckets live in a small SQLite file, so every job thread, worker process and
+# batch on the host draws from the same budget. After the call the estimate
+# is settled against the tokens Bedrock actually reported, and a
+# ThrottlingException empties the request bucket for a few seconds so every
+# process backs off together.
+#
+# Quotas are configured, not discovered:
+#   BEDROCK_RATE_LIMITS   JSON {"amazon.nova-pro-v1:0": {"rpm": 200, "tpm": 400000}, ...}
+#   BEDROCK_DEFAULT_RPM / BEDROCK_DEFAULT_TPM   for models not listed (0 = unlimited)
+# With nothing configured the limiter does nothing.
+
+BEDROCK_RATE_LIMIT_DB = os.getenv("BEDROCK_RATE_LIMIT_DB", "bedrock_rate_limits.db")
+BEDROCK_DEFAULT_RPM = float(os.getenv("BEDROCK_DEFAULT_RPM", "0"))
+BEDROCK_DEFAULT_TPM = float(os.getenv("BEDROCK_DEFAULT_TPM", "0"))
+# Largest burst, in seconds of quota; smooths a full minute of requests over time
+BEDROCK_BURST_SECONDS = float(os.getenv("BEDROCK_BURST_SECONDS", "10"))
+THROTTLE_PENALTY_SECONDS = float(os.getenv("BEDROCK_THROTTLE_PENALTY_SECONDS", "5"))
+MAX_SLEEP = 1.0
+CHARS_PER_TOKEN = 4
+
+# Called as fn(waited_seconds) in the caller's context each time acquire lets a call
+# through, so callers can time model calls without the quota wait
+# (see extraction.call_with_progress and hedging.py)
+on_quota_acquired = contextvars.ContextVar("on_quota_acquired", default=None)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    model_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    level REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (model_id, kind)
+);
+"""
+
+
+def load_quotas():
+    """{model_id: (rpm, tpm)} from BEDROCK_RATE_LIMITS"""
+    raw = os.getenv("BEDROCK_RATE_LIMITS", "").strip()
+    if not raw:
+        return {}
+    return {
+        model_id: (float(limits.get("rpm") or 0), float(limits.get("tpm") or 0))
+        for model_id, limits in json.loads(raw).items()
+    }
+
+
+def estimate_tokens(*texts):
+    return sum(len(text) for text in texts) // CHARS_PER_TOKEN
+
+
+def is_throttling_error(error):
+    code = (getattr(error, "response", None) or {}).get("Error", {}).get("Code", "")
+    return code in ("ThrottlingException", "TooManyRequestsException") or "Throttling" in type(error).__name__
+
+
+class RateLimiter:
+    """Token buckets per model_id shared across processes through SQLite"""
+
+    def __init__(self, db_path=BEDROCK_RATE_LIMIT_DB, quotas=None, default_rpm=BEDROCK_DEFAULT_RPM,
+                 default_tpm=BEDROCK_DEFAULT_TPM, burst_seconds=BEDROCK_BURST_SECONDS):
+        self.db_path = db_path
+        self.quotas = load_quotas() if quotas is None else quotas
+        self.default = (default_rpm, default_tpm)
+        self.burst_seconds = burst_seconds
+        self._local = threading.local()
+        self._output_estimates = {}
+        self._lock = threading.Lock()
+        self.waited_seconds = 0.0
+
+    def quota(self, model_id):
+        """(rpm, tpm) for a model, or None if it is not limited"""
+        rpm, tpm = self.quotas.get(model_id, self.default)
+        return (rpm, tpm) if rpm or tpm else None
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _capacity(self, limit):
+        return max(1.0, limit * self.burst_seconds / 60)
+
+    def _buckets(self, quota, tokens):
+        """(kind, capacity, refill per second, cost) for the limited dimensions"""
+        rpm, tpm = quota
+        for kind, limit, cost in (("requests", rpm, 1), ("tokens", tpm, tokens)):
+            if limit:
+                capacity = self._capacity(limit)
+                # A single call larger than the bucket would otherwise never fit
+                yield kind, capacity, limit / 60, min(cost, capacity)
+
+    def _try_take(self, model_id, quota, tokens):
+        """Take from every bucket at once, or return the seconds to wait"""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            stored = {kind: (level, updated) for kind, level, updated in conn.execute(
+                "SELECT kind, level, updated_at FROM buckets WHERE model_id = ?", (model_id,))}
+            levels, wait = [], 0.0
+            for kind, capacity, rate, cost in self._buckets(quota, tokens):
+                level, updated = stored.get(kind, (capacity, now))
+                level = min(capacity, level + (now - updated) * rate)
+                levels.append((kind, level - cost))
+                if level < cost:
+                    wait = max(wait, (cost - level) / rate)
+            if wait:
+                conn.execute("ROLLBACK")
+                return wait
+            conn.executemany(
+                "INSERT OR REPLACE INTO buckets (model_id, kind, level, updated_at) VALUES (?, ?, ?, ?)",
+                [(model_id, kind, level, now) for kind, level in levels])
+            conn.execute("COMMIT")
+            return 0.0
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def expected_output_tokens(self, model_id, max_tokens):
+        with self._lock:
+            return min(max_tokens, self._output_estimates.get(model_id, max_tokens / 4))
+
+    def acquire(self, model_id, input_tokens, max_tokens):
+        """Block until the call fits the model's quota; returns the tokens reserved"""
+        reserved, waited = self._take(model_id, input_tokens, max_tokens)
+        callback = on_quota_acquired.get()
+        if callback is not None:
+            callback(waited)
+        return reserved
+
+    def _take(self, model_id, input_tokens, max_tokens):
+        """(tokens reserved, seconds waited)"""
+        quota = self.quota(model_id)
+        if quota is None:
+            return 0, 0.0
+        tokens = input_tokens + self.expected_output_tokens(model_id, max_tokens)
+        if quota[1]:
+            # What _buckets actually takes, so settle never credits more than was taken
+            tokens = min(tokens, self._capacity(quota[1]))
+        waited = 0.0
+        while True:
+            wait = self._try_take(model_id, quota, tokens)
+            if not wait:
+                return tokens, waited
+            wait = min(wait, MAX_SLEEP)
+            with self._lock:
+                self.waited_seconds += wait
+            time.sleep(wait)
+            waited += wait
+
+    def settle(self, model_id, reserved, input_tokens, output_tokens):
+        """Correct the token bucket by the difference between the estimate and the actual usage"""
+        if not reserved:
+            return
+        if input_tokens or output_tokens:
+            with self._lock:
+                previous = self._output_estimates.get(model_id)
+                self._output_estimates[model_id] = (output_tokens if previous is None
+                                                    else 0.8 * previous + 0.2 * output_tokens)
+        quota = self.quota(model_id)
+        if quota is None or not quota[1]:
+            return
+        self._conn().execute(
+            "UPDATE buckets SET level = MIN(?, level + ?) WHERE model_id = ? AND kind = 'tokens'",
+            (self._capacity(quota[1]), reserved - input_tokens - output_tokens, model_id))
+
+    def penalize(self, model_id, seconds=THROTTLE_PENALTY_SECONDS):
+        """After a throttle, make every process wait about `seconds` before the next call"""
+        quota = self.quota(model_id)
+        if quota is None or not quota[0]:
+            return
+        self._conn().execute(
+            "UPDATE buckets SET level = MIN(level, ?), updated_at = ? WHERE model_id = ? AND kind = 'requests'",
+            (-quota[0] / 60 * seconds, time.time(), model_id))
+
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = RateLimiter()
+    return _rate_limiter
+
+
+def set_rate_limiter(limiter):
+    """Replace the process-wide limiter (benchmarks, tests); None resets to the env configuration"""
+    global _rate_limiter
+    with _rate_limiter_lock:
+        _rate_limiter = limiter
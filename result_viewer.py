@@ -0,0 +1,134 @@
+import json
+import math
+import os
+
+import pandas as pd
+import streamlit as st
+
+from json_records import iter_json_record_batches
+
+# Viewer for extraction outputs that stays responsive with 20k+ records.
+#
+# Parsed files are cached once per server (not per session) keyed by
+# (path, mtime), so a file that is still being written is re-read only when it
+# changes. A file is held once, as a DataFrame built from streamed batches of
+# records; only the current page is sent to the browser.
+
+PAGE_SIZES = [50, 100, 250, 500]
+RESULT_EXTENSIONS = (".json", ".jsonl")
+
+
+@st.cache_data(ttl=10, show_spinner=False)
+def list_output_files(root_folder):
+    """Return {folder_name: [{"file_name", "file_path"}, ...]} for result files under root_folder"""
+    files_by_folder = {}
+    for dirpath, dirnames, filenames in os.walk(root_folder):
+        dirnames.sort()
+        files = [
+            {"file_name": file, "file_path": os.path.join(dirpath, file)}
+            for file in sorted(filenames) if file.endswith(RESULT_EXTENSIONS)
+        ]
+        if files:
+            relative_path = os.path.relpath(dirpath, root_folder)
+            folder_name = "Root" if relative_path == "." else relative_path
+            files_by_folder[folder_name] = files
+    return files_by_folder
+
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _collect_failed_rows(output_main_folder, signature):
+    from extraction import collect_failed_rows
+    return collect_failed_rows(output_main_folder)
+
+
+def failed_rows_summary(output_main_folder):
+    """Cached `collect_failed_rows`; rescans only when an output file changes"""
+    signature = []
+    if os.path.isdir(output_main_folder):
+        for subfolder_name in sorted(os.listdir(output_main_folder)):
+            output_path = os.path.join(output_main_folder, subfolder_name, "freight_rates.json")
+            if os.path.exists(output_path):
+                signature.append((subfolder_name, os.path.getmtime(output_path)))
+    return _collect_failed_rows(output_main_folder, tuple(signature))
+
+
+@st.cache_resource(max_entries=8, show_spinner="Loading results...")
+def load_records_frame(file_path, mtime):
+    """Stream a result file into one DataFrame (a row per record), shared by all sessions.
+
+    Records are kept only as DataFrame rows; the raw JSON view rebuilds a
+    page's records from them (see page_records). `mtime` is only part of the
+    cache key, so a rewritten file is reloaded.
+    """
+    # object columns keep ints as ints when some records lack the key
+    frames = [pd.DataFrame(batch, dtype=object) for batch in iter_json_record_batches(file_path)]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+
+def page_records(page_df):
+    """The records of a page, without the keys a record did not have (NaN in the frame)"""
+    return [
+        {name: value for name, value in row.items() if not (isinstance(value, float) and math.isnan(value))}
+        for row in page_df.to_dict("records")
+    ]
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def filter_row_positions(file_path, mtime, column, query):
+    """Positions of the rows whose `column` contains `query` (case-insensitive)"""
+    df = load_records_frame(file_path, mtime)
+    if not column or not query or column not in df.columns:
+        return list(range(len(df)))
+    mask = df[column].astype(str).str.contains(query, case=False, regex=False, na=False)
+    return mask.to_numpy().nonzero()[0].tolist()
+
+
+def displayable(page_df):
+    """Render nested list/dict cells as JSON text so mixed-type columns survive Arrow conversion"""
+    page_df = page_df.copy()
+    for column in page_df.columns:
+        if page_df[column].dtype == object:
+            page_df[column] = page_df[column].map(
+                lambda v: json.dumps(v, ensure_ascii=False) if isinstance(v, (list, dict)) else v
+            )
+    return page_df
+
+
+def render_result_viewer(file_path, key):
+    """Render one result file as a filterable, server-side paginated table"""
+    try:
+        mtime = os.path.getmtime(file_path)
+    except OSError as e:
+        st.error(f"❌ Error reading {file_path}: {e}")
+        return
+
+    df = load_records_frame(file_path, mtime)
+    if df.empty:
+        st.info("No records in this file yet.")
+        return
+
+    col1, col2, col3 = st.columns([2, 2, 1])
+    with col1:
+        filter_column = st.selectbox("Filter column", [""] + list(df.columns), key=f"{key}_filter_col")
+    with col2:
+        query = st.text_input("Contains", key=f"{key}_filter_query", disabled=not filter_column)
+    with col3:
+        page_size = st.selectbox("Rows per page", PAGE_SIZES, key=f"{key}_page_size")
+
+    columns = st.multiselect("Columns", list(df.columns), key=f"{key}_columns",
+                             placeholder="All columns")
+
+    positions = filter_row_positions(file_path, mtime, filter_column, query.strip())
+    page_count = max(1, -(-len(positions) // page_size))
+    page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1,
+                           key=f"{key}_page")
+    page_positions = positions[(page - 1) * page_size: page * page_size]
+
+    st.caption(f"{len(positions)} of {len(df)} record(s)")
+
+    tab1, tab2 = st.tabs(["📊 Table View", "📋 Raw JSON"])
+    page_df = df.iloc[page_positions]
+    with tab1:
+        st.dataframe(displayable(page_df[columns] if columns else page_df), use_container_width=True)
+    with tab2:
+        st.json(page_records(page_df))
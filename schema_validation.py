@@ -0,0 +1,226 @@
+import csv
+import json
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+from freight_schema import (BOOL_FIELDS, CURRENCY_FIELDS, DATE_FIELDS, DAY_TYPES, ENUM_FIELDS, FREEDAY_FIELDS,
+                            FREEDAY_TYPES, LIST_FIELDS, MANDATORY_FIELDS, RECORD_FIELDS)
+
+# Checks a model response against the f9.txt output schema.
+#
+# The field rules quoted in repair requests come from the job's own extraction
+# prompt (f9.txt or custom_prompt.txt). A prompt that no longer has a rule for
+# every schema field describes some other output, so its responses are not
+# validated or repaired at all (see prompt_field_rules).
+#
+# The schema is compiled once into one checker function per field, so
+# validating a record is a single pass of cheap type and set lookups. Field
+# errors are kept per record and field, which lets the extraction engine ask
+# the model to repair just those fields (see repair_request) instead of
+# re-extracting the row.
+#
+# Confidence is a softer signal: the share of the row's numeric cells (rates,
+# transit days, free days) that show up somewhere in the output, so a response
+# that silently drops rate columns scores low even if it is valid.
+
+DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+CURRENCY_RE = re.compile(r"^[A-Z]{3}$")
+NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")
+THOUSANDS_RE = re.compile(r"(?<=\d),(?=\d{3}\b)")
+FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL)
+# "5. **leg**" / "2. **`carrier_tariff_number`** *(Optional, string)*" in f9.txt
+RULE_HEADING_RE = re.compile(r"^\s*\d+\.\s+\*\*`?(\w+)`?\*\*")
+
+
+def _freeday_error(item):
+    if not isinstance(item, dict):
+        return "FreeDay is not an object"
+    days = item.get("free_days")
+    if isinstance(days, bool) or not isinstance(days, int):
+        return "FreeDay.free_days is not an integer"
+    if item.get("free_days_type") not in FREEDAY_TYPES:
+        return f"FreeDay.free_days_type must be one of {sorted(FREEDAY_TYPES)}"
+    if item.get("day_type") not in DAY_TYPES:
+        return f"FreeDay.day_type must be one of {sorted(DAY_TYPES)}"
+    return None
+
+
+def _compile_checker(name):
+    """Checker for one field: value -> error message or None"""
+    if name in FREEDAY_FIELDS:
+        def check(value):
+            if not isinstance(value, list):
+                return "must be a list of FreeDay objects"
+            for item in value:
+                error = _freeday_error(item)
+                if error:
+                    return error
+            return None
+    elif name == "freight_rates":
+        def check(value):
+            if not isinstance(value, list):
+                return "must be a list"
+            if any(not isinstance(r, str) or ":" not in r for r in value):
+                return "entries must be 'COLUMN_HEADER:rate_value' strings"
+            return None
+    elif name in LIST_FIELDS:
+        def check(value):
+            return None if isinstance(value, list) else "must be a list"
+    elif name in BOOL_FIELDS:
+        def check(value):
+            return None if isinstance(value, bool) else "must be true or false"
+    elif name in DATE_FIELDS:
+        def check(value):
+            return None if value == "" or (isinstance(value, str) and DATE_RE.match(value)) else "must be YYYY-MM-DD"
+    elif name in ENUM_FIELDS:
+        allowed = frozenset(ENUM_FIELDS[name])
+        message = "must be one of " + ", ".join(f'"{v}"' for v in sorted(allowed))
+
+        def check(value):
+            return None if isinstance(value, str) and value in allowed else message
+    elif name in CURRENCY_FIELDS:
+        def check(value):
+            return None if value == "" or (isinstance(value, str) and CURRENCY_RE.match(value)) else "must be a 3-letter currency code"
+    elif name in MANDATORY_FIELDS:
+        def check(value):
+            return None if isinstance(value, str) and value.strip() else "is mandatory"
+    else:
+        # Free-text fields; code lists are tolerated, the export flattens them
+        def check(value):
+            return None if isinstance(value, (str, int, float, list)) and not isinstance(value, bool) else "must be a string"
+    return check
+
+
+CHECKERS = tuple((name, _compile_checker(name)) for name in RECORD_FIELDS)
+
+
+@dataclass
+class ValidationResult:
+    records: list | None
+    errors: list = field(default_factory=list)
+    confidence: float = 0.0
+    # {record index: {field: message}}
+    field_errors: dict = field(default_factory=dict)
+
+    @property
+    def valid(self):
+        return self.records is not None and not self.errors
+
+
+def parse_records(text):
+    """JSON array (or single object) from a model response, allowing a ```json fence; None if unparseable"""
+    text = text.strip()
+    fenced = FENCE_RE.search(text)
+    if fenced:
+        text = fenced.group(1).strip()
+    try:
+        records = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    return records if isinstance(records, list) else [records]
+
+
+def field_errors(record):
+    """{field: message} for every missing or invalid field of a record"""
+    errors = {}
+    for name, check in CHECKERS:
+        if name not in record:
+            errors[name] = "is missing"
+            continue
+        error = check(record[name])
+        if error:
+            errors[name] = error
+    return errors
+
+
+def numeric_cells(row_csv):
+    """Numbers in a row, normalized so "1,250.00" and 1250 compare equal"""
+    numbers = set()
+    for cell in next(csv.reader([row_csv]), []):
+        try:
+            numbers.add(float(cell.strip().replace(",", "")))
+        except ValueError:
+            continue
+    return numbers
+
+
+def coverage(records, row_csv):
+    """Share of the row's numeric cells that appear in the records (1.0 for rows without numbers)"""
+    wanted = numeric_cells(row_csv)
+    if not wanted:
+        return 1.0
+    text = THOUSANDS_RE.sub("", json.dumps(records, ensure_ascii=False))
+    found = {float(n) for n in NUMBER_RE.findall(text)}
+    return len(wanted & found) / len(wanted)
+
+
+def validate_records(records, row_csv):
+    errors, by_record = [], {}
+    for i, record in enumerate(records):
+        if not isinstance(record, dict):
+            errors.append(f"record {i}: is {type(record).__name__}, not an object")
+            continue
+        invalid = field_errors(record)
+        if invalid:
+            by_record[i] = invalid
+            errors.extend(f"record {i}: {name} {message}" for name, message in invalid.items())
+    if not records and numeric_cells(row_csv):
+        errors.append("no records for a row with numeric cells")
+    return ValidationResult(records, errors, coverage(records, row_csv) if records else 0.0, by_record)
+
+
+def validate_extraction(text, row_csv):
+    """Validate one row's model response against the extraction schema"""
+    records = parse_records(text)
+    if records is None:
+        return ValidationResult(None, ["response is not JSON"])
+    return validate_records(records, row_csv)
+
+
+# One entry per subfolder prompt being extracted at the same time
+@lru_cache(maxsize=32)
+def load_field_rules(prompt):
+    """{field: rule text} from the numbered "Column Specific Rules" of an extraction prompt's text"""
+    rules, current = {}, None
+    for line in prompt.splitlines():
+        heading = RULE_HEADING_RE.match(line)
+        if heading and heading.group(1) in RECORD_FIELDS:
+            current = heading.group(1)
+            rules[current] = [line.strip()]
+        elif current and line.startswith("**"):
+            current = None
+        elif current:
+            rules[current].append(line.strip())
+    return {name: "\n".join(lines) for name, lines in rules.items()}
+
+
+def prompt_field_rules(prompt):
+    """Field rules of a prompt that still describes the whole output schema, else None"""
+    rules = load_field_rules(prompt)
+    return rules if len(rules) == len(RECORD_FIELDS) else None
+
+
+def repair_request(row_csv, record, invalid, rules):
+    """User input asking for corrected values of just the `invalid` fields of one record"""
+    problems = []
+    for name, message in invalid.items():
+        problems.append(f"- {name}: {message} (got {json.dumps(record.get(name), ensure_ascii=False)})")
+        if name in rules:
+            problems.append("  " + rules[name].replace("\n", "\n  "))
+    return (
+        "REPAIR REQUEST: the row below was already extracted, but some fields of the result are invalid.\n"
+        "Return ONLY a JSON object with corrected values for the listed fields, following the schema and "
+        "field rules. Do not include any other keys or explanations.\n"
+        f"<document_chunk_content>\n{row_csv.strip()}\n</document_chunk_content>\n"
+        f"<extracted_record>\n{json.dumps(record, ensure_ascii=False)}\n</extracted_record>\n"
+        f"<invalid_fields>\n" + "\n".join(problems) + "\n</invalid_fields>"
+    )
+
+
+def merge_repair(record, invalid, text):
+    """Record with the repaired fields from a repair response applied; unrequested keys are ignored"""
+    repaired = parse_records(text)
+    if not repaired or not isinstance(repaired[0], dict):
+        return record
+    return {**record, **{name: value for name, value in repaired[0].items() if name in invalid}}
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+import threading
+from functools import lru_cache
+
+# Workbook-wide context stored once per workbook.
+#
+# The freetime, rule and surcharge sheets of a workbook apply to every freight
+# sheet. Preprocessing writes each of those blocks once, to a content-addressed
+# file under `{workbook}_processed/_shared/{sha}.xlsx`. Each sheet folder keeps
+# only its own context (`{sheet}_context.xlsx`) plus `shared_context.json`,
+# which names the shared artifacts it uses:
+#
+#   {"context": "_shared/3f2a....xlsx", "surcharges": "_shared/91c0....xlsx"}
+#
+# Readers join the local context and the shared block; the shared block is
+# parsed once per process and artifact (see read_context_csv).
+
+SHARED_DIRNAME = "_shared"
+REFERENCE_FILENAME = "shared_context.json"
+DIGEST_LENGTH = 16
+
+_write_lock = threading.Lock()
+
+
+def is_shared_folder(name):
+    """True for the `_shared` folder that sits next to the sheet folders"""
+    return name == SHARED_DIRNAME
+
+
+def frame_digest(df):
+    return hashlib.sha256(df.to_csv(index=False, header=False).encode("utf-8")).hexdigest()[:DIGEST_LENGTH]
+
+
+def write_shared_artifact(out_dir, df, sheet_name):
+    """Write `df` to `_shared/{sha}.xlsx` unless it is already there; returns the path relative to `out_dir`"""
+    relative = f"{SHARED_DIRNAME}/{frame_digest(df)}.xlsx"
+    path = os.path.join(out_dir, relative)
+    with _write_lock:
+        if os.path.exists(path):
+            return relative
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = os.path.join(os.path.dirname(path), f".{os.getpid()}.{os.path.basename(path)}")
+        write_context_workbook(tmp, df, sheet_name)
+        os.replace(tmp, path)
+    return relative
+
+
+def write_context_workbook(path, df, sheet_name):
+    """Write a context block without a header row, keeping "=== ... ===" markers as text.
+
+    openpyxl stores any string starting with "=" as a formula, which readers
+    then see as an empty cell.
+    """
+    import pandas as pd
+
+    with pd.ExcelWriter(path, engine="openpyxl") as w:
+        df.to_excel(w, sheet_name=sheet_name, index=False, header=False)
+        for row in w.sheets[sheet_name].iter_rows():
+            for cell in row:
+                if cell.data_type == "f":
+                    cell.data_type = "s"
+
+
+def write_sheet_reference(sheet_folder, references):
+    """Record which shared artifacts (`{kind: relative path}`) a sheet folder uses"""
+    path = os.path.join(sheet_folder, REFERENCE_FILENAME)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(references, f, indent=2)
+    os.replace(tmp, path)
+
+
+def read_sheet_reference(sheet_folder):
+    path = os.path.join(sheet_folder, REFERENCE_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=32)
+def _read_excel_csv(path, mtime):
+    import pandas as pd
+
+    df = pd.read_excel(path, dtype=str, header=None).fillna("")
+    return df.to_csv(index=False, header=False) if not df.empty else ""
+
+
+def read_context_csv(path):
+    """A context workbook as CSV; artifacts are content-addressed, so repeated reads hit the cache"""
+    return _read_excel_csv(os.path.abspath(path), os.path.getmtime(path))
+
+
+def load_sheet_context(sheet_folder, local_file, kind="context"):
+    """CSV of a sheet's own context followed by the shared `kind` block it references"""
+    parts = [read_context_csv(local_file)] if local_file else []
+    relative = read_sheet_reference(sheet_folder).get(kind)
+    if relative:
+        shared_path = os.path.join(os.path.dirname(os.path.abspath(sheet_folder)), relative)
+        if os.path.exists(shared_path):
+            parts.append(read_context_csv(shared_path))
+        else:
+            print(f"⚠️ Shared {kind} artifact missing: {shared_path}")
+    return "".join(part for part in parts if part)
@@ -0,0 +1,139 @@
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+
+# One Bedrock concurrency budget shared by several workbooks.
+#
+# FairExecutor runs a fixed number of worker threads. Callers submit through a
+# per-tenant view (one tenant per workbook) and idle workers take the next task
+# from the tenants in round-robin order, so a 20k-row tariff cannot starve the
+# small ones queued behind it. An optional RateLimiter spaces out call starts
+# across all tenants.
+
+
+class RateLimiter:
+    """Spaces out acquisitions to at most `rate` per second (0 disables it)"""
+
+    def __init__(self, rate=0.0):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class TenantExecutor:
+    """Executor-like view of a FairExecutor for one tenant.
+
+    Usable wherever extraction expects `executor.submit(fn, *args)`; leaving
+    the `with` block does not shut the shared pool down.
+    """
+
+    def __init__(self, pool, tenant):
+        self.pool = pool
+        self.tenant = tenant
+
+    def submit(self, fn, *args, **kwargs):
+        return self.pool.submit(self.tenant, fn, *args, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FairExecutor:
+    """Fixed thread pool serving per-tenant queues round-robin"""
+
+    def __init__(self, max_workers, max_rate=0.0, name="shared-pool"):
+        self.max_workers = max_workers
+        self.limiter = RateLimiter(max_rate)
+        self._queues = {}
+        self._ring = deque()  # tenants with queued tasks, in serving order
+        self._cond = threading.Condition()
+        self._shutdown = False
+        self.submitted = Counter()
+        self.completed = Counter()
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"{name}-{i}", daemon=True)
+            for i in range(max_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def for_tenant(self, tenant):
+        return TenantExecutor(self, tenant)
+
+    def submit(self, tenant, fn, *args, **kwargs):
+        future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError("cannot submit after shutdown")
+            queue = self._queues.setdefault(tenant, deque())
+            if not queue:
+                self._ring.append(tenant)
+            queue.append((future, fn, args, kwargs))
+            self.submitted[tenant] += 1
+            self._cond.notify()
+        return future
+
+    def _next_task(self):
+        with self._cond:
+            while not self._ring and not self._shutdown:
+                self._cond.wait()
+            if not self._ring:
+                return None, None
+            tenant = self._ring.popleft()
+            queue = self._queues[tenant]
+            task = queue.popleft()
+            if queue:
+                self._ring.append(tenant)
+            return tenant, task
+
+    def _worker(self):
+        while True:
+            tenant, task = self._next_task()
+            if task is None:
+                return
+            future, fn, args, kwargs = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            self.limiter.acquire()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            with self._cond:
+                self.completed[tenant] += 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                tenant: {
+                    "submitted": self.submitted[tenant],
+                    "completed": self.completed[tenant],
+                    "queued": len(self._queues.get(tenant, ())),
+                }
+                for tenant in self.submitted
+            }
+
+    def shutdown(self, wait=True):
+        """Stop the workers once every queued task has run"""
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
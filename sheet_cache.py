@@ -0,0 +1,74 @@
+import hashlib
+import os
+import pickle
+import time
+
+# Per-sheet cache of parsed, unmerged worksheets, keyed by workbook hash.
+#
+# Loading a workbook with openpyxl and filling in its merged ranges is the
+# bulk of preprocessing, and none of it depends on the ignored sheets or the
+# custom header terms the user picks afterwards. As soon as a file is
+# uploaded, the frontend enqueues a low-priority `warm` job that parses the
+# workbook once and stores every sheet's unmerged DataFrame here:
+#
+#   {SHEET_CACHE_DIR}/{workbook sha256}/{sheet digest}.pkl
+#
+# FreightTableExtractor.load_and_unmerge then takes sheets from the cache and
+# only parses the ones that are missing (e.g. while the warm job is still
+# running). Header detection, table splitting and the context files are
+# always recomputed, since they depend on the user's choices.
+#
+# Workbooks big enough for streaming mode are not cached; their frames would
+# not fit in memory anyway.
+
+SHEET_CACHE_DIR = os.getenv("SHEET_CACHE_DIR", "sheet_cache")
+
+
+def _sheet_path(sha256, sheet, cache_dir=SHEET_CACHE_DIR):
+    digest = hashlib.sha256(sheet.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(cache_dir, sha256, f"{digest}.pkl")
+
+
+def load_cached_sheet(sha256, sheet, cache_dir=SHEET_CACHE_DIR):
+    """The cached unmerged frame of a sheet, or None"""
+    path = _sheet_path(sha256, sheet, cache_dir)
+    try:
+        with open(path, "rb") as f:
+            df = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    # The workbook folder's mtime is its last use (see `preprocess_cache.py evict --sheet-cache`)
+    os.utime(os.path.dirname(path))
+    return df
+
+
+def store_sheet(sha256, sheet, df, cache_dir=SHEET_CACHE_DIR):
+    path = _sheet_path(sha256, sheet, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump(df, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def warm_workbook(file_path, cache_dir=SHEET_CACHE_DIR):
+    """Parse and cache every sheet of a workbook ahead of preprocessing; returns the number of sheets cached"""
+    import openpyxl
+    from preprocessing_freightrates import STREAMING_MIN_CELLS, unmerged_frame
+    from sheet_classifier import classify_workbook
+    from workbook_inspector import file_sha256
+
+    t0 = time.perf_counter()
+    sha256 = file_sha256(file_path)
+    plan = classify_workbook(file_path, sha256=sha256)
+    if sum((s["max_row"] or 0) * (s["max_column"] or 0) for s in plan["sheets"]) >= STREAMING_MIN_CELLS:
+        print(f"ℹ️ {file_path} is processed in streaming mode, not warming the sheet cache")
+        return 0
+    missing = [s["name"] for s in plan["sheets"]
+               if not os.path.exists(_sheet_path(sha256, s["name"], cache_dir))]
+    if missing:
+        wb = openpyxl.load_workbook(file_path, data_only=True)
+        for sheet in missing:
+            store_sheet(sha256, sheet, unmerged_frame(wb[sheet])[0], cache_dir)
+    print(f"🔥 Cached {len(missing)} sheet(s) of {file_path} in {time.perf_counter() - t0:.1f}s")
+    return len(missing)
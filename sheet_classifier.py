@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+from workbook_inspector import file_sha256, inspect_workbook
+
+# One-pass sheet classification.
+#
+# Every sheet name of a workbook is scored against every category keyword in
+# a single rapidfuzz cdist call (same partial_ratio as thefuzz, rounded the
+# same way), and the result is kept as a plan:
+#
+#   {"workbook_sha256", "keywords", "threshold", "sheets": [
+#       {name, index, state, max_row, max_column, ..., scores, freetime, rules,
+#        surcharges, ignored, label}, ...]}
+#
+# Scores are cached per (workbook hash, keywords); the ignored sheets are
+# applied on top, so toggling them in the UI never rescores. The frontend shows
+# the plan before processing and passes it to the job, which reuses it as long
+# as the workbook hash still matches.
+
+DEFAULT_SHEET_KEYWORDS = {
+    "freetime": ["free time", "freetime", "demurrage", "detention", "storage"],
+    "rules": ["rule", "policy", "term", "condition", "regulation", "note", "remark"],
+    "surcharges": ["surcharge", "tariff", "charge"],
+}
+DEFAULT_THRESHOLD = 70
+PLAN_CACHE_SIZE = 32
+
+# Display label, in order of precedence
+LABELS = ("ignored", "freetime", "rules", "surcharges", "empty", "freight")
+
+_plan_cache = OrderedDict()
+_plan_cache_lock = threading.Lock()
+
+
+def score_sheet_names(names: List[str], keywords_by_category: Dict[str, List[str]]) -> Dict[str, List[int]]:
+    """Best fuzzy score of each name per category, from one batched name × keyword matrix"""
+    import numpy as np
+    from rapidfuzz import fuzz, process
+
+    all_keywords = [kw for keywords in keywords_by_category.values() for kw in keywords]
+    if not names or not all_keywords:
+        return {category: [0] * len(names) for category in keywords_by_category}
+    matrix = process.cdist([name.lower() for name in names], all_keywords,
+                           scorer=fuzz.partial_ratio, dtype=np.float64)
+    scores, column = {}, 0
+    for category, keywords in keywords_by_category.items():
+        block = matrix[:, column:column + len(keywords)]
+        column += len(keywords)
+        # thefuzz reports round(partial_ratio); keep the same thresholds
+        scores[category] = block.max(axis=1).round().astype(int).tolist() if keywords else [0] * len(names)
+    return scores
+
+
+def _keywords_signature(keywords_by_category):
+    return tuple((category, tuple(keywords)) for category, keywords in sorted(keywords_by_category.items()))
+
+
+def _score_workbook(file_path, sha256, keywords_by_category, threshold):
+    key = (sha256, _keywords_signature(keywords_by_category), threshold)
+    with _plan_cache_lock:
+        if key in _plan_cache:
+            _plan_cache.move_to_end(key)
+            return _plan_cache[key]
+
+    sheets = inspect_workbook(file_path)
+    scores = score_sheet_names([sheet["name"] for sheet in sheets], keywords_by_category)
+    for i, sheet in enumerate(sheets):
+        sheet["scores"] = {category: scores[category][i] for category in keywords_by_category}
+    scored = {
+        "workbook_sha256": sha256,
+        "keywords": {category: list(keywords) for category, keywords in keywords_by_category.items()},
+        "threshold": threshold,
+        "sheets": sheets,
+    }
+    with _plan_cache_lock:
+        _plan_cache[key] = scored
+        while len(_plan_cache) > PLAN_CACHE_SIZE:
+            _plan_cache.popitem(last=False)
+    return scored
+
+
+def apply_ignored(plan: Dict, ignored_sheets: Iterable[str] = ()) -> Dict:
+    """Label every sheet of a scored plan, treating `ignored_sheets` as ignored"""
+    ignored_sheets = set(ignored_sheets or ())
+    sheets = []
+    for sheet in plan["sheets"]:
+        sheet = dict(sheet)
+        for category in plan["keywords"]:
+            sheet[category] = sheet["scores"].get(category, 0) >= plan["threshold"]
+        sheet["ignored"] = sheet["name"] in ignored_sheets
+        if sheet["ignored"]:
+            sheet["label"] = "ignored"
+        elif sheet.get("freetime"):
+            sheet["label"] = "freetime"
+        elif sheet.get("rules"):
+            sheet["label"] = "rules"
+        elif sheet.get("surcharges"):
+            sheet["label"] = "surcharges"
+        elif sheet.get("max_row") is not None and sheet["max_row"] < 2:
+            # A freight table needs at least a header row and one data row
+            sheet["label"] = "empty"
+        else:
+            sheet["label"] = "freight"
+        sheets.append(sheet)
+    return {**plan, "ignored_sheets": sorted(ignored_sheets), "sheets": sheets}
+
+
+def classify_workbook(file_path: Union[str, Path], keywords_by_category: Optional[Dict[str, List[str]]] = None,
+                      ignored_sheets: Iterable[str] = (), threshold: int = DEFAULT_THRESHOLD,
+                      sha256: Optional[str] = None) -> Dict:
+    """Classification plan for every sheet of a workbook (see module comment)"""
+    keywords_by_category = keywords_by_category or DEFAULT_SHEET_KEYWORDS
+    sha256 = sha256 or file_sha256(file_path)
+    return apply_ignored(_score_workbook(file_path, sha256, keywords_by_category, threshold), ignored_sheets)
+
+
+def plan_matches(plan: Optional[Dict], file_path: Union[str, Path],
+                 keywords_by_category: Optional[Dict[str, List[str]]] = None,
+                 threshold: int = DEFAULT_THRESHOLD) -> bool:
+    """True when `plan` was computed for this exact workbook content and keyword set"""
+    if not plan or "sheets" not in plan:
+        return False
+    keywords_by_category = keywords_by_category or DEFAULT_SHEET_KEYWORDS
+    return (plan.get("threshold") == threshold
+            and _keywords_signature(plan.get("keywords", {})) == _keywords_signature(keywords_by_category)
+            and plan.get("workbook_sha256") == file_sha256(file_path))
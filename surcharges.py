@@ -0,0 +1,178 @@
+import csv
+import io
+import os
+import threading
+import time
+
+from extraction import (EXTRACTION_MAX_WORKERS, call_nova_pro_converse_cached, find_freight_and_context_files,
+                        iter_bounded_completions, parse_extraction_result, write_json_record_to_file)
+from shared_context import SHARED_DIRNAME, is_shared_folder, read_context_csv, read_sheet_reference
+
+# Surcharge extraction stage.
+#
+# Preprocessing writes the workbook's surcharge sheets once, as a shared
+# artifact referenced by every freight sheet (see shared_context.py). This
+# stage cuts each distinct artifact into chunks of SURCHARGE_CHUNK_ROWS rows,
+# each prefixed with its section and column header, and sends every chunk
+# with the s9.txt prompt. The prompt carries the freight sheet's own context
+# (validity, carrier, notes), so chunks are sent once per distinct pair of
+# artifact and sheet context; within a pair the prompt is identical and is
+# served from the prompt cache after the first call.
+#
+# The stage runs in a background thread on the job's executor, alongside the
+# freight-rate rows, so both share one concurrency budget. At most
+# SURCHARGE_MAX_PENDING chunks are in flight, which leaves most of the pool to
+# the freight rows. Each chunk's records are streamed into the `surcharges.json`
+# of every sheet of its pair; failed chunks are written as error records with
+# their `chunk_index`. A failure of the stage itself is raised by join().
+#
+# It costs a second pass of model calls, so it is opt-in: the `surcharges`
+# param or EXTRACTION_SURCHARGES=1.
+
+SURCHARGE_PROMPT = "s9.txt"
+SURCHARGES_FILENAME = "surcharges.json"
+SURCHARGE_CHUNK_ROWS = int(os.getenv("SURCHARGE_CHUNK_ROWS", "25"))
+SURCHARGE_MAX_PENDING = int(os.getenv("SURCHARGE_MAX_PENDING", str(max(1, EXTRACTION_MAX_WORKERS // 2))))
+SECTION_PREFIX = "=== surcharge:"
+
+
+def surcharges_enabled(requested=None):
+    """Job param wins; otherwise EXTRACTION_SURCHARGES=1 turns surcharge extraction on"""
+    if requested is not None:
+        return bool(requested)
+    return os.getenv("EXTRACTION_SURCHARGES", "").lower() in ("1", "true", "yes")
+
+
+def _csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerow(values)
+    return buffer.getvalue()
+
+
+def iter_surcharge_chunks(artifact_path, rows_per_chunk=SURCHARGE_CHUNK_ROWS):
+    """CSV chunks of a surcharge artifact, each starting with its section and column header"""
+    import pandas as pd
+
+    df = pd.read_excel(artifact_path, dtype=str, header=None).fillna("")
+    header, lines = [], []
+    for values in df.itertuples(index=False):
+        values = [v.strip() for v in values]
+        while values and not values[-1]:
+            values.pop()
+        if not values:
+            continue
+        if values[0].startswith(SECTION_PREFIX):
+            if lines:
+                yield "".join(header + lines)
+            header, lines = [_csv_line(values)], []
+        elif len(header) == 1:
+            # First row of a section is its column header
+            header.append(_csv_line(values))
+        else:
+            lines.append(_csv_line(values))
+            if len(lines) >= rows_per_chunk:
+                yield "".join(header + lines)
+                lines = []
+    if lines:
+        yield "".join(header + lines)
+
+
+class SurchargeStage:
+    """Extracts the surcharge artifacts of a preprocessed workbook on a shared executor"""
+
+    def __init__(self, main_folder_path, output_main_folder, executor, prompt_path=SURCHARGE_PROMPT,
+                 max_pending=SURCHARGE_MAX_PENDING):
+        self.main_folder_path = main_folder_path
+        self.output_main_folder = output_main_folder
+        self.executor = executor
+        self.prompt_path = prompt_path
+        self.max_pending = max_pending
+        self._thread = None
+        self.error = None
+        self.chunks = 0
+        self.failed_chunks = 0
+        self.records = 0
+
+    def sheets_by_group(self):
+        """{(artifact relative path, sheet context CSV): [subfolder name, ...]}"""
+        sheets = {}
+        for name in sorted(os.listdir(self.main_folder_path)):
+            subfolder_path = os.path.join(self.main_folder_path, name)
+            if not os.path.isdir(subfolder_path) or is_shared_folder(name):
+                continue
+            artifact = read_sheet_reference(subfolder_path).get("surcharges")
+            if artifact:
+                _, context_file = find_freight_and_context_files(subfolder_path)
+                context_csv = read_context_csv(context_file) if context_file else ""
+                sheets.setdefault((artifact, context_csv), []).append(name)
+        return sheets
+
+    def run(self):
+        sheets = self.sheets_by_group()
+        if not sheets:
+            print("ℹ️ No surcharge sheets to extract")
+            return
+        with open(self.prompt_path, "r", encoding="utf-8") as f:
+            prompt_template = f.read().strip()
+
+        outputs = {}
+        for names in sheets.values():
+            for name in names:
+                output_subfolder = os.path.join(self.output_main_folder, name)
+                os.makedirs(output_subfolder, exist_ok=True)
+                json_file = open(os.path.join(output_subfolder, SURCHARGES_FILENAME), "w", encoding="utf-8")
+                json_file.write("[\n")
+                outputs[name] = (json_file, [True], threading.Lock())
+
+        def tasks():
+            for group in sheets:
+                artifact, context_csv = group
+                prompt = prompt_template.replace("{{METADATA_CONTEXT_HERE}}", context_csv)
+                for chunk_index, chunk_csv in enumerate(iter_surcharge_chunks(os.path.join(self.main_folder_path, artifact))):
+                    yield (group, chunk_index), call_nova_pro_converse_cached, prompt, chunk_csv
+
+        t0 = time.perf_counter()
+        print(f"💲 Extracting surcharges from {len({artifact for artifact, _ in sheets})} shared artifact(s) "
+              f"for {len(outputs)} sheet(s)")
+        try:
+            for (group, chunk_index), future in iter_bounded_completions(self.executor, tasks(), self.max_pending):
+                artifact = group[0]
+                self.chunks += 1
+                try:
+                    result, _ = future.result()
+                    records = parse_extraction_result(result, chunk_index, index_key="chunk_index")
+                except Exception as e:
+                    print(f"❌ Surcharge chunk {chunk_index} of {artifact}: {e}")
+                    records = [{"error": str(e), "chunk_index": chunk_index,
+                                "artifact": artifact.removeprefix(f"{SHARED_DIRNAME}/")}]
+                    self.failed_chunks += 1
+                self.records += len(records)
+                for name in sheets[group]:
+                    json_file, is_first, lock = outputs[name]
+                    for record in records:
+                        write_json_record_to_file(json_file, record, is_first, lock)
+        finally:
+            for json_file, _, _ in outputs.values():
+                json_file.write("\n]")
+                json_file.close()
+        print(f"💲 Surcharges: {self.records} record(s) from {self.chunks} chunk(s), "
+              f"{self.failed_chunks} failed, in {time.perf_counter() - t0:.1f}s")
+
+    def _run_logged(self):
+        try:
+            self.run()
+        except Exception as e:
+            print(f"❌ Surcharge extraction failed: {e}")
+            self.error = e
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run_logged, name="surcharge-stage", daemon=True)
+        self._thread.start()
+        return self
+
+    def join(self):
+        """Wait for the stage; re-raises the exception that stopped it, if any"""
+        if self._thread is not None:
+            self._thread.join()
+        if self.error is not None:
+            raise RuntimeError(f"Surcharge extraction failed: {self.error}") from self.error
@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import threading
+import time
+
+# Per-row lifecycle tracing for the extraction engine.
+#
+# Every freight row gets one span with timestamps (µs since the epoch) for
+#   enqueue   submitted to the executor
+#   dispatch  picked up by a worker thread
+#   admitted  first model call let through by the rate limiter (quota_wait_ms)
+#   response  model call returned (Converse is not streamed, so this is also the first byte)
+#   collected picked up by the writer loop from as_completed
+#   parsed    model output parsed into records
+#   written   all records written, after waiting on the output file lock
+# plus attributes such as subfolder, row_index, tokens, cache hit and lock wait.
+#
+# Spans are written to a JSONL file per job; `python tracing.py trace.jsonl` prints
+# per-phase percentiles and `--chrome out.json` converts it for chrome://tracing
+# or Perfetto. Enabled per job with the `trace` param or EXTRACTION_TRACE=1.
+
+TRACE_FOLDER_NAME = "_trace"
+TRACE_FILENAME = "extraction_trace.jsonl"
+PHASES = [
+    ("queue_wait", "enqueue", "dispatch"),
+    ("quota_wait", "dispatch", "admitted"),
+    ("model_call", "admitted", "response"),
+    ("collect_wait", "response", "collected"),
+    ("parse", "collected", "parsed"),
+    ("write", "parsed", "written"),
+]
+
+
+def now_us():
+    return time.time_ns() // 1000
+
+
+def tracing_enabled(requested=None):
+    """Job param wins; otherwise EXTRACTION_TRACE=1 turns tracing on"""
+    if requested is not None:
+        return bool(requested)
+    return os.getenv("EXTRACTION_TRACE", "").lower() in ("1", "true", "yes")
+
+
+class RowSpan:
+    """Lifecycle of one freight row; finished spans are handed to the tracer"""
+
+    def __init__(self, tracer, subfolder, row_index):
+        self.tracer = tracer
+        self.events = {"enqueue": now_us()}
+        self.attrs = {"subfolder": subfolder, "row_index": int(row_index), "lock_wait_us": 0}
+        self.threads = {}
+
+    def mark(self, event):
+        self.events[event] = now_us()
+        self.threads[event] = threading.current_thread().name
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add_lock_wait(self, waited_us):
+        self.attrs["lock_wait_us"] += waited_us
+
+    def record_usage(self, usage):
+        if usage:
+            self.set(
+                input_tokens=usage.get("inputTokens"),
+                output_tokens=usage.get("outputTokens"),
+                cache_read_tokens=usage.get("cacheReadInputTokens"),
+                cache_hit=bool(usage.get("cacheReadInputTokens")),
+            )
+
+    def end(self, failed=False):
+        self.mark("written")
+        self.attrs["failed"] = failed
+        self.tracer.emit({"events": self.events, "threads": self.threads, **self.attrs})
+
+
+class Tracer:
+    """Thread-safe JSONL span sink"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._file = open(path, "w", encoding="utf-8")
+
+    @classmethod
+    def for_output_folder(cls, output_main_folder):
+        return cls(os.path.join(output_main_folder, TRACE_FOLDER_NAME, TRACE_FILENAME))
+
+    def row(self, subfolder, row_index):
+        return RowSpan(self, subfolder, row_index)
+
+    def emit(self, span):
+        line = json.dumps(span, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def read_spans(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def phase_durations(span):
+    """{phase: µs} for every phase whose start and end were recorded"""
+    events = span["events"]
+    durations = {
+        phase: events[end] - events[start]
+        for phase, start, end in PHASES
+        if start in events and end in events
+    }
+    durations["lock_wait"] = span.get("lock_wait_us", 0)
+    if "enqueue" in events and "written" in events:
+        durations["total"] = events["written"] - events["enqueue"]
+    return durations
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def summarize_trace(path):
+    """Per-phase p50/p95/p99/max in milliseconds, plus row and failure counts"""
+    spans = read_spans(path)
+    by_phase = {}
+    for span in spans:
+        for phase, us in phase_durations(span).items():
+            by_phase.setdefault(phase, []).append(us / 1000)
+    return {
+        "rows": len(spans),
+        "failed": sum(1 for s in spans if s.get("failed")),
+        "cache_hits": sum(1 for s in spans if s.get("cache_hit")),
+        "phases_ms": {
+            phase: {q: round(percentile(values, p), 2) for q, p in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))}
+            | {"max": round(max(values), 2)}
+            for phase, values in by_phase.items()
+        },
+    }
+
+
+def to_chrome_trace(spans):
+    """Chrome trace events: one process per subfolder, one lane per thread"""
+    pids, tids = {}, {}
+    events = []
+    for span in spans:
+        pid = pids.setdefault(span["subfolder"], len(pids) + 1)
+        args = {k: v for k, v in span.items() if k not in ("events", "threads")}
+        for phase, start, end in PHASES:
+            if start not in span["events"] or end not in span["events"]:
+                continue
+            # Queue time belongs to no thread; give it its own lane
+            thread = "queue" if phase == "queue_wait" else span["threads"].get(end, "main")
+            tid = tids.setdefault(thread, len(tids) + 1)
+            events.append({
+                "name": phase, "cat": "row", "ph": "X", "pid": pid, "tid": tid,
+                "ts": span["events"][start], "dur": span["events"][end] - span["events"][start],
+                "args": args,
+            })
+    for name, pid in pids.items():
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "args": {"name": name}})
+        for thread, tid in tids.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize or convert an extraction trace")
+    parser.add_argument("trace", help="JSONL trace written by the extraction engine")
+    parser.add_argument("--chrome", metavar="OUT", help="write a Chrome trace (chrome://tracing, Perfetto)")
+    args = parser.parse_args()
+
+    print(json.dumps(summarize_trace(args.trace), indent=2))
+    if args.chrome:
+        with open(args.chrome, "w", encoding="utf-8") as f:
+            json.dump(to_chrome_trace(read_spans(args.trace)), f)
+        print(f"🧭 Chrome trace written to {args.chrome}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,437 @@
+import argparse
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import nullcontext
+from dataclasses import dataclass
+
+from extraction import (EXTRACTION_MAX_WORKERS, call_with_progress, finish_row_manifest, is_failed_record,
+                        iter_freight_rows, match_previous_version, parse_extraction_result,
+                        prepare_subfolder_extraction, write_carried_rows, write_json_record_to_file)
+from incremental import RESULTS_FILENAME, row_key, text_hash, write_job_diff_summary
+from shared_context import is_shared_folder
+
+# Distributed row extraction over a shared work queue.
+#
+# The job that owns a workbook publishes every freight row (plus each
+# subfolder's extraction prompt, stored once) to the queue. Workers on any
+# node claim rows under a lease, call the model and write the result back.
+#
+#   - A lease expires after the visibility timeout; the row is then claimable
+#     again, and a worker renews the leases of calls still in flight.
+#   - Results are written with the lease token, so a worker whose lease was
+#     taken over cannot overwrite the new owner's result. Completing a row
+#     twice is a no-op.
+#   - After WORK_QUEUE_MAX_ATTEMPTS failures or expired leases a row is failed
+#     and assembled as an error record, ready for the retry-failures job.
+#
+# Enabled per job with the `distributed` param or EXTRACTION_DISTRIBUTED=1.
+# Rows unchanged since a previous version of the sheet are carried over and
+# never queued (see incremental.py). The owning job works its own rows with
+# its tracer, router and hedger. Carried rows go to freight_rates.json.partial
+# when the rows are published; once nothing is queued or leased the queued
+# results are appended in row order and the file replaces freight_rates.json,
+# so a job that dies in between never leaves a truncated array behind. The
+# row manifest and diff summary are written as a local run would. Other workers call
+# the model directly, or through tiers / hedging with --routing / --hedge.
+#
+# This SQLite backend shares state between processes on one machine (tests,
+# single-host replicas). A multi-node backend needs the same methods on a
+# networked store: publish, claim, renew, complete, fail, counts, results, purge.
+#
+#   python work_queue.py worker --concurrency 10 [--routing] [--hedge]
+#   python work_queue.py status [--job JOB]
+
+WORK_QUEUE_DB = os.getenv("WORK_QUEUE_DB", "work_queue.db")
+WORK_QUEUE_VISIBILITY_TIMEOUT = float(os.getenv("WORK_QUEUE_VISIBILITY_TIMEOUT", "120"))
+WORK_QUEUE_MAX_ATTEMPTS = int(os.getenv("WORK_QUEUE_MAX_ATTEMPTS", "3"))
+POLL_INTERVAL = 0.5
+# freight_rates.json of a published subfolder until it is assembled; never a valid JSON array
+PARTIAL_RESULTS_FILENAME = f"{RESULTS_FILENAME}.partial"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prompts (
+    prompt_key TEXT PRIMARY KEY,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rows (
+    job TEXT NOT NULL,
+    subfolder TEXT NOT NULL,
+    row_index INTEGER NOT NULL,
+    prompt_key TEXT NOT NULL,
+    row_csv TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_token TEXT,
+    lease_owner TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (job, subfolder, row_index)
+);
+CREATE INDEX IF NOT EXISTS rows_claim_idx ON rows(status, lease_expires);
+"""
+
+
+def distributed_enabled(requested=None):
+    """Job param wins; otherwise EXTRACTION_DISTRIBUTED=1 sends rows through the shared queue"""
+    if requested is not None:
+        return bool(requested)
+    return os.getenv("EXTRACTION_DISTRIBUTED", "").lower() in ("1", "true", "yes")
+
+
+@dataclass
+class RowTask:
+    job: str
+    subfolder: str
+    row_index: int
+    prompt: str
+    row_csv: str
+    lease_token: str
+
+
+@dataclass
+class PublishedSheet:
+    """What the owning job keeps of a subfolder between publishing and assembling it"""
+    output_subfolder: str
+    manifest: object
+    diff: object
+    written: int
+    queued: int
+
+    @property
+    def partial_path(self):
+        return os.path.join(self.output_subfolder, PARTIAL_RESULTS_FILENAME)
+
+
+class SQLiteWorkQueue:
+    """Row queue with leases in a local SQLite file; safe across threads and processes"""
+
+    def __init__(self, db_path=WORK_QUEUE_DB, visibility_timeout=WORK_QUEUE_VISIBILITY_TIMEOUT,
+                 max_attempts=WORK_QUEUE_MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self, fn):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return result
+
+    def publish(self, job, subfolder, prompt, rows):
+        """Queue `(row_index, row_csv)` rows; rows already in the queue are left alone"""
+        prompt_key = text_hash(prompt)
+        now = time.time()
+
+        def insert(conn):
+            conn.execute("INSERT OR IGNORE INTO prompts (prompt_key, text) VALUES (?, ?)", (prompt_key, prompt))
+            cursor = conn.executemany(
+                "INSERT OR IGNORE INTO rows (job, subfolder, row_index, prompt_key, row_csv, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                ((job, subfolder, int(idx), prompt_key, row_csv, now) for idx, row_csv in rows))
+            return cursor.rowcount
+        return self._transaction(insert)
+
+    def claim(self, worker_id, limit, job=None):
+        """Lease up to `limit` queued (or expired) rows"""
+        def take(conn):
+            now = time.time()
+            # Leases that expired too often fail for good instead of looping forever
+            conn.execute(
+                "UPDATE rows SET status = 'failed', error = 'lease expired', lease_token = NULL, updated_at = ? "
+                "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts))
+            query = ("SELECT r.job, r.subfolder, r.row_index, p.text, r.row_csv FROM rows r "
+                     "JOIN prompts p ON p.prompt_key = r.prompt_key "
+                     "WHERE (r.status = 'queued' OR (r.status = 'leased' AND r.lease_expires < ?))")
+            args = [now]
+            if job is not None:
+                query += " AND r.job = ?"
+                args.append(job)
+            rows = conn.execute(query + " ORDER BY r.attempts, r.rowid LIMIT ?", (*args, limit)).fetchall()
+            tasks = []
+            for row_job, subfolder, row_index, prompt, row_csv in rows:
+                token = uuid.uuid4().hex
+                conn.execute(
+                    "UPDATE rows SET status = 'leased', lease_token = ?, lease_owner = ?, lease_expires = ?, "
+                    "attempts = attempts + 1, updated_at = ? WHERE job = ? AND subfolder = ? AND row_index = ?",
+                    (token, worker_id, now + self.visibility_timeout, now, row_job, subfolder, row_index))
+                tasks.append(RowTask(row_job, subfolder, row_index, prompt, row_csv, token))
+            return tasks
+        return self._transaction(take)
+
+    def _update_leased(self, task, assignments, args):
+        cursor = self._conn().execute(
+            f"UPDATE rows SET {assignments}, updated_at = ? "
+            "WHERE job = ? AND subfolder = ? AND row_index = ? AND lease_token = ? AND status = 'leased'",
+            (*args, time.time(), task.job, task.subfolder, task.row_index, task.lease_token))
+        return cursor.rowcount == 1
+
+    def renew(self, task):
+        """Extend a lease; False if it was lost to another worker"""
+        return self._update_leased(task, "lease_expires = ?", (time.time() + self.visibility_timeout,))
+
+    def complete(self, task, result):
+        """Store a row's result; False (and nothing written) if the lease is no longer ours"""
+        return self._update_leased(task, "status = 'done', result = ?, error = NULL, lease_token = NULL", (result,))
+
+    def fail(self, task, error):
+        """Give a failed row back to the queue, or fail it for good after max_attempts"""
+        return self._update_leased(
+            task, "status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END, error = ?, lease_token = NULL",
+            (self.max_attempts, error))
+
+    def counts(self, job=None):
+        """{job: {subfolder: {status: rows}}}"""
+        query = "SELECT job, subfolder, status, COUNT(*) FROM rows"
+        args = ()
+        if job is not None:
+            query += " WHERE job = ?"
+            args = (job,)
+        counts = {}
+        for row_job, subfolder, status, n in self._conn().execute(query + " GROUP BY job, subfolder, status", args):
+            counts.setdefault(row_job, {}).setdefault(subfolder, {})[status] = n
+        return counts
+
+    def pending(self, job):
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM rows WHERE job = ? AND status IN ('queued', 'leased')", (job,)).fetchone()[0]
+
+    def results(self, job, subfolder):
+        """(row_index, row_csv, status, result, error) in row order"""
+        return self._conn().execute(
+            "SELECT row_index, row_csv, status, result, error FROM rows WHERE job = ? AND subfolder = ? "
+            "ORDER BY row_index",
+            (job, subfolder))
+
+    def purge(self, job):
+        def delete(conn):
+            conn.execute("DELETE FROM rows WHERE job = ?", (job,))
+            conn.execute("DELETE FROM prompts WHERE prompt_key NOT IN (SELECT DISTINCT prompt_key FROM rows)")
+        self._transaction(delete)
+
+
+def process_task(queue, task, tracer=None, router=None, hedger=None):
+    span = tracer.row(task.subfolder, task.row_index) if tracer is not None else None
+    try:
+        result, _ = call_with_progress(None, task.subfolder, task.prompt, task.row_csv, span, router, hedger)
+    except Exception as e:
+        print(f"❌ {task.job}/{task.subfolder} row {task.row_index}: {e}")
+        queue.fail(task, str(e))
+        if span is not None:
+            span.set(error=type(e).__name__)
+            span.end(failed=True)
+        return False
+    if not queue.complete(task, result):
+        print(f"⚠️ Lease on {task.job}/{task.subfolder} row {task.row_index} was lost, result discarded")
+    if span is not None:
+        span.end()
+    return True
+
+
+def run_worker(queue, concurrency=EXTRACTION_MAX_WORKERS, job=None, until=None, idle_exit=None,
+               on_progress=None, executor=None, tracer=None, router=None, hedger=None):
+    """Claim and extract rows until `until()` is true or the queue stays empty for `idle_exit` seconds.
+
+    Model calls run on `executor` if given, else on a private pool of
+    `concurrency` threads, through `router` and `hedger` if given. Returns the
+    number of rows this worker processed.
+    """
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    in_flight = {}
+    processed = 0
+    idle_since = time.time()
+    last_renewal = time.time()
+    pool = nullcontext(executor) if executor is not None else \
+        ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="queue-worker")
+    with pool as pool_executor:
+        while True:
+            if len(in_flight) < concurrency:
+                for task in queue.claim(worker_id, concurrency - len(in_flight), job=job):
+                    in_flight[pool_executor.submit(process_task, queue, task, tracer, router, hedger)] = task
+            if in_flight:
+                idle_since = time.time()
+                done, _ = wait(in_flight, timeout=POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                for future in done:
+                    in_flight.pop(future)
+                    processed += 1
+                # Keep long calls leased
+                if time.time() - last_renewal > queue.visibility_timeout / 3:
+                    for task in in_flight.values():
+                        queue.renew(task)
+                    last_renewal = time.time()
+            else:
+                if until is not None and until():
+                    return processed
+                if idle_exit is not None and time.time() - idle_since > idle_exit:
+                    return processed
+                time.sleep(POLL_INTERVAL)
+            if on_progress is not None:
+                on_progress()
+
+
+def publish_main_folder(queue, job, main_folder_path, extraction_prompt_path, output_main_folder,
+                        context_filter_prompt_path=None, incremental=None):
+    """Prepare every subfolder (context filtering happens here, once) and queue its rows.
+
+    Rows unchanged since a previous version are written to the subfolder's
+    partial results right away instead of queued; freight_rates.json itself
+    only appears once assemble_main_folder has completed it. Returns
+    {subfolder: PublishedSheet}.
+    """
+    queue.purge(job)
+    published = {}
+    for subfolder_name in sorted(os.listdir(main_folder_path)):
+        subfolder_path = os.path.join(main_folder_path, subfolder_name)
+        if not os.path.isdir(subfolder_path) or is_shared_folder(subfolder_name):
+            continue
+        output_subfolder = os.path.join(output_main_folder, subfolder_name)
+        os.makedirs(output_subfolder, exist_ok=True)
+        prepared = prepare_subfolder_extraction(subfolder_path, subfolder_name, extraction_prompt_path,
+                                                output_subfolder, context_filter_prompt_path=context_filter_prompt_path)
+        if prepared is None:
+            continue
+        freight_file, extraction_prompt = prepared
+        manifest, previous, diff = match_previous_version(
+            subfolder_path, output_subfolder, extraction_prompt_path, freight_file, incremental)
+
+        # Carried rows open the output; assemble_main_folder appends the queued ones
+        with open(os.path.join(output_subfolder, PARTIAL_RESULTS_FILENAME), "w", encoding="utf-8") as json_file:
+            json_file.write("[\n")
+            written = write_carried_rows(json_file, [True], threading.Lock(), previous, diff, manifest)
+        queued = queue.publish(job, subfolder_name, extraction_prompt,
+                               ((idx, row_csv) for idx, row_csv in iter_freight_rows(freight_file)
+                                if idx not in diff.carried))
+        published[subfolder_name] = PublishedSheet(output_subfolder, manifest, diff, written, queued)
+        print(f"📤 Queued {queued} rows of {subfolder_name}")
+    return published
+
+
+def assemble_main_folder(queue, job, published):
+    """Append each subfolder's queued results to its partial results, in row order, and move them into
+    place as freight_rates.json together with the subfolder's manifest"""
+    for subfolder_name, sheet in published.items():
+        output_path = os.path.join(sheet.output_subfolder, RESULTS_FILENAME)
+        lock = threading.Lock()
+        is_first = [sheet.written == 0]
+        written = sheet.written
+        failed = 0
+        with open(sheet.partial_path, "a", encoding="utf-8") as json_file:
+            for row_index, row_csv, status, result, error in queue.results(job, subfolder_name):
+                if status == "done":
+                    records = parse_extraction_result(result, row_index)
+                else:
+                    records = [{"error": error or f"row {status}", "row_index": row_index, "subfolder": subfolder_name}]
+                row_failed = any(is_failed_record(record) for record in records)
+                failed += row_failed
+                for record in records:
+                    write_json_record_to_file(json_file, record, is_first, lock)
+                key = row_key(row_csv)
+                sheet.diff.add_extracted(key)
+                sheet.manifest.add(row_index, text_hash(row_csv), key, written, len(records), row_failed)
+                written += len(records)
+            json_file.write("\n]")
+        os.replace(sheet.partial_path, output_path)
+        finish_row_manifest(sheet.output_subfolder, sheet.manifest, sheet.diff)
+        print(f"💾 Assembled {output_path} ({failed} failed row(s))")
+
+
+def process_main_folder_distributed(main_folder_path, extraction_prompt_path, context_filter_prompt_path=None,
+                                    progress=None, queue=None, job=None, tracer=None, incremental=None,
+                                    executor=None, router=None, hedger=None):
+    """Extract a preprocessed folder through the shared queue, working on it alongside any other workers.
+
+    `tracer`, `incremental`, `executor`, `router` and `hedger` mean the same as
+    for process_main_folder_structure_incremental; the last four apply to the
+    rows this job extracts itself.
+    """
+    queue = queue or SQLiteWorkQueue()
+    main_folder_name = os.path.basename(main_folder_path.rstrip('/\\'))
+    output_main_folder = f"{main_folder_name}_output"
+    job = job or output_main_folder
+    os.makedirs(output_main_folder, exist_ok=True)
+
+    published = publish_main_folder(queue, job, main_folder_path, extraction_prompt_path, output_main_folder,
+                                    context_filter_prompt_path, incremental)
+    if progress is not None:
+        for subfolder_name, sheet in published.items():
+            progress.register_sheet(subfolder_name, sheet.queued)
+            progress.start_sheet(subfolder_name, sheet.queued)
+
+    def report():
+        if progress is None:
+            return
+        for subfolder_name, statuses in queue.counts(job).get(job, {}).items():
+            progress.set_sheet_counts(subfolder_name,
+                                      rows_done=statuses.get("done", 0) + statuses.get("failed", 0),
+                                      rows_failed=statuses.get("failed", 0),
+                                      rows_in_flight=statuses.get("leased", 0))
+
+    run_worker(queue, job=job, until=lambda: queue.pending(job) == 0, on_progress=report,
+               executor=executor, tracer=tracer, router=router, hedger=hedger)
+    report()
+    assemble_main_folder(queue, job, published)
+    write_job_diff_summary(output_main_folder)
+    if progress is not None:
+        for subfolder_name in published:
+            progress.finish_sheet(subfolder_name)
+    queue.purge(job)
+    return output_main_folder
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared extraction work queue")
+    parser.add_argument("--db", default=WORK_QUEUE_DB)
+    sub = parser.add_subparsers(dest="command", required=True)
+    worker = sub.add_parser("worker", help="claim and extract rows from any job")
+    worker.add_argument("--concurrency", type=int, default=EXTRACTION_MAX_WORKERS)
+    worker.add_argument("--job", help="only work on this job")
+    worker.add_argument("--idle-exit", type=float, help="exit after this many idle seconds")
+    worker.add_argument("--routing", action="store_true", help="route rows through escalating model tiers")
+    worker.add_argument("--hedge", action="store_true", help="duplicate calls that run past the rolling p95")
+    status = sub.add_parser("status", help="row counts per job, subfolder and status")
+    status.add_argument("--job")
+    args = parser.parse_args()
+
+    queue = SQLiteWorkQueue(args.db)
+    if args.command == "worker":
+        from hedging import HedgedCaller, hedging_enabled
+        from model_router import ModelRouter, routing_enabled
+        router = ModelRouter() if routing_enabled(args.routing or None) else None
+        hedger = HedgedCaller() if hedging_enabled(args.hedge or None) else None
+        print(f"👷 Queue worker on {args.db} ({args.concurrency} concurrent rows)")
+        try:
+            processed = run_worker(queue, args.concurrency, job=args.job, idle_exit=args.idle_exit,
+                                   router=router, hedger=hedger)
+        finally:
+            if hedger is not None:
+                hedger.shutdown()
+        print(f"👷 Worker exiting after {processed} row(s)")
+    else:
+        print(json.dumps(queue.counts(args.job), indent=2))
+
+
+if __name__ == "__main__":
+    main()
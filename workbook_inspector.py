@@ -0,0 +1,177 @@
+import hashlib
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+# Lightweight xlsx inspector.
+#
+# Reads sheet names straight from the package's xl/workbook.xml and the
+# dimension of each sheet from the first bytes of its XML, without parsing any
+# cells. Merged ranges live at the end of the sheet XML, so counting them
+# streams the decompressed sheet once (still far cheaper than openpyxl).
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+CHUNK_SIZE = 1 << 16
+
+_dimension_re = re.compile(rb'<(?:\w+:)?dimension\s+ref="([^"]+)"')
+_sheet_data_re = re.compile(rb'<(?:\w+:)?sheetData[\s>/]')
+_merge_cells_re = re.compile(rb'<(?:\w+:)?mergeCells\s+count="(\d+)"')
+_merge_cell_re = re.compile(rb'<(?:\w+:)?mergeCell\s')
+_merge_ref_re = re.compile(rb'<(?:\w+:)?mergeCell\s+ref="([^"]+)"')
+_cell_re = re.compile(r"([A-Z]+)(\d+)")
+
+
+def file_sha256(file_path: Union[str, Path]) -> str:
+    """Content hash of a workbook, used as a cache key for anything derived from it"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def column_index(letters: str) -> int:
+    """'A' -> 1, 'AA' -> 27"""
+    index = 0
+    for ch in letters:
+        index = index * 26 + ord(ch) - 64
+    return index
+
+
+def parse_range(ref: str):
+    """'B2:D10' -> (min_col, min_row, max_col, max_row), like openpyxl's range bounds"""
+    parts = ref.replace("$", "").split(":")
+    (c1, r1), (c2, r2) = [_cell_re.match(p).groups() for p in (parts[0], parts[-1])]
+    return column_index(c1), int(r1), column_index(c2), int(r2)
+
+
+def _sheet_paths(zf: zipfile.ZipFile) -> List[Dict]:
+    workbook = ET.fromstring(zf.read("xl/workbook.xml"))
+    rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    targets = {}
+    for rel in rels.findall(f"{{{PKG_REL_NS}}}Relationship"):
+        target = rel.get("Target")
+        if target.startswith("/"):
+            target = target.lstrip("/")
+        else:
+            target = posixpath.normpath(posixpath.join("xl", target))
+        targets[rel.get("Id")] = target
+
+    sheets = []
+    for index, sheet in enumerate(workbook.iter(f"{{{MAIN_NS}}}sheet")):
+        sheets.append({
+            "name": sheet.get("name"),
+            "index": index,
+            "state": sheet.get("state", "visible"),
+            "path": targets.get(sheet.get(f"{{{REL_NS}}}id")),
+        })
+    return sheets
+
+
+def _read_dimension(zf: zipfile.ZipFile, path: str) -> Optional[str]:
+    """Scan the sheet XML up to <sheetData> for the <dimension ref=...> element"""
+    head = b""
+    with zf.open(path) as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            head += chunk
+            match = _dimension_re.search(head)
+            if match:
+                return match.group(1).decode()
+            if _sheet_data_re.search(head):
+                return None
+    return None
+
+
+def _scan_merged_ranges(zf: zipfile.ZipFile, path: str, collect_refs: bool = False):
+    """Stream a sheet's XML and return (merged range count, list of refs or None)"""
+    refs = [] if collect_refs else None
+    count = 0
+    tail = b""
+    with zf.open(path) as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            data = tail + chunk
+            # Keep an overlap so elements split across chunks are seen exactly once
+            cut = max(0, len(data) - 256)
+            lt = data.rfind(b"<", cut)
+            cut = lt if lt != -1 else len(data)
+            window, tail = data[:cut], data[cut:]
+            if collect_refs:
+                refs.extend(r.decode() for r in _merge_ref_re.findall(window))
+            count += len(_merge_cell_re.findall(window))
+        if tail:
+            if collect_refs:
+                refs.extend(r.decode() for r in _merge_ref_re.findall(tail))
+            count += len(_merge_cell_re.findall(tail))
+    return count, refs
+
+
+def inspect_workbook(file_path: Union[str, Path], count_merged: bool = False) -> List[Dict]:
+    """Describe every sheet of an xlsx workbook without loading it.
+
+    Each entry has name, index, state (visible/hidden), dimension, max_row,
+    max_column and - if `count_merged` - merged_ranges.
+    """
+    if not zipfile.is_zipfile(file_path):
+        return _inspect_with_openpyxl(file_path)
+
+    with zipfile.ZipFile(file_path) as zf:
+        sheets = _sheet_paths(zf)
+        for sheet in sheets:
+            dimension = _read_dimension(zf, sheet["path"]) if sheet["path"] else None
+            sheet["dimension"] = dimension
+            if dimension:
+                _, _, max_col, max_row = parse_range(dimension)
+                sheet["max_row"], sheet["max_column"] = max_row, max_col
+            else:
+                sheet["max_row"] = sheet["max_column"] = None
+            if count_merged and sheet["path"]:
+                sheet["merged_ranges"], _ = _scan_merged_ranges(zf, sheet["path"])
+    return sheets
+
+
+def read_merged_ranges(file_path: Union[str, Path], sheet_name: str) -> List[tuple]:
+    """Bounds (min_col, min_row, max_col, max_row) of every merged range of one sheet"""
+    if not zipfile.is_zipfile(file_path):
+        import openpyxl
+        wb = openpyxl.load_workbook(file_path)
+        return [mr.bounds for mr in wb[sheet_name].merged_cells.ranges]
+    with zipfile.ZipFile(file_path) as zf:
+        for sheet in _sheet_paths(zf):
+            if sheet["name"] == sheet_name and sheet["path"]:
+                _, refs = _scan_merged_ranges(zf, sheet["path"], collect_refs=True)
+                return [parse_range(ref) for ref in refs]
+    raise KeyError(f"Worksheet {sheet_name} does not exist.")
+
+
+def list_sheet_names(file_path: Union[str, Path]) -> List[str]:
+    """Sheet names in workbook order, read from xl/workbook.xml only"""
+    if not zipfile.is_zipfile(file_path):
+        return [s["name"] for s in _inspect_with_openpyxl(file_path)]
+    with zipfile.ZipFile(file_path) as zf:
+        return [s["name"] for s in _sheet_paths(zf)]
+
+
+def _inspect_with_openpyxl(file_path):
+    # Not an xlsx zip package: let openpyxl read it (or raise its usual error)
+    import openpyxl
+    wb = openpyxl.load_workbook(file_path, read_only=True)
+    try:
+        return [
+            {"name": ws.title, "index": i, "state": ws.sheet_state, "path": None,
+             "dimension": None, "max_row": ws.max_row, "max_column": ws.max_column}
+            for i, ws in enumerate(wb.worksheets)
+        ]
+    finally:
+        wb.close()
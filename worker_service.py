@@ -0,0 +1,420 @@
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Long-lived local worker that runs jobs from a SQLite-backed queue.
+#
+# The Streamlit app only enqueues jobs (cheap: sqlite3 is the only import
+# needed on that side). The worker runs up to `max_concurrent_jobs` of them at
+# a time, each in its own process, so profilers, environment settings and
+# module-level singletons are never shared between jobs and a crashing job
+# only takes itself down. Job processes are forked from a forkserver that has
+# pandas, openpyxl, thefuzz and boto3 imported and the Bedrock client built
+# already (see job_preload.py; spawned where fork is not available). Only one
+# worker runs per job database; a second one exits.
+#
+# A job is tried at most WORKER_MAX_JOB_ATTEMPTS times when the worker running
+# it dies; after that it fails instead of taking down the next worker too.
+# The worker logs to {JOB_LOG_DIR}/worker.log and each job to
+# {JOB_LOG_DIR}/job_{id}.log.
+#
+#   python worker_service.py --max-concurrent-jobs 2 --scheduling fifo
+#   python worker_service.py --enqueue my_params.json --priority 5
+
+DEFAULT_DB_PATH = os.getenv("FREIGHTIFY_JOB_DB", "jobs.db")
+DEFAULT_MAX_CONCURRENT_JOBS = int(os.getenv("WORKER_MAX_CONCURRENT_JOBS", "2"))
+# The app enqueues retries ahead of and warm-ups behind full jobs, so priority is the default
+DEFAULT_SCHEDULING = os.getenv("WORKER_SCHEDULING", "priority")
+WORKER_MAX_JOB_ATTEMPTS = int(os.getenv("WORKER_MAX_JOB_ATTEMPTS", "3"))
+JOB_LOG_DIR = os.getenv("FREIGHTIFY_JOB_LOG_DIR", "jobs")
+# Exit code of a job process whose failure is recorded in its status file
+JOB_FAILED_EXIT_CODE = 3
+
+HEARTBEAT_INTERVAL = 5      # seconds between worker heartbeats
+HEARTBEAT_STALE_AFTER = 30  # a worker silent for longer than this is considered dead
+POLL_INTERVAL = 1.0
+# workers row of a worker that has been started but has not registered yet
+LAUNCHING_WORKER_ID = "launching"
+
+# Jobs with a negative priority (background warm-ups) only run when nothing else is queued
+SCHEDULING_ORDER = {
+    "fifo": "priority < 0, id ASC",
+    "priority": "priority DESC, id ASC",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    params TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    worker_id TEXT,
+    enqueued_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_status_idx ON jobs(status, priority, id);
+CREATE TABLE IF NOT EXISTS workers (
+    worker_id TEXT PRIMARY KEY,
+    host TEXT,
+    pid INTEGER,
+    started_at REAL,
+    heartbeat_at REAL
+);
+"""
+
+
+def connect(db_path=DEFAULT_DB_PATH):
+    """Open the job database, creating the schema on first use"""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    if "attempts" not in {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}:
+        # Databases created before jobs counted their attempts
+        try:
+            conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            pass  # added by another process meanwhile
+    return conn
+
+
+def enqueue_job(params, priority=0, db_path=DEFAULT_DB_PATH):
+    """Add a job to the queue and return its id.
+
+    A real job for a file cancels the queued warm-up of the same file: the job
+    parses the workbook itself, so the warm-up would only take a slot and
+    parse it a second time.
+    """
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            cur = conn.execute(
+                "INSERT INTO jobs (params, priority, status, enqueued_at) VALUES (?, ?, 'queued', ?)",
+                (json.dumps(params, ensure_ascii=False), priority, time.time())
+            )
+            if params.get('mode') != 'warm' and params.get('file_path'):
+                conn.execute(
+                    """UPDATE jobs SET status = 'cancelled', finished_at = ?
+                       WHERE status = 'queued' AND json_extract(params, '$.mode') = 'warm'
+                         AND json_extract(params, '$.file_path') = ?""",
+                    (time.time(), params['file_path'])
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return cur.lastrowid
+    finally:
+        conn.close()
+
+
+def get_job(job_id, db_path=DEFAULT_DB_PATH):
+    """Return a job row as a dict, or None"""
+    conn = connect(db_path)
+    try:
+        conn.row_factory = sqlite3.Row
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+    finally:
+        conn.close()
+
+
+def queue_position(job_id, scheduling=DEFAULT_SCHEDULING, db_path=DEFAULT_DB_PATH):
+    """Number of queued jobs that will be picked up before `job_id` (None if not queued)"""
+    conn = connect(db_path)
+    try:
+        conn.row_factory = sqlite3.Row
+        order = SCHEDULING_ORDER[scheduling]
+        ids = [r["id"] for r in conn.execute(f"SELECT id FROM jobs WHERE status = 'queued' ORDER BY {order}")]
+        return ids.index(job_id) if job_id in ids else None
+    finally:
+        conn.close()
+
+
+def live_workers(conn):
+    """Ids of the workers (or worker launches) that have sent a heartbeat recently"""
+    cutoff = time.time() - HEARTBEAT_STALE_AFTER
+    return [r[0] for r in conn.execute("SELECT worker_id FROM workers WHERE heartbeat_at >= ?", (cutoff,))]
+
+
+def worker_is_alive(db_path=DEFAULT_DB_PATH):
+    """True if some worker has sent a heartbeat recently"""
+    conn = connect(db_path)
+    try:
+        return bool(live_workers(conn))
+    finally:
+        conn.close()
+
+
+def ensure_worker_running(db_path=DEFAULT_DB_PATH, scheduling=DEFAULT_SCHEDULING,
+                          max_concurrent_jobs=DEFAULT_MAX_CONCURRENT_JOBS):
+    """Start a detached worker process unless one is already heartbeating or starting.
+
+    The check and the start happen under the job database's write lock, and
+    the launch is recorded as a heartbeat, so two sessions (or two clicks
+    before the new worker's first heartbeat) never start two workers.
+    """
+    conn = connect(db_path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if live_workers(conn):
+                conn.execute("COMMIT")
+                return False
+            os.makedirs(JOB_LOG_DIR, exist_ok=True)
+            with open(os.path.join(JOB_LOG_DIR, "worker.log"), "ab") as log:
+                process = subprocess.Popen(
+                    [sys.executable, os.path.abspath(__file__), "--db", db_path, "--scheduling", scheduling,
+                     "--max-concurrent-jobs", str(max_concurrent_jobs)],
+                    stdout=log, stderr=subprocess.STDOUT,
+                    start_new_session=True
+                )
+            now = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO workers (worker_id, host, pid, started_at, heartbeat_at) VALUES (?, ?, ?, ?, ?)",
+                (LAUNCHING_WORKER_ID, socket.gethostname(), process.pid, now, now)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+    finally:
+        conn.close()
+
+
+def register_worker(conn, worker_id, started_at):
+    """Record this worker as the running one; False if another worker is already alive"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        others = [w for w in live_workers(conn) if w not in (worker_id, LAUNCHING_WORKER_ID)]
+        if not others:
+            conn.execute("DELETE FROM workers WHERE worker_id = ?", (LAUNCHING_WORKER_ID,))
+            heartbeat(conn, worker_id, started_at)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return not others
+
+
+def claim_next_job(conn, worker_id, scheduling=DEFAULT_SCHEDULING):
+    """Atomically move the next queued job to 'running' and return (id, params)"""
+    order = SCHEDULING_ORDER[scheduling]
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(
+            f"SELECT id, params FROM jobs WHERE status = 'queued' ORDER BY {order} LIMIT 1"
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        conn.execute(
+            "UPDATE jobs SET status = 'running', worker_id = ?, started_at = ?, attempts = attempts + 1 WHERE id = ?",
+            (worker_id, time.time(), row[0])
+        )
+        conn.execute("COMMIT")
+        return row[0], json.loads(row[1])
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def finish_job(conn, job_id, status, error=None):
+    conn.execute(
+        "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ?",
+        (status, time.time(), error, job_id)
+    )
+
+
+def write_job_error(params, error):
+    """Mark a job that could not report its own failure as failed in its status file"""
+    file_stem = params.get('file_stem')
+    if not file_stem or params.get('mode') == 'warm':
+        return
+    from progress import write_json_atomic
+    write_json_atomic(f"{file_stem}_status.json", {"status": "error", "error": error})
+
+
+def requeue_orphaned_jobs(conn, max_attempts=WORKER_MAX_JOB_ATTEMPTS):
+    """Put 'running' jobs of dead workers back on the queue, or fail them after `max_attempts`"""
+    orphaned = """status = 'running' AND (worker_id IS NULL OR worker_id NOT IN
+                  (SELECT worker_id FROM workers WHERE heartbeat_at >= ?))"""
+    cutoff = time.time() - HEARTBEAT_STALE_AFTER
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        given_up = conn.execute(
+            f"SELECT id, params, attempts FROM jobs WHERE {orphaned} AND attempts >= ?", (cutoff, max_attempts)
+        ).fetchall()
+        conn.execute(
+            f"""UPDATE jobs SET status = 'failed', finished_at = ?,
+                    error = 'Worker died during each of ' || attempts || ' attempts'
+                WHERE {orphaned} AND attempts >= ?""",
+            (time.time(), cutoff, max_attempts)
+        )
+        cur = conn.execute(
+            f"UPDATE jobs SET status = 'queued', worker_id = NULL, started_at = NULL WHERE {orphaned}",
+            (cutoff,)
+        )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if cur.rowcount:
+        print(f"♻️ Re-queued {cur.rowcount} orphaned job(s)")
+    for job_id, params, attempts in given_up:
+        print(f"❌ Job {job_id} failed: worker died during each of {attempts} attempts")
+        write_job_error(json.loads(params), f"The worker died during each of {attempts} attempts of this job")
+
+
+def run_job_process(params, log_path):
+    """Entry point of a job's process: output goes to the job's log, the exit code is the result"""
+    log = open(log_path, "a", encoding="utf-8", buffering=1)
+    # Also catches output of C extensions and child processes
+    os.dup2(log.fileno(), 1)
+    os.dup2(log.fileno(), 2)
+    sys.stdout = sys.stderr = log
+    from background_processor import run_job
+    sys.exit(0 if run_job(params) else JOB_FAILED_EXIT_CODE)
+
+
+def job_process_context():
+    """Forkserver with the heavy modules and the Bedrock client preloaded where available, else spawn"""
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("spawn")
+    ctx = multiprocessing.get_context("forkserver")
+    ctx.set_forkserver_preload(["job_preload"])
+    return ctx
+
+
+def heartbeat(conn, worker_id, started_at):
+    conn.execute(
+        """INSERT INTO workers (worker_id, host, pid, started_at, heartbeat_at) VALUES (?, ?, ?, ?, ?)
+           ON CONFLICT(worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at""",
+        (worker_id, socket.gethostname(), os.getpid(), started_at, time.time())
+    )
+
+
+def warm_up(ctx):
+    """Start the forkserver now, so its imports are done before the first job arrives"""
+    if ctx.get_start_method() == "forkserver":
+        from multiprocessing import forkserver
+        forkserver.ensure_running()
+
+
+def run_worker(db_path=DEFAULT_DB_PATH, max_concurrent_jobs=DEFAULT_MAX_CONCURRENT_JOBS,
+               scheduling=DEFAULT_SCHEDULING, poll_interval=POLL_INTERVAL):
+    """Main worker loop: claim queued jobs and run each in its own process"""
+    if scheduling not in SCHEDULING_ORDER:
+        raise ValueError(f"Unknown scheduling mode: {scheduling}")
+
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    started_at = time.time()
+    conn = connect(db_path)
+    conn_lock = threading.Lock()
+    os.makedirs(JOB_LOG_DIR, exist_ok=True)
+
+    # One worker per job database, or the concurrent job limit would be multiplied
+    if not register_worker(conn, worker_id, started_at):
+        print(f"👷 Another worker is already running on {db_path}, exiting")
+        return
+    requeue_orphaned_jobs(conn)
+
+    print(f"🔥 Warming up imports...")
+    ctx = job_process_context()
+    warm_up(ctx)
+    print(f"👷 Worker {worker_id} ready ({max_concurrent_jobs} concurrent job(s), {scheduling} scheduling)")
+
+    active = set()
+    active_lock = threading.Lock()
+
+    def execute(job_id, params):
+        log_path = os.path.join(JOB_LOG_DIR, f"job_{job_id}.log")
+        try:
+            process = ctx.Process(target=run_job_process, args=(params, log_path), name=f"job-{job_id}")
+            process.start()
+            process.join()
+            # Anything but a failure the job reported itself is a crash
+            ok, error = process.exitcode == 0, None
+            if process.exitcode == JOB_FAILED_EXIT_CODE:
+                error = f"Job failed, see status file and {log_path}"
+            elif not ok:
+                error = f"Job process exited with code {process.exitcode}, see {log_path}"
+                write_job_error(params, error)
+        except Exception:
+            ok, error = False, traceback.format_exc()
+        with conn_lock:
+            finish_job(conn, job_id, "completed" if ok else "failed", error)
+        with active_lock:
+            active.discard(job_id)
+        print(f"{'✅' if ok else '❌'} Job {job_id} finished")
+
+    last_heartbeat = 0.0
+    try:
+        with ThreadPoolExecutor(max_workers=max_concurrent_jobs) as executor:
+            while True:
+                now = time.time()
+                if now - last_heartbeat >= HEARTBEAT_INTERVAL:
+                    with conn_lock:
+                        heartbeat(conn, worker_id, started_at)
+                    last_heartbeat = now
+
+                claimed = None
+                with active_lock:
+                    has_capacity = len(active) < max_concurrent_jobs
+                if has_capacity:
+                    with conn_lock:
+                        claimed = claim_next_job(conn, worker_id, scheduling)
+
+                if claimed is None:
+                    time.sleep(poll_interval)
+                    continue
+
+                job_id, params = claimed
+                print(f"🚀 Starting job {job_id} ({params.get('file_stem', 'unknown')})")
+                with active_lock:
+                    active.add(job_id)
+                executor.submit(execute, job_id, params)
+    finally:
+        with conn_lock:
+            conn.execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Freightify local job worker")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="path of the SQLite job database")
+    parser.add_argument("--max-concurrent-jobs", type=int, default=DEFAULT_MAX_CONCURRENT_JOBS)
+    parser.add_argument("--scheduling", choices=sorted(SCHEDULING_ORDER), default=DEFAULT_SCHEDULING)
+    parser.add_argument("--enqueue", metavar="PARAMS_FILE", help="enqueue a params JSON file and exit")
+    parser.add_argument("--priority", type=int, default=0, help="priority of the enqueued job")
+    args = parser.parse_args()
+
+    if args.enqueue:
+        with open(args.enqueue, 'r', encoding='utf-8') as f:
+            params = json.load(f)
+        print(enqueue_job(params, priority=args.priority, db_path=args.db))
+        return
+
+    from background_processor import configure_utf8_stdio
+    configure_utf8_stdio()
+    # The log file is read while the worker runs
+    sys.stdout.reconfigure(line_buffering=True)
+    sys.stderr.reconfigure(line_buffering=True)
+    run_worker(db_path=args.db, max_concurrent_jobs=args.max_concurrent_jobs, scheduling=args.scheduling)
+
+
+if __name__ == "__main__":
+    main()